@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+import mmap
+import struct
+import weakref
+from abc import ABC, abstractmethod
+from array import array
+from typing import IO, Any
+
+from pgsn.json_codec import dag_document, term_class
+from pgsn.pgsn_term import Term, lazy_term
+
+
+# Binary codec of terms
+# The nodes of the compiled format (see json_codec.dag_document) in a compact encoding:
+#   magic, version
+#   strings: count, then the length and the UTF-8 bytes of each string
+#   classes: count, then for each class its name and the names of its fields, as string numbers
+#   root: node number
+#   nodes: count, then for each node its class number, its max_free_index plus one (0 if it is named)
+#          and the length of its fields, followed by the fields
+# Numbers are unsigned LEB128 varints.  A field is a one byte tag followed by its value.
+
+MAGIC = b'PGSN\x00'
+VERSION = 2
+
+_NONE, _FALSE, _TRUE, _INT, _NEG_INT, _FLOAT, _STR, _LIST, _DICT, _TERM = range(10)
+
+
+def is_binary(prefix: bytes) -> bool:
+    return bytes(prefix[:len(MAGIC)]) == MAGIC
+
+
+def is_binary_file(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return is_binary(f.read(len(MAGIC)))
+
+
+def _write_varint(out: bytearray, n: int):
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data, i: int) -> tuple[int, int]:
+    b = data[i]
+    if b < 0x80:
+        return b, i + 1
+    n = 0
+    shift = 0
+    while b >= 0x80:
+        n |= (b & 0x7f) << shift
+        shift += 7
+        i += 1
+        b = data[i]
+    return n | b << shift, i + 1
+
+
+class _Encoder:
+    def __init__(self):
+        self.strings: dict[str, int] = {}
+
+    def string(self, s: str) -> int:
+        n = self.strings.get(s)
+        if n is None:
+            n = len(self.strings)
+            self.strings[s] = n
+        return n
+
+    def value(self, out: bytearray, v: Any):
+        if v is None:
+            out.append(_NONE)
+        elif v is True:
+            out.append(_TRUE)
+        elif v is False:
+            out.append(_FALSE)
+        elif isinstance(v, int):
+            out.append(_INT if v >= 0 else _NEG_INT)
+            _write_varint(out, abs(v))
+        elif isinstance(v, float):
+            out.append(_FLOAT)
+            out += struct.pack('<d', v)
+        elif isinstance(v, str):
+            out.append(_STR)
+            _write_varint(out, self.string(v))
+        elif isinstance(v, (list, tuple)):
+            out.append(_LIST)
+            _write_varint(out, len(v))
+            for x in v:
+                self.value(out, x)
+        elif isinstance(v, dict):
+            out.append(_DICT)
+            _write_varint(out, len(v))
+            for k, x in v.items():
+                _write_varint(out, self.string(k))
+                self.value(out, x)
+        else:
+            raise TypeError(f'Object of type {type(v).__name__} cannot be written')
+
+    def reference(self, out: bytearray, position: int | None):
+        if position is None:
+            out.append(_NONE)
+        else:
+            out.append(_TERM)
+            _write_varint(out, position)
+
+
+def dumps(t: Term) -> bytes:
+    terms = []
+    document = dag_document(t, terms)
+    encoder = _Encoder()
+    classes: dict[str, int] = {}
+    class_table = bytearray()
+    nodes = bytearray()
+    fields = bytearray()
+    for node, u in zip(document['nodes'], terms):
+        name = node['type_name']
+        _, schema = term_class(name)
+        tag = classes.get(name)
+        if tag is None:
+            tag = len(classes)
+            classes[name] = tag
+            _write_varint(class_table, encoder.string(name))
+            _write_varint(class_table, len(schema))
+            for field_name, _, _ in schema:
+                _write_varint(class_table, encoder.string(field_name))
+        fields.clear()
+        for field_name, _, kind in schema:
+            v = node[field_name]
+            if kind == 'term':
+                encoder.reference(fields, v)
+            elif kind == 'terms':
+                fields.append(_LIST)
+                _write_varint(fields, len(v))
+                for position in v:
+                    encoder.reference(fields, position)
+            elif kind == 'map':
+                fields.append(_DICT)
+                _write_varint(fields, len(v))
+                for label, position in v.items():
+                    _write_varint(fields, encoder.string(label))
+                    encoder.reference(fields, position)
+            else:
+                encoder.value(fields, v)
+        _write_varint(nodes, tag)
+        _write_varint(nodes, 0 if u.is_named else u.max_free_index() + 1)
+        _write_varint(nodes, len(fields))
+        nodes += fields
+    out = bytearray(MAGIC)
+    _write_varint(out, VERSION)
+    _write_varint(out, len(encoder.strings))
+    for s in encoder.strings:
+        b = s.encode('utf-8')
+        _write_varint(out, len(b))
+        out += b
+    _write_varint(out, len(classes))
+    out += class_table
+    _write_varint(out, document['root'])
+    _write_varint(out, len(document['nodes']))
+    out += nodes
+    return bytes(out)
+
+
+def dump(t: Term, fp: IO[bytes]):
+    fp.write(dumps(t))
+
+
+# Reads the header, the values and the nodes.  Subclasses give the term of a node by its position.
+class _Decoder(ABC):
+    def __init__(self, data):
+        self.data = data
+        if not is_binary(data):
+            raise ValueError('not a binary PGSN term')
+        version, i = _read_varint(data, len(MAGIC))
+        if version != VERSION:
+            raise ValueError(f'unsupported binary format version {version}')
+        n, i = _read_varint(data, i)
+        self.string_offsets = array('Q')
+        for _ in range(n):
+            self.string_offsets.append(i)
+            length, i = _read_varint(data, i)
+            i += length
+        # the class of each class number, and its fields in the file as (constructor argument, kind)
+        self.classes = []
+        n, i = _read_varint(data, i)
+        for _ in range(n):
+            name, i = _read_varint(data, i)
+            cls, schema = term_class(self.string(name))
+            kinds = {field_name: (alias, kind) for field_name, alias, kind in schema}
+            count, i = _read_varint(data, i)
+            layout = []
+            for _ in range(count):
+                field_name, i = _read_varint(data, i)
+                field_name = self.string(field_name)
+                if field_name not in kinds:
+                    raise ValueError(f'unknown field {field_name} of {cls.__name__}')
+                layout.append(kinds[field_name])
+            self.classes.append((cls, layout))
+        self.root, i = _read_varint(data, i)
+        self.size, self.start = _read_varint(data, i)
+        if self.root >= self.size:
+            raise ValueError(f'root {self.root} is not a node')
+        # the node being read, which refers only to the nodes before it
+        self.position = 0
+
+    def string(self, n: int) -> str:
+        length, i = _read_varint(self.data, self.string_offsets[n])
+        return str(self.data[i:i + length], 'utf-8')
+
+    @abstractmethod
+    def term(self, position: int) -> Term:
+        pass
+
+    def value(self, i: int) -> tuple[Any, int]:
+        data = self.data
+        tag = data[i]
+        i += 1
+        if tag == _NONE:
+            return None, i
+        if tag == _FALSE:
+            return False, i
+        if tag == _TRUE:
+            return True, i
+        if tag == _INT or tag == _NEG_INT:
+            n, i = _read_varint(data, i)
+            return (n if tag == _INT else -n), i
+        if tag == _FLOAT:
+            return struct.unpack_from('<d', data, i)[0], i + 8
+        if tag == _STR:
+            n, i = _read_varint(data, i)
+            return self.string(n), i
+        if tag == _TERM:
+            n, i = _read_varint(data, i)
+            if n >= self.position:
+                raise ValueError(f'node {self.position} refers to node {n}')
+            return self.term(n), i
+        if tag == _LIST:
+            n, i = _read_varint(data, i)
+            values = []
+            for _ in range(n):
+                v, i = self.value(i)
+                values.append(v)
+            return values, i
+        if tag == _DICT:
+            n, i = _read_varint(data, i)
+            values = {}
+            for _ in range(n):
+                k, i = _read_varint(data, i)
+                values[self.string(k)], i = self.value(i)
+            return values, i
+        raise ValueError(f'unknown tag {tag} at {i - 1}')
+
+    # The class, the max_free_index and the constructor arguments of the node at i, and the next node
+    def node(self, i: int) -> tuple[type[Term], int, dict[str, Any], int]:
+        data = self.data
+        tag, i = _read_varint(data, i)
+        free, i = _read_varint(data, i)
+        length, i = _read_varint(data, i)
+        end = i + length
+        cls, layout = self.classes[tag]
+        kwargs = {}
+        for alias, kind in layout:
+            v, i = self.value(i)
+            kwargs[alias] = set(v) if kind == 'set' else v
+        if i != end:
+            raise ValueError(f'node {self.position} has a wrong length')
+        return cls, free - 1, kwargs, i
+
+
+class _Loader(_Decoder):
+    def __init__(self, data):
+        self.strings: dict[int, str] = {}
+        self.terms: list[Term] = []
+        super().__init__(data)
+
+    def string(self, n: int) -> str:
+        s = self.strings.get(n)
+        if s is None:
+            s = self.strings[n] = super().string(n)
+        return s
+
+    def term(self, position: int) -> Term:
+        return self.terms[position]
+
+    def load(self) -> Term:
+        i = self.start
+        for position in range(self.size):
+            self.position = position
+            cls, free, kwargs, i = self.node(i)
+            t = cls(**kwargs)
+            if not t.is_named:
+                object.__setattr__(t, '_max_free_index_cache', free)
+            self.terms.append(t)
+        return self.terms[self.root]
+
+
+def loads(data: bytes | bytearray | memoryview | mmap.mmap) -> Term:
+    with memoryview(data) as buffer:
+        return _Loader(buffer).load()
+
+
+# Files are memory-mapped when possible
+def load(fp: IO[bytes]) -> Term:
+    try:
+        fileno = fp.fileno()
+    except (AttributeError, OSError):
+        return loads(fp.read())
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as m:
+        return loads(m)
+
+
+class TermStore(_Decoder):
+    """A memory-mapped binary file whose terms are lazy terms (see pgsn_term.lazy_term).  A node is read
+    from the file when a field of its term is first read, e.g. by the evaluator or to_python, and its
+    subterms are lazy terms again.  The terms of the nodes are shared while they are alive, so the memory
+    used is that of the terms in use, and not of the file.
+
+    The file is open until the store is closed, after which its terms which are not loaded yet cannot be
+    loaded."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            super().__init__(memoryview(self._mmap))
+            # the offset of each node
+            self.offsets = array('Q')
+            data = self.data
+            i = self.start
+            for _ in range(self.size):
+                self.offsets.append(i)
+                _, i = _read_varint(data, i)
+                _, i = _read_varint(data, i)
+                length, i = _read_varint(data, i)
+                i += length
+            if i != len(data):
+                raise ValueError('the nodes do not end at the end of the file')
+        except Exception:
+            self.close()
+            raise
+        self._terms: weakref.WeakValueDictionary[int, Term] = weakref.WeakValueDictionary()
+
+    def close(self):
+        self.data.release()
+        self._mmap.close()
+
+    def __enter__(self) -> TermStore:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def root_term(self) -> Term:
+        return self.term(self.root)
+
+    def term(self, position: int) -> Term:
+        t = self._terms.get(position)
+        if t is None:
+            tag, i = _read_varint(self.data, self.offsets[position])
+            free, _ = _read_varint(self.data, i)
+            t = lazy_term(self.classes[tag][0], self, position)
+            # The max_free_index in the header, so that shift and substitution skip the term without loading it.
+            # A named term is written with 0, and the cache is reset when it is loaded.
+            object.__setattr__(t, '_max_free_index_cache', free - 1)
+            self._terms[position] = t
+        return t
+
+    def load(self, position: int) -> tuple[dict[str, Any], int]:
+        self.position = position
+        _, free, kwargs, _ = self.node(self.offsets[position])
+        return kwargs, free
+
+
+# The store of a binary file, whose root_term is the term of the file.  It is closed on exit of a with block.
+def open_store(path: str) -> TermStore:
+    return TermStore(path)
@@ -19,6 +19,7 @@ default_layout = {
 # (Imports and file loading function remain the same)
 try:
     from pgsn import dsl
+    from pgsn import binary_codec
     from pgsn import gsn
     from pgsn.pgsn_term import Term
 except ImportError as e:
@@ -67,25 +68,28 @@ def doc(input_file, term_name, doc_type, output, steps):
 
     click.echo(f"Generating '{output}' from '{input_file}'", err=True)
 
+    store = None
     try:
-        if input_file.endswith('.py'):
+        if binary_codec.is_binary_file(input_file):
+            click.echo("Opening binary file...", err=True)
+            store = dsl.binary_open(input_file)
+            term = store.root_term()
+
+        elif input_file.endswith('.py'):
             term = load_term_from_py_file(input_file, term_name)
             click.echo(f"Evaluating term '{term_name}'...", err=True)
-            evaluated_gsn = term.fully_eval(steps=steps)
 
         elif input_file.endswith('.json'):
-            with open(input_file, 'r', encoding='utf-8') as f:
-                json_str = f.read()
-
             click.echo("Validating and parsing JSON file...", err=True)
-            term = dsl.json_loads(json_str)
-            evaluated_gsn = term.fully_eval(steps=steps)
+            with open(input_file, 'r', encoding='utf-8') as f:
+                term = dsl.json_load(f)
 
         else:
-            click.echo(f"Error: Unsupported file type for '{input_file}'. Please use .py or .json.", err=True)
+            click.echo(f"Error: Unsupported file type for '{input_file}'. Please use .py, .json or a compiled binary file.", err=True)
             return
 
-        tree = gsn.gsn_tree(evaluated_gsn)
+        # The term is evaluated as it is converted, within the steps
+        tree = gsn.gsn_tree(term, steps=steps)
 
         if doc_type == 'plain':
             document = tree.show(stdout=False)
@@ -109,6 +113,10 @@ def doc(input_file, term_name, doc_type, output, steps):
 
     except Exception as e:
         click.echo(f"Error: {e}", err=True)
+    finally:
+        # The terms of a binary file are read from it until the output is written
+        if store is not None:
+            store.close()
 
 
 @cli.command()
@@ -124,30 +132,32 @@ def render(input_file, term_name, output, image_format, steps, layout):
 
     click.echo(f"Processing '{input_file}' to render a graph...", err=True)
 
+    store = None
     try:
-        if input_file.endswith('.py'):
+        if binary_codec.is_binary_file(input_file):
+            click.echo("Opening binary file...", err=True)
+            store = dsl.binary_open(input_file)
+            term = store.root_term()
+
+        elif input_file.endswith('.py'):
             term = load_term_from_py_file(input_file, term_name)
             click.echo(f"Evaluating term '{term_name}'...", err=True)
-            evaluated_gsn = term.fully_eval(steps=steps)
 
         elif input_file.endswith('.json'):
-            with open(input_file, 'r', encoding='utf-8') as f:
-                json_str = f.read()
-
             click.echo("Validating and parsing JSON file...", err=True)
-            term = dsl.json_loads(json_str)
-            evaluated_gsn = term.fully_eval(steps=steps)
+            with open(input_file, 'r', encoding='utf-8') as f:
+                term = dsl.json_load(f)
 
         else:
-            click.echo(f"Error: Unsupported file type for '{input_file}'. Please use .py or .json.", err=True)
+            click.echo(f"Error: Unsupported file type for '{input_file}'. Please use .py, .json or a compiled binary file.", err=True)
             return
 
-        dot = gsn.gsn_dot(evaluated_gsn, layout_attrs=layout)
+        dot = gsn.gsn_dot(term, layout_attrs=layout, steps=steps)
 
         if output:
             if output == '-':
                 # The user explicitly asked for stdout
-                dot = gsn.gsn_dot(evaluated_gsn)
+                dot = gsn.gsn_dot(term, steps=steps)
 
                 graph_data = dot.pipe(format=image_format)
                 click.echo(graph_data)
@@ -170,24 +180,36 @@ def render(input_file, term_name, output, image_format, steps, layout):
 
     except Exception as e:
         click.echo(f"Error: {e}", err=True)
+    finally:
+        # The terms of a binary file are read from it until the output is written
+        if store is not None:
+            store.close()
 
 
 @cli.command()
 @click.argument('python_file', type=click.Path(exists=True, dir_okay=False))
 @click.option('--term-name', default='main', help='The name of the Term object to evaluate.')
 @click.option('--output', '-o', default=None, help='The output JSON filename.')
-def compile(python_file, term_name, output, eval, steps):
+@click.option('--format', '-f', 'output_format', type=click.Choice(['tree', 'dag', 'binary']),
+              default='tree',
+              help='tree writes the whole term, dag writes each distinct subterm once, '
+                   'binary writes the dag in a compact binary encoding.')
+def compile(python_file, term_name, output, output_format):
     """Compiles a trusted PGSN (.py) file into a secure JSON format."""
     click.echo(f"Compiling '{python_file}' to JSON...", err=True)
 
     try:
         term = load_term_from_py_file(python_file, term_name)
 
-        click.echo(f"Saving JSON to '{output}'...", err=True)
-        json_str = dsl.json_dumps(term, indent=None, separators=(',', ':'))
-
-        with open(output, 'w', encoding='utf-8') as f:
-            f.write(json_str)
+        if output_format == 'binary':
+            click.echo(f"Saving binary to '{output}'...", err=True)
+            # The nameless term is evaluated without reading the whole file
+            with open(output, 'wb') as f:
+                dsl.binary_dump(term.remove_name(), f)
+        else:
+            click.echo(f"Saving JSON to '{output}'...", err=True)
+            with open(output, 'w', encoding='utf-8') as f:
+                dsl.json_dump(term, f, dag=output_format == 'dag', indent=None, separators=(',', ':'))
 
         click.echo("Done.")
 
@@ -1,12 +1,13 @@
 from __future__ import annotations
 
-import json
+from typing import IO
 
+from pgsn import json_codec, binary_codec
 from pgsn.pgsn_term import Term, Variable, Abs, String, Integer, \
     Boolean, List, Record, ConstMixin, PGSNClass, PGSNObject, DefineClass, \
     Instance, IsSubclass, Constant, Formatter, IfThenElse, Guard, Equal, \
-    Plus, Cons, Head, Tail, Index, Map, HasLabel, ListLabels, \
-    AddAttribute, RemoveAttribute, OverwriteRecord, to_python, json_term_converter
+    Plus, Cons, Head, Tail, Index, Fold, FoldLeft, FoldLeftStrict, Map, HasLabel, ListLabels, \
+    AddAttribute, RemoveAttribute, OverwriteRecord, to_python
 
 ###########################
 # DSL API
@@ -100,34 +101,27 @@ cons = Cons.named()
 head = Head.named()
 tail = Tail.named()
 index = Index.named()
-#fold = Fold.named()
+# foldr(f)(init)(list), foldl(f)(init)(list) and its strict variant foldl_strict
+foldr = Fold.named()
+fold = foldr
+foldl = FoldLeft.named()
+foldl_strict = FoldLeftStrict.named()
 map_term = Map.named()
 
-_elem = variable('elem')
-_list = variable('list')
-_acc = variable('acc')
-_foldr = variable('_foldr')
 empty: List = List.named(terms=tuple())
-_F = lambda_abs_vars((_foldr, _f, _acc, _list),
-                     if_then_else(equal(_list)(empty))
-                     (_acc)
-                     (_f(head(_list))(_foldr(_f)(_acc)(tail(_list))) )
-                     )
-foldr = fix(_F)
-fold = foldr
 
 _list1 = variable('list1')
 _list2 = variable('list2')
 concat = lambda_abs_vars(
     (_list1, _list2),
-    foldr(lambda_abs_vars((_elem, _acc), cons(_elem)(_acc)), _list2, _list1))
+    foldr(cons, _list2, _list1))
 
 list_all = lambda_abs_vars(
     (_x, _y),
     let(
         _f,
         lambda_abs_vars((_z, _w), boolean_and(_x(_z))(_w)),
-        fold(_f)(_y)(true)
+        fold(_f)(true)(_y)
     )
 )
 
@@ -136,7 +130,7 @@ def integer(i: int) -> Integer:
     return Integer.named(value=i)
 
 
-integer_sum = fold(plus)(integer(0))
+integer_sum = foldr(plus)(integer(0))
 
 
 # Record
@@ -198,15 +192,54 @@ is_instance = lambda_abs_vars((_obj, _class), is_subclass(instance(_obj))(_class
 instantiate = lambda_abs_vars((_class, _attrs), _class(_attrs))
 
 
-def python_value(obs: Term):
-    return to_python(obs)
+# obs is evaluated as it is converted, in at most steps steps
+def python_value(obs: Term, steps: int = 100000):
+    return to_python(obs, steps)
+
+
+# dag: writes the compiled format, in which each distinct subterm is written once
+# kwargs: indent, separators, ensure_ascii and sort_keys of json.dumps
+def json_dumps(t: Term, dag: bool = False, **kwargs) -> str:
+    if dag:
+        return json_codec.dumps_dag(t, **kwargs)
+    return json_codec.dumps(t, **kwargs)
 
 
-def json_dumps(t: Term, **kwargs) -> str:
-    d = json_term_converter.unstructure(t, unstructure_as=Term)
-    return json.dumps(d, **kwargs)
+def json_dump(t: Term, fp: IO[str], dag: bool = False, **kwargs):
+    if dag:
+        json_codec.dump_dag(t, fp, **kwargs)
+    else:
+        json_codec.dump(t, fp, **kwargs)
 
 
+# kwargs: options of json.loads
 def json_loads(s: str, **kwargs) -> Term:
-    d = json.loads(s, **kwargs)
-    return json_term_converter.structure(d, Term)
+    return json_codec.loads(s, **kwargs)
+
+
+# fp is read in chunks and parsed incrementally
+def json_load(fp: IO[str]) -> Term:
+    return json_codec.load(fp)
+
+
+def binary_dumps(t: Term) -> bytes:
+    return binary_codec.dumps(t)
+
+
+def binary_dump(t: Term, fp: IO[bytes]):
+    binary_codec.dump(t, fp)
+
+
+def binary_loads(data: bytes) -> Term:
+    return binary_codec.loads(data)
+
+
+# fp is memory-mapped if it is a file
+def binary_load(fp: IO[bytes]) -> Term:
+    return binary_codec.load(fp)
+
+
+# The store of a binary file, whose root_term() is the term of the file.  Its subterms are read from the
+# memory-mapped file when they are used, until the store is closed.
+def binary_open(path: str) -> binary_codec.TermStore:
+    return binary_codec.open_store(path)
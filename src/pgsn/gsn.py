@@ -68,9 +68,10 @@ GSN_TYPES = {"Goal", "Strategy", "Evidence", "Context", "Assumption"}
 # Term and to_python are assumed to be in your module
 # from your_module import Term, to_python
 
-def gsn_tree(root_term: pgsn.pgsn_term.Term) -> Tree:
+# root_term is evaluated as it is converted, in at most steps steps
+def gsn_tree(root_term: pgsn.pgsn_term.Term, steps: int = 100000) -> Tree:
     tree = Tree()
-    py_data = pgsn.dsl.python_value(root_term)
+    py_data = pgsn.dsl.python_value(root_term, steps)
 
     def _add_nodes(data, parent_id=None, key_name="root"):
 
@@ -143,12 +144,12 @@ GSN_SHAPES = {
 
 
 
-def gsn_dot(gsn: pgsn.pgsn_term.Term, layout_attrs: dict[str]=None) -> graphviz.Digraph:
+def gsn_dot(gsn: pgsn.pgsn_term.Term, layout_attrs: dict[str]=None, steps: int = 100000) -> graphviz.Digraph:
     """
     treelib.Treeオブジェクトを受け取り、GSNのルールに基づいて
     ノードの形をカスタマイズしたdotファイルを生成する。
     """
-    tree = gsn_tree(gsn)
+    tree = gsn_tree(gsn, steps)
 
     # GSNのタイプとgraphvizのshapeを対応付ける辞書
     default_layout = {
@@ -0,0 +1,704 @@
+from __future__ import annotations
+
+import codecs
+import itertools
+import json
+import re
+import types
+import typing
+from collections.abc import Callable, Iterable, Iterator
+from json.decoder import scanstring
+from json.encoder import encode_basestring, encode_basestring_ascii
+from typing import IO, Any, TypeAlias
+
+from attrs import fields
+
+from pgsn.persistent import PMap, PVector
+from pgsn.pgsn_term import Term
+
+
+# JSON codec of terms
+# Reads and writes the format of json_term_converter: a term is an object of the init fields of its class,
+# in declaration order, followed by its class name under "type_name".
+# Both directions use explicit stacks, so the depth of a term is not limited by the recursion limit.
+# load parses a file incrementally, building the term while it is read.
+#
+# The compiled (DAG) format writes each distinct subterm once:
+#   {"format": "pgsn-dag", "version": 1, "nodes": [...], "root": i}
+# A node is written as in the tree format, except that its subterms are the positions of earlier nodes.
+
+
+def _subclasses(cls: type):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from _subclasses(sub)
+
+
+# isinstance of the abstract Term goes through ABCMeta, so the answer is cached for each class
+_is_term_class: dict[type, bool] = {}
+
+
+def _is_term(x: Any) -> bool:
+    cls = x.__class__
+    is_term = _is_term_class.get(cls)
+    if is_term is None:
+        is_term = issubclass(cls, Term)
+        _is_term_class[cls] = is_term
+    return is_term
+
+
+def _is_term_type(tp: Any) -> bool:
+    return isinstance(tp, type) and issubclass(tp, Term)
+
+
+# 'term' for a term or None, 'terms' for a tuple of terms, 'map' for a dict of terms, 'set' for a set,
+# which is written as a list, and None for the other values
+def _field_kind(tp: Any) -> str | None:
+    origin = typing.get_origin(tp)
+    args = typing.get_args(tp)
+    if origin is set:
+        return 'set'
+    if origin is tuple and args and _is_term_type(args[0]):
+        return 'terms'
+    if origin is dict and len(args) == 2 and _is_term_type(args[1]):
+        return 'map'
+    if _is_term_type(tp) or origin in (types.UnionType, typing.Union) and any(_is_term_type(a) for a in args):
+        return 'term'
+    return None
+
+
+Schema: TypeAlias = tuple[tuple[str, str, str | None], ...]
+# (field name, constructor argument, kind) for each init field
+_schemas: dict[type, Schema] = {}
+
+
+def _schema(cls: type) -> Schema:
+    schema = _schemas.get(cls)
+    if schema is None:
+        hints = typing.get_type_hints(cls)
+        schema = tuple((a.name, a.alias, _field_kind(hints.get(a.name))) for a in fields(cls) if a.init)
+        _schemas[cls] = schema
+    return schema
+
+
+_classes: dict[str, tuple[type, Schema]] = {}
+
+
+def term_class(name: str) -> tuple[type, Schema]:
+    entry = _classes.get(name)
+    if entry is None:
+        for cls in _subclasses(Term):
+            if cls.__name__ == name:
+                entry = (cls, _schema(cls))
+                _classes[name] = entry
+                break
+        else:
+            raise ValueError(f'unknown term type {name}')
+    return entry
+
+
+# Encoding
+# The text of each class is cut into fragments between the values of its fields, once for each depth.
+# A term met a second time is captured as one string, and later occurrences reuse the string.
+
+
+class _Capture:
+    __slots__ = ('key', 'start')
+
+    def __init__(self, key, start: int):
+        self.key = key
+        self.start = start
+
+
+def _key(k: Any) -> str:
+    if isinstance(k, str):
+        return k
+    if k is None or isinstance(k, (bool, int, float)):
+        return json.dumps(k)
+    raise TypeError(f'keys must be str, int, float, bool or None, not {type(k).__name__}')
+
+
+def iterencode(t: Term, *, indent: int | str | None = None, separators: tuple[str, str] | None = None,
+               ensure_ascii: bool = True, sort_keys: bool = False, chunk_size: int = 4096) -> Iterator[str]:
+    """Yields the JSON text of `t` in chunks, as `json.dumps(json_term_converter.unstructure(t))` would."""
+    if isinstance(indent, int):
+        indent = ' ' * indent
+    if separators is None:
+        item_separator, key_separator = (', ', ': ') if indent is None else (',', ': ')
+    else:
+        item_separator, key_separator = separators
+    encode_str = encode_basestring_ascii if ensure_ascii else encode_basestring
+    newlines = ['\n']
+    templates = {}
+
+    def newline(depth: int) -> str:
+        if indent is None:
+            return ''
+        while len(newlines) <= depth:
+            newlines.append('\n' + indent * len(newlines))
+        return newlines[depth]
+
+    # The fragment before each field, and the closing one
+    def template(cls: type, depth: int) -> tuple[str, tuple[tuple[str, str], ...]]:
+        names = [name for name, _, _ in _schema(cls)] + ['type_name']
+        if sort_keys:
+            names.sort()
+        fragment = '{'
+        members = []
+        for i, name in enumerate(names):
+            fragment += (item_separator if i else '') + newline(depth + 1) + encode_str(name) + key_separator
+            if name == 'type_name':
+                fragment += encode_str(cls.__name__)
+            else:
+                members.append((name, fragment))
+                fragment = ''
+        return fragment + newline(depth) + '}', tuple(members)
+
+    # The text of a value without nested members, otherwise None
+    def literal(x: Any) -> str | None:
+        cls = x.__class__
+        if cls is str:
+            return encode_str(x)
+        if cls is bool:
+            return 'true' if x else 'false'
+        if x is None:
+            return 'null'
+        if cls is int:
+            return int.__repr__(x)
+        if _is_term(x):
+            return None
+        if cls is PMap or cls is dict:
+            return None if x else '{}'
+        if cls is PVector or cls is list:
+            return None if x else '[]'
+        if isinstance(x, str):
+            return encode_str(x)
+        if isinstance(x, (int, float)):
+            return json.dumps(x)
+        if isinstance(x, (dict, PMap)):
+            return None if x else '{}'
+        if isinstance(x, (list, tuple, PVector, set, frozenset)):
+            return None if x else '[]'
+        raise TypeError(f'Object of type {cls.__name__} is not JSON serializable')
+
+    buffer = []
+    write = buffer.append
+    texts = {}
+    seen = set()
+    capturing = 0
+    stack = [(t, 0)]
+    while stack:
+        item = stack.pop()
+        if item.__class__ is str:
+            write(item)
+            continue
+        if item.__class__ is _Capture:
+            text = ''.join(buffer[item.start:])
+            del buffer[item.start:]
+            write(text)
+            texts[item.key] = text
+            capturing -= 1
+            continue
+        v, depth = item
+        parts = []
+        if _is_term(v):
+            key = id(v) if indent is None else (id(v), depth)
+            text = texts.get(key)
+            if text is not None:
+                write(text)
+                continue
+            if key in seen:
+                stack.append(_Capture(key, len(buffer)))
+                capturing += 1
+            else:
+                seen.add(key)
+            cls = v.__class__
+            entry = templates.get((cls, depth))
+            if entry is None:
+                entry = template(cls, depth)
+                templates[(cls, depth)] = entry
+            closing, members = entry
+            text = ''
+            for name, fragment in members:
+                x = getattr(v, name)
+                cls = x.__class__
+                if cls is bool:
+                    text += fragment + ('true' if x else 'false')
+                    continue
+                if cls is dict and not x:
+                    text += fragment + '{}'
+                    continue
+                s = literal(x)
+                if s is None:
+                    parts.append(text + fragment)
+                    parts.append((x, depth + 1))
+                    text = ''
+                else:
+                    text += fragment + s
+            parts.append(text + closing)
+        elif v.__class__ is PMap or isinstance(v, dict):
+            items = list(v.items())
+            if sort_keys:
+                items.sort(key=lambda kv: kv[0])
+            text = '{'
+            for i, (k, x) in enumerate(items):
+                text += (item_separator if i else '') + newline(depth + 1) + encode_str(_key(k)) + key_separator
+                s = literal(x)
+                if s is None:
+                    parts.append(text)
+                    parts.append((x, depth + 1))
+                    text = ''
+                else:
+                    text += s
+            parts.append(text + newline(depth) + '}')
+        else:
+            text = '['
+            for i, x in enumerate(v):
+                text += (item_separator if i else '') + newline(depth + 1)
+                s = literal(x)
+                if s is None:
+                    parts.append(text)
+                    parts.append((x, depth + 1))
+                    text = ''
+                else:
+                    text += s
+            parts.append(text + newline(depth) + ']')
+        parts.reverse()
+        stack.extend(parts)
+        if len(buffer) > chunk_size and not capturing:
+            yield ''.join(buffer)
+            buffer.clear()
+    yield ''.join(buffer)
+
+
+def dumps(t: Term, **kwargs) -> str:
+    return ''.join(iterencode(t, **kwargs))
+
+
+def dump(t: Term, fp: IO[str], **kwargs):
+    for chunk in iterencode(t, **kwargs):
+        fp.write(chunk)
+
+
+# Decoding
+# Objects are turned into terms bottom up.  Terms without meta_info which are written more than once
+# in the document are built once and shared, as hash_cons does.
+
+
+_missing = object()
+
+
+def _term_hook(shared: dict) -> Callable[[dict], Any]:
+    def hook(d: dict) -> Any:
+        name = d.get('type_name')
+        if name.__class__ is not str:
+            return d
+        cls, schema = _classes.get(name) or term_class(name)
+        key = None
+        if not d.get('meta_info'):
+            # subterms are compared by identity, as equality ignores meta_info
+            key = [name]
+            for field_name, _, _ in schema:
+                v = d.get(field_name, _missing)
+                if v.__class__ is dict:
+                    v = tuple((k, id(x) if _is_term(x) else x) for k, x in v.items())
+                elif v.__class__ is list:
+                    v = tuple(id(x) if _is_term(x) else x for x in v)
+                elif _is_term(v):
+                    v = id(v)
+                key.append(v)
+            key = tuple(key)
+            try:
+                t = shared.get(key)
+            except TypeError:
+                key = t = None
+            if t is not None:
+                return t
+        kwargs = {}
+        for field_name, alias, kind in schema:
+            v = d.get(field_name, _missing)
+            # a missing field takes its default
+            if v is _missing:
+                continue
+            kwargs[alias] = set(v) if kind == 'set' else v
+        t = cls(**kwargs)
+        if key is not None:
+            shared[key] = t
+        return t
+    return hook
+
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_number = re.compile(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?')
+_numeral = re.compile(r'[-+.\deE]*')
+_constants = {'true': True, 'false': False, 'null': None,
+              'NaN': float('nan'), 'Infinity': float('inf'), '-Infinity': float('-inf')}
+
+
+# `"key":` followed by the value if it is a scalar or an empty container, without escapes in the strings
+_member = re.compile(r'"([^"\\\x00-\x1f]*)"[ \t\n\r]*:[ \t\n\r]*'
+                     r'(?:(?:"([^"\\\x00-\x1f]*)"|(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?|(true)|(false)|(null)|'
+                     r'(\{[ \t\n\r]*\})|(\[[ \t\n\r]*\]))[ \t\n\r]*)?')
+
+
+# The parser of json, without recursion, for documents nested deeper than the recursion limit.
+# The document is read from chunks, and only its part from the token being read is kept.
+def _parse(chunks: Iterable[str], object_hook: Callable[[dict], Any]) -> Any:
+    chunks = iter(chunks)
+    s = ''
+    i = 0
+
+    # Appends the next chunk to s, dropping the part before i.  False at the end of the document.
+    def more() -> bool:
+        nonlocal s, i
+        for chunk in chunks:
+            if chunk:
+                s = s[i:] + chunk
+                i = 0
+                return True
+        return False
+
+    def skip_whitespace():
+        nonlocal i
+        i = _whitespace.match(s, i).end()
+        while i == len(s) and more():
+            i = _whitespace.match(s, i).end()
+
+    def string() -> str:
+        nonlocal i
+        while True:
+            try:
+                v, i = scanstring(s, i + 1)
+                return v
+            except json.JSONDecodeError as e:
+                # the string or an escape in it may continue in the next chunk
+                if not (e.msg.startswith('Unterminated') or e.pos >= len(s) - 6) or not more():
+                    raise
+
+    # Reads `"key":` at i
+    def member_key() -> str:
+        nonlocal i
+        if not s.startswith('"', i):
+            raise json.JSONDecodeError('Expecting property name enclosed in double quotes', s, i)
+        key = string()
+        if i == len(s) or s[i] <= ' ':
+            skip_whitespace()
+        if not s.startswith(':', i):
+            raise json.JSONDecodeError("Expecting ':' delimiter", s, i)
+        i += 1
+        if i == len(s) or s[i] <= ' ':
+            skip_whitespace()
+        return key
+
+    # Reads the members at i as long as their values are read by _member.  Returns the key of the next
+    # member, whose value is at i, or None at the end of the object.
+    def members(d: dict) -> str | None:
+        nonlocal i
+        while True:
+            m = _member.match(s, i)
+            # a value is complete if it is followed by the end of the member
+            if m is None or m.end() == len(s) or m.lastindex > 1 and s[m.end()] not in ',}':
+                return member_key()
+            i = m.end()
+            key = m.group(1)
+            kind = m.lastindex
+            if kind == 1:
+                return key
+            if kind == 2:
+                d[key] = m.group(2)
+            elif kind <= 5:
+                integer, fraction, exponent = m.group(3, 4, 5)
+                d[key] = float(integer + (fraction or '') + (exponent or '')) if fraction or exponent \
+                    else int(integer)
+            elif kind == 6:
+                d[key] = True
+            elif kind == 7:
+                d[key] = False
+            elif kind == 8:
+                d[key] = None
+            elif kind == 9:
+                d[key] = object_hook({})
+            else:
+                d[key] = []
+            if s[i] != ',':
+                return None
+            i += 1
+            if i == len(s) or s[i] <= ' ':
+                skip_whitespace()
+
+    # Containers being read are kept on a stack of [container, key of the next member].
+    stack = []
+    if i == len(s) or s[i] <= ' ':
+        skip_whitespace()
+    expect_value = True
+    while True:
+        if i >= len(s):
+            raise json.JSONDecodeError('Expecting value', s, i)
+        c = s[i]
+        if expect_value:
+            if c == '{':
+                i += 1
+                if i == len(s) or s[i] <= ' ':
+                    skip_whitespace()
+                if s.startswith('}', i):
+                    v = object_hook({})
+                    i += 1
+                else:
+                    d = {}
+                    key = members(d)
+                    stack.append([d, key])
+                    expect_value = key is not None
+                    continue
+            elif c == '[':
+                i += 1
+                if i == len(s) or s[i] <= ' ':
+                    skip_whitespace()
+                if s.startswith(']', i):
+                    v = []
+                    i += 1
+                else:
+                    stack.append([[], None])
+                    continue
+            elif c == '"':
+                v = string()
+            else:
+                # a number or a literal, which is at most 9 characters long, may continue in the next chunk
+                while (len(s) - i < 9 or _numeral.match(s, i).end() == len(s)) and more():
+                    pass
+                m = _number.match(s, i)
+                if m is not None:
+                    integer, fraction, exponent = m.groups()
+                    v = float(m.group()) if fraction or exponent else int(integer)
+                    i = m.end()
+                else:
+                    for literal, constant in _constants.items():
+                        if s.startswith(literal, i):
+                            v = constant
+                            i += len(literal)
+                            break
+                    else:
+                        raise json.JSONDecodeError('Expecting value', s, i)
+        else:
+            frame = stack[-1]
+            container = frame[0]
+            if c == ',':
+                i += 1
+                if i == len(s) or s[i] <= ' ':
+                    skip_whitespace()
+                if container.__class__ is dict:
+                    frame[1] = members(container)
+                    expect_value = frame[1] is not None
+                else:
+                    expect_value = True
+                continue
+            if c == '}' and container.__class__ is dict:
+                v = object_hook(container)
+            elif c == ']' and container.__class__ is list:
+                v = container
+            else:
+                raise json.JSONDecodeError("Expecting ',' delimiter", s, i)
+            stack.pop()
+            i += 1
+        # v is a complete value
+        if i == len(s) or s[i] <= ' ':
+            skip_whitespace()
+        if not stack:
+            break
+        frame = stack[-1]
+        if frame[0].__class__ is dict:
+            frame[0][frame[1]] = v
+        else:
+            frame[0].append(v)
+        expect_value = False
+    if i != len(s):
+        raise json.JSONDecodeError('Extra data', s, i)
+    return v
+
+
+# Compiled format
+
+DAG_FORMAT = 'pgsn-dag'
+DAG_VERSION = 1
+_dag_header = re.compile(r'\s*\{\s*"format"\s*:\s*"' + DAG_FORMAT + '"')
+
+
+def _subterms(t: Term, schema: Schema) -> Iterator[Term]:
+    for name, _, kind in schema:
+        if kind == 'term':
+            v = getattr(t, name)
+            if v is not None:
+                yield v
+        elif kind == 'terms':
+            yield from getattr(t, name)
+        elif kind == 'map':
+            yield from getattr(t, name).values()
+
+
+def dag_document(t: Term, terms: list[Term] | None = None) -> dict:
+    """The compiled form of `t` as a JSON value.  Nodes come after their subterms, and the subterms
+    that are written identically, meta_info included, share one node.  If `terms` is given, a term of
+    each node is appended to it."""
+    nodes = []
+    # id of a visited term -> its node, and the contents of a node -> its position
+    positions = {}
+    node_positions = {}
+    stack = [t]
+    while stack:
+        u = stack[-1]
+        if id(u) in positions:
+            stack.pop()
+            continue
+        cls = u.__class__
+        schema = _schema(cls)
+        pending = [v for v in _subterms(u, schema) if id(v) not in positions]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        node = {}
+        key = [cls.__name__]
+        for name, _, kind in schema:
+            v = getattr(u, name)
+            if kind == 'term':
+                k = v = None if v is None else positions[id(v)]
+            elif kind == 'terms':
+                v = [positions[id(x)] for x in v]
+                k = tuple(v)
+            elif kind == 'map':
+                v = {label: positions[id(x)] for label, x in v.items()}
+                k = tuple(v.items())
+            elif kind == 'set':
+                v = list(v)
+                k = tuple(v)
+            else:
+                k = (json.dumps(v) if v else '') if isinstance(v, (dict, list)) else v
+            node[name] = v
+            key.append(k)
+        node['type_name'] = cls.__name__
+        key = tuple(key)
+        position = node_positions.get(key)
+        if position is None:
+            position = len(nodes)
+            nodes.append(node)
+            node_positions[key] = position
+            if terms is not None:
+                terms.append(u)
+        positions[id(u)] = position
+    return {'format': DAG_FORMAT, 'version': DAG_VERSION, 'nodes': nodes, 'root': positions[id(t)]}
+
+
+# kwargs are those of json.dumps
+def dumps_dag(t: Term, **kwargs) -> str:
+    return json.dumps(dag_document(t), **kwargs)
+
+
+def dump_dag(t: Term, fp: IO[str], **kwargs):
+    fp.write(dumps_dag(t, **kwargs))
+
+
+# Nodes are turned into terms as they are read, and a node is an object with a "type_name"
+def _dag_hook(terms: list[Term]) -> Callable[[dict], Any]:
+    def term(position: int) -> Term:
+        if not 0 <= position < len(terms):
+            raise ValueError(f'node {len(terms)} refers to node {position}')
+        return terms[position]
+
+    def hook(node: dict) -> Any:
+        name = node.get('type_name')
+        if name.__class__ is not str:
+            return node
+        cls, schema = _classes.get(name) or term_class(name)
+        kwargs = {}
+        for field_name, alias, kind in schema:
+            v = node.get(field_name, _missing)
+            if v is _missing:
+                continue
+            if kind == 'term':
+                v = None if v is None else term(v)
+            elif kind == 'terms':
+                v = [term(x) for x in v]
+            elif kind == 'map':
+                v = {label: term(x) for label, x in v.items()}
+            elif kind == 'set':
+                v = set(v)
+            kwargs[alias] = v
+        t = cls(**kwargs)
+        terms.append(t)
+        return t
+    return hook
+
+
+def _dag_root(document: Any, terms: list[Term]) -> Term:
+    if not isinstance(document, dict) or document.get('format') != DAG_FORMAT \
+            or document.get('version') != DAG_VERSION:
+        raise ValueError('unsupported compiled format')
+    root = document.get('root')
+    if not isinstance(root, int) or not 0 <= root < len(terms):
+        raise ValueError(f'root {root} is not a node')
+    return terms[root]
+
+
+def _tree_root(t: Any) -> Term:
+    if not isinstance(t, Term):
+        raise ValueError('JSON document is not a term')
+    return t
+
+
+# An object_hook or object_pairs_hook in kwargs is applied to each object before it is turned into a term
+def _hook_kwargs(hook: Callable[[dict], Any], kwargs: dict) -> dict:
+    kwargs = dict(kwargs)
+    object_hook = kwargs.pop('object_hook', None)
+    pairs_hook = kwargs.pop('object_pairs_hook', None)
+    if pairs_hook is not None:
+        user_hook, wrap = pairs_hook, 'object_pairs_hook'
+    elif object_hook is not None:
+        user_hook, wrap = object_hook, 'object_hook'
+    else:
+        kwargs['object_hook'] = hook
+        return kwargs
+
+    def chained(o):
+        v = user_hook(o)
+        return hook(v) if isinstance(v, dict) else v
+    kwargs[wrap] = chained
+    return kwargs
+
+
+# kwargs are passed to json.loads
+def loads(s: str | bytes, **kwargs) -> Term:
+    if isinstance(s, (bytes, bytearray)):
+        s = s.decode('utf-8')
+    if _dag_header.match(s):
+        terms = []
+        return _dag_root(json.loads(s, **_hook_kwargs(_dag_hook(terms), kwargs)), terms)
+    try:
+        t = json.loads(s, **_hook_kwargs(_term_hook({}), kwargs))
+    except RecursionError:
+        # the incremental parser has none of the options of json.loads
+        if kwargs:
+            raise
+        t = _parse((s,), _term_hook({}))
+    return _tree_root(t)
+
+
+# fp is read in chunks of chunk_size and parsed incrementally into the term, so that neither its text
+# nor the parsed document is held in memory with the term
+def load(fp: IO[str] | IO[bytes], chunk_size: int = 1 << 16) -> Term:
+    chunks = iter(lambda: fp.read(chunk_size), '')
+    head = fp.read(chunk_size)
+    if isinstance(head, bytes):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        head = decoder.decode(head)
+        chunks = itertools.chain((decoder.decode(b) for b in iter(lambda: fp.read(chunk_size), b'')),
+                                 (decoder.decode(b'', final=True),))
+    # enough of the document to tell the compiled format
+    while len(head.lstrip()) < 32:
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        head += chunk
+    chunks = itertools.chain((head,), chunks)
+    if _dag_header.match(head):
+        terms = []
+        return _dag_root(_parse(chunks, _dag_hook(terms)), terms)
+    return _tree_root(_parse(chunks, _term_hook({})))
@@ -0,0 +1,414 @@
+from __future__ import annotations
+
+import sys
+
+from attrs import field, frozen
+
+from pgsn.pgsn_term import Term, Variable, Abs, App, Builtin, List, Record, PGSNClass, PGSNObject, fix_combinator, \
+    Equal, Formatter, IsSubclass, LambdaInterpreterError
+
+
+# Environment machine (Krivine style)
+# A beta step pushes the argument on the environment instead of substituting it into the body.
+# Terms are only rebuilt when a builtin looks at its arguments, and when the normal form is read back.
+
+
+# A variable bound outside of the evaluated term.
+# Levels count binders from the outside, so they are stable when the machine goes under a binder.
+class Level:
+    __slots__ = ('level',)
+
+    def __init__(self, level: int):
+        self.level = level
+
+
+# Under call-by-need, `value` and `normal` are updated once the thunk has been reduced.
+class Thunk:
+    __slots__ = ('term', 'env', 'value', 'normal')
+
+    def __init__(self, term: Term, env: Env):
+        self.term = term
+        self.env = env
+        self.value = None
+        self.normal = None
+
+
+# The thunk of fix f, whose term is f applied to the thunk itself.
+# It is read back as fix f, since instantiating the back-reference would never end.
+class FixPoint(Thunk):
+    __slots__ = ('f',)
+
+    def __init__(self, f: Thunk, env: Env):
+        super().__init__(App.nameless(t1=Suspension.nameless(thunk=f), t2=Suspension.nameless(thunk=self)), env)
+        self.f = f
+
+
+# Linked list of Thunk | Level.
+# Indices beyond the entries refer to the variables bound outside, counted from `base`.
+class Env:
+    __slots__ = ('entry', 'rest', 'size', 'base')
+
+    def __init__(self, entry, rest: Env | None, size: int, base: int):
+        self.entry = entry
+        self.rest = rest
+        self.size = size
+        self.base = base
+
+    @classmethod
+    def empty(cls, base: int) -> Env:
+        return cls(None, None, 0, base)
+
+    def extend(self, entry: Thunk | Level) -> Env:
+        return Env(entry, self, self.size + 1, self.base)
+
+    # An empty environment at the current depth leaves terms as they are
+    def is_identity(self, depth: int) -> bool:
+        return self.size == 0 and self.base == depth
+
+    def lookup(self, num: int) -> Thunk | Level:
+        if num >= self.size:
+            return Level(self.base - 1 - (num - self.size))
+        env = self
+        for _ in range(num):
+            env = env.rest
+        return env.entry
+
+
+# Weak head normal forms
+class Closure:
+    __slots__ = ('term', 'env')
+
+    def __init__(self, term: Abs, env: Env):
+        self.term = term
+        self.env = env
+
+
+# Builtins and data (List, Record, ...) whose children live in env
+class Data:
+    __slots__ = ('term', 'env')
+
+    def __init__(self, term: Builtin, env: Env):
+        self.term = term
+        self.env = env
+
+
+# Application of a variable bound outside
+class Stuck:
+    __slots__ = ('head', 'args')
+
+    def __init__(self, head: Level, args: list[Thunk]):
+        self.head = head
+        self.args = args
+
+
+# Builtin application which does not reduce.  `term` is already normal at `depth`.
+class Neutral:
+    __slots__ = ('term', 'depth')
+
+    def __init__(self, term: Term, depth: int):
+        self.term = term
+        self.depth = depth
+
+
+
+# Marks a shared thunk under evaluation.  Entering it again means that the reduction loops.
+_BLACKHOLE = object()
+
+
+# A thunk put inside a term, so that builtins can move unevaluated arguments around.
+# It never appears in the terms returned by the machine.
+@frozen
+class Suspension(Term):
+    thunk: Thunk = field()
+
+    def _eval_or_none(self):
+        raise LambdaInterpreterError('Suspended term escaped the machine', self)
+
+    def _free_variables(self) -> set[str]:
+        return set()
+
+    def _free_indices(self) -> set[int]:
+        return set()
+
+    # A suspension depends on its environment, so terms containing one are never treated as closed
+    def _max_free_index(self) -> int:
+        return sys.maxsize
+
+    def _nameless(self, images: list[Term]) -> Term:
+        return self
+
+
+def suspend(term: Term, env: Env) -> Term:
+    if isinstance(term, Suspension):
+        return term
+    return Suspension.nameless(thunk=Thunk(term, env))
+
+
+def thunk_of(term: Term, env: Env) -> Thunk:
+    if isinstance(term, Suspension):
+        return term.thunk
+    return Thunk(term, env)
+
+
+# Thunk of an argument.  A variable shares the thunk it refers to, instead of making a chain of thunks.
+def argument(term: Term, env: Env) -> Thunk:
+    if isinstance(term, Variable):
+        entry = env.lookup(term.num)
+        if isinstance(entry, Thunk):
+            return entry
+    return thunk_of(term, env)
+
+
+def map_children(term: Term, visit) -> Term:
+    match term:
+        case List():
+            return term.evolve(terms=tuple(visit(t) for t in term.terms))
+        case Record():
+            return term.evolve(attributes=term.attributes().map_values(visit))
+        case PGSNClass():
+            inherit = None if term.inherit is None else visit(term.inherit)
+            return term.evolve(inherit=inherit,
+                               defaults=term.defaults().map_values(visit),
+                               methods=term.methods().map_values(visit))
+        case PGSNObject():
+            return term.evolve(instance=visit(term.instance),
+                               attributes=term.attributes().map_values(visit),
+                               methods=term.methods().map_values(visit))
+        case _:
+            return term
+
+
+# These builtins compare their arguments deeply, so they see fully instantiated terms.
+_DEEP_BUILTINS = (Equal, Formatter, IsSubclass)
+
+
+# sharing=False is call-by-name: a thunk is reduced every time it is used.
+# sharing=True is call-by-need: a thunk is reduced at most once and its value is shared.
+class Machine:
+
+    def __init__(self, steps: int, sharing: bool = False):
+        self.steps = steps
+        self.sharing = sharing
+
+    def tick(self, term: Term):
+        self.steps -= 1
+        if self.steps < 0:
+            raise LambdaInterpreterError('Reduction did not terminate', term)
+
+    def force(self, thunk: Thunk, depth: int):
+        if not self.sharing:
+            return self.whnf(thunk.term, thunk.env, depth)
+        if thunk.value is _BLACKHOLE:
+            raise LambdaInterpreterError('Reduction did not terminate', self.instantiate(thunk, None, depth))
+        if thunk.value is None:
+            thunk.value = _BLACKHOLE
+            thunk.value = self.whnf(thunk.term, thunk.env, depth)
+        return thunk.value
+
+    # fix F as a thunk of F rec, where rec is the thunk itself.  The recursion goes through the
+    # back-reference instead of unfolding the combinator.
+    def fix_point(self, f: Thunk, depth: int) -> Thunk:
+        return FixPoint(f, Env.empty(depth))
+
+    # The value of a thunk if it has already been reduced
+    def shared_value(self, thunk: Thunk):
+        if not self.sharing or thunk.value is _BLACKHOLE:
+            return None
+        return thunk.value
+
+    # Term at depth, for a normal term computed at another depth
+    def at(self, neutral: Neutral, depth: int) -> Term:
+        if depth == neutral.depth:
+            return neutral.term
+        return self.instantiate_term(neutral.term, Env.empty(neutral.depth), depth)
+
+    def whnf(self, term: Term, env: Env, depth: int):
+        stack = []
+        while True:
+            match term:
+                case Suspension() | Variable():
+                    entry = term.thunk if isinstance(term, Suspension) else env.lookup(term.num)
+                    if isinstance(entry, Level):
+                        return Stuck(entry, stack[::-1])
+                    if not self.sharing:
+                        term, env = entry.term, entry.env
+                        continue
+                    value = self.force(entry, depth)
+                    match value:
+                        case Closure() | Data():
+                            term, env = value.term, value.env
+                        case Stuck():
+                            return Stuck(value.head, value.args + stack[::-1])
+                        case Neutral():
+                            if not stack:
+                                return value
+                            term, env = self.at(value, depth), Env.empty(depth)
+                case App():
+                    stack.append(argument(term.t2, env))
+                    term = term.t1
+                case Abs():
+                    if not stack:
+                        return Closure(term, env)
+                    self.tick(term)
+                    if term == fix_combinator:
+                        rec = self.fix_point(stack.pop(), depth)
+                        term, env = rec.term, rec.env
+                        continue
+                    env = env.extend(stack.pop())
+                    term = term.t
+                case Builtin():
+                    if not stack:
+                        return Data(term, env)
+                    args = stack[::-1]
+                    reduced = self.reduce_builtin(term, env, args, depth)
+                    if isinstance(reduced, Neutral):
+                        return reduced
+                    term, rest = reduced
+                    self.tick(term)
+                    env = Env.empty(depth)
+                    stack = rest[::-1]
+                case _:
+                    raise LambdaInterpreterError('Unknown term', term)
+
+    # Mirrors Context.reduce_or_none: the rule is tried first, then on the normalized head,
+    # then after each argument, from left to right, is reduced to weak head and normal form.
+    def reduce_builtin(self, head: Builtin, env: Env, args: list[Thunk], depth: int):
+        deep = isinstance(head, _DEEP_BUILTINS)
+
+        def present(thunk: Thunk, value=None) -> Term:
+            if deep:
+                return self.instantiate(thunk, value, depth)
+            return self.present(thunk, value, depth)
+
+        head_thunk = Thunk(head, env)
+        head_form = present(head_thunk)
+        forms = [present(a) for a in args]
+
+        def applied():
+            reduced = head_form.apply_args_or_none(tuple(forms))
+            if reduced is None:
+                return None
+            return reduced, args[head_form.arity:]
+
+        reduced = applied()
+        if reduced is not None:
+            return reduced
+        head_form = self.normalize(head_thunk, depth)
+        reduced = applied()
+        if reduced is not None:
+            return reduced
+        for i, arg in enumerate(args):
+            forms[i] = present(arg, self.force(arg, depth))
+            reduced = applied()
+            if reduced is not None:
+                return reduced
+            forms[i] = self.normalize(arg, depth)
+            reduced = applied()
+            if reduced is not None:
+                return reduced
+        stuck = head_form
+        for form in forms:
+            stuck = App.nameless(t1=stuck, t2=form)
+        return Neutral(stuck, depth)
+
+    # The outermost constructor of a thunk, with suspended children.
+    # This is what Context.reduce_or_none would see at the same point.
+    def present(self, thunk: Thunk, value, depth: int) -> Term:
+        if value is None:
+            value = self.shared_value(thunk)
+        match value:
+            case None:
+                term, env = thunk.term, thunk.env
+                match term:
+                    case Suspension():
+                        return self.present(term.thunk, None, depth)
+                    case Variable():
+                        entry = env.lookup(term.num)
+                        if isinstance(entry, Level):
+                            return suspend(term, env)
+                        return self.present(entry, None, depth)
+                    case App():
+                        return App.nameless(t1=suspend(term.t1, env), t2=suspend(term.t2, env))
+                    case Builtin():
+                        if term.is_closed or env.is_identity(depth):
+                            return term
+                        return map_children(term, lambda t: suspend(t, env))
+                    case _:
+                        return suspend(term, env)
+            case Data():
+                if value.term.is_closed or value.env.is_identity(depth):
+                    return value.term
+                return map_children(value.term, lambda t: suspend(t, value.env))
+            case Neutral():
+                return self.at(value, depth)
+            case _:
+                return Suspension.nameless(thunk=thunk)
+
+    # Read back a thunk without evaluating it, as substitution would have produced it.
+    def instantiate(self, thunk: Thunk, value, depth: int) -> Term:
+        if isinstance(thunk, FixPoint):
+            return App.nameless(t1=fix_combinator, t2=self.instantiate(thunk.f, None, depth))
+        if value is None:
+            value = self.shared_value(thunk)
+        match value:
+            case None:
+                return self.instantiate_term(thunk.term, thunk.env, depth)
+            case Closure():
+                return self.instantiate_term(value.term, value.env, depth)
+            case Data():
+                return self.instantiate_term(value.term, value.env, depth)
+            case Stuck():
+                t = Variable.nameless(num=depth - 1 - value.head.level)
+                for arg in value.args:
+                    t = App.nameless(t1=t, t2=self.instantiate(arg, None, depth))
+                return t
+            case Neutral():
+                return self.at(value, depth)
+
+    def instantiate_term(self, term: Term, env: Env, depth: int) -> Term:
+        if term.is_closed:
+            return term
+        match term:
+            case Suspension():
+                return self.instantiate(term.thunk, None, depth)
+            case Variable():
+                entry = env.lookup(term.num)
+                if isinstance(entry, Level):
+                    return term.evolve(num=depth - 1 - entry.level)
+                return self.instantiate(entry, None, depth)
+            case App():
+                return term.evolve(t1=self.instantiate_term(term.t1, env, depth),
+                                   t2=self.instantiate_term(term.t2, env, depth))
+            case Abs():
+                body_env = env.extend(Level(depth))
+                return term.evolve(t=self.instantiate_term(term.t, body_env, depth + 1))
+            case _:
+                return map_children(term, lambda t: self.instantiate_term(t, env, depth))
+
+    def normalize(self, thunk: Thunk, depth: int) -> Term:
+        if not self.sharing:
+            return self.readback(self.force(thunk, depth), depth)
+        if thunk.normal is None:
+            thunk.normal = Neutral(self.readback(self.force(thunk, depth), depth), depth)
+        return self.at(thunk.normal, depth)
+
+    def readback(self, value, depth: int) -> Term:
+        match value:
+            case Closure():
+                body = Thunk(value.term.t, value.env.extend(Level(depth)))
+                return value.term.evolve(t=self.normalize(body, depth + 1))
+            case Data():
+                return map_children(value.term,
+                                    lambda t: self.normalize(thunk_of(t, value.env), depth))
+            case Stuck():
+                t = Variable.nameless(num=depth - 1 - value.head.level)
+                for arg in value.args:
+                    t = App.nameless(t1=t, t2=self.normalize(arg, depth))
+                return t
+            case Neutral():
+                return self.at(value, depth)
+
+
+def normal_form(term: Term, steps: int = 100000, sharing: bool = False) -> Term:
+    t = term if not term.is_named else term.remove_name()
+    return Machine(steps, sharing=sharing).normalize(Thunk(t, Env.empty(0)), 0)
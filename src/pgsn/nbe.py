@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+from pgsn.pgsn_term import Term, Variable, Abs, App, Builtin, ConstMixin, LambdaInterpreterError, fix_combinator
+from pgsn.machine import Machine, Env, Thunk, Level, Closure, Data, Stuck, Neutral, Suspension, argument, \
+    _DEEP_BUILTINS
+
+
+# Normalization by evaluation
+# The nameless terms of the program are compiled into Python closures, which are kept on the terms
+# (see Term.compiled), so that a term is compiled once however many times it is evaluated.
+# Running a closure produces the semantic values of pgsn.machine (closures, data, neutral terms),
+# and the machine reads them back into a normal form.
+#
+# A code is called as code(compiler, term, env, stack, depth) and returns either a value,
+# or a pair (term, env) to be run next with the same stack, so that tail calls do not
+# consume the Python stack.  The terms made by builtins during the reduction are not compiled.
+# They are interpreted node by node until they reach a term of the program.
+
+
+def _variable_code(m: Compiler, term: Variable, env: Env, stack: list[Thunk], depth: int):
+    entry = env.lookup(term.num)
+    if type(entry) is Level:
+        return Stuck(entry, stack[::-1])
+    return m.enter(entry, stack, depth)
+
+
+def _abs_code(m: Compiler, term: Abs, env: Env, stack: list[Thunk], depth: int):
+    if not stack:
+        return Closure(term, env)
+    m.tick(term)
+    return term.t, env.extend(stack.pop())
+
+
+def _fix_code(m: Compiler, term: Abs, env: Env, stack: list[Thunk], depth: int):
+    if not stack:
+        return Closure(term, env)
+    m.tick(term)
+    rec = m.fix_point(stack.pop(), depth)
+    return rec.term, rec.env
+
+
+def _builtin_code(m: Compiler, term: Builtin, env: Env, stack: list[Thunk], depth: int):
+    return m.apply_builtin(term, env, stack, depth)
+
+
+# The code shared by the terms of the same kind, except applications
+def _code_of(term: Term):
+    match term:
+        case Variable():
+            return _variable_code
+        case Abs() if term == fix_combinator:
+            return _fix_code
+        case Abs():
+            return _abs_code
+        case Builtin():
+            return _builtin_code
+        case _:
+            raise LambdaInterpreterError('Unknown term', term)
+
+
+# An application pushes the arguments of its spine and runs the head.
+# A variable argument shares the thunk it refers to, as pgsn.machine.argument.
+def _compile(term: Term):
+    if not isinstance(term, App):
+        return _code_of(term)
+    args = []
+    head = term
+    while isinstance(head, App):
+        arg = head.t2
+        args.append((arg, arg.num if isinstance(arg, Variable) else None))
+        head = head.t1
+    head_code = head._code_cache
+
+    def code(m, term, env, stack, depth):
+        for arg, num in args:
+            if num is not None:
+                entry = env.lookup(num)
+                if type(entry) is not Level:
+                    stack.append(entry)
+                    continue
+            stack.append(Thunk(arg, env))
+        return head_code(m, head, env, stack, depth)
+    return code
+
+
+class Compiler(Machine):
+
+    def __init__(self, steps: int, sharing: bool = True):
+        super().__init__(steps, sharing=sharing)
+        # Normal forms of the closed terms met during this reduction
+        self.normal_forms: dict[Term, Term] = {}
+
+    # A term made by a builtin, which has no code
+    def interpret(self, term: Term, env: Env, stack: list[Thunk], depth: int):
+        match term:
+            case Suspension():
+                return self.enter(term.thunk, stack, depth)
+            case App():
+                stack.append(argument(term.t2, env))
+                return term.t1, env
+            case _:
+                return _code_of(term)(self, term, env, stack, depth)
+
+    def apply_builtin(self, term: Builtin, env: Env, stack: list[Thunk], depth: int):
+        if not stack:
+            return Data(term, env)
+        args = stack[::-1]
+        stack.clear()
+        reduced = self.reduce_builtin(term, env, args, depth)
+        if isinstance(reduced, Neutral):
+            return reduced
+        result, rest = reduced
+        self.tick(result)
+        if isinstance(result, Builtin) and not rest:
+            return Data(result, Env.empty(depth))
+        stack.extend(rest[::-1])
+        return result, Env.empty(depth)
+
+    # Machine.reduce_builtin for a builtin without children, which is its own normal form.
+    # A constant argument is used as it is, and the rule is not tried again on the same forms.
+    def reduce_builtin(self, head: Builtin, env: Env, args: list[Thunk], depth: int):
+        if not isinstance(head, ConstMixin):
+            return super().reduce_builtin(head, env, args, depth)
+        deep = isinstance(head, _DEEP_BUILTINS)
+
+        def present(thunk: Thunk, value=None) -> Term:
+            form = self.constant(thunk, value)
+            if form is not None:
+                return form
+            if deep:
+                return self.instantiate(thunk, value, depth)
+            return self.present(thunk, value, depth)
+
+        forms = [present(a) for a in args]
+        reduced = head.apply_args_or_none(tuple(forms))
+        if reduced is not None:
+            return reduced, args[head.arity:]
+        for i, arg in enumerate(args):
+            form = present(arg, self.force(arg, depth))
+            if form is not forms[i]:
+                forms[i] = form
+                reduced = head.apply_args_or_none(tuple(forms))
+                if reduced is not None:
+                    return reduced, args[head.arity:]
+            form = self.normalize(arg, depth)
+            if form is not forms[i]:
+                forms[i] = form
+                reduced = head.apply_args_or_none(tuple(forms))
+                if reduced is not None:
+                    return reduced, args[head.arity:]
+        stuck = head
+        for form in forms:
+            stuck = App.nameless(t1=stuck, t2=form)
+        return Neutral(stuck, depth)
+
+    # The form of an argument which is a constant, or None.  It is the same presented or instantiated.
+    def constant(self, thunk: Thunk, value) -> Term | None:
+        # The recursion thunk of fix is instantiated as fix f
+        if type(thunk) is not Thunk:
+            return None
+        if value is None:
+            value = self.shared_value(thunk)
+        if value is None:
+            term = thunk.term
+        elif type(value) is Data:
+            term = value.term
+        else:
+            return None
+        return term if isinstance(term, ConstMixin) else None
+
+    # A constant is its own normal form.  A closed term does not depend on its environment,
+    # so its normal form is computed once.
+    def normalize(self, thunk: Thunk, depth: int) -> Term:
+        form = self.constant(thunk, None)
+        if form is not None:
+            return form
+        term = thunk.term
+        if not term.is_closed:
+            return super().normalize(thunk, depth)
+        if term.is_normal_form():
+            return term
+        form = self.normal_forms.get(term)
+        if form is None:
+            form = super().normalize(thunk, depth)
+            self.normal_forms[term] = form
+            if form is term:
+                term.mark_normal_form()
+        return form
+
+    def enter(self, thunk: Thunk, stack: list[Thunk], depth: int):
+        if not self.sharing:
+            return thunk.term, thunk.env
+        value = self.force(thunk, depth)
+        match value:
+            case Closure():
+                if not stack:
+                    return value
+                return value.term, value.env
+            case Data():
+                return self.apply_builtin(value.term, value.env, stack, depth)
+            case Stuck():
+                return Stuck(value.head, value.args + stack[::-1])
+            case Neutral():
+                if not stack:
+                    return value
+                return self.at(value, depth), Env.empty(depth)
+
+    def whnf(self, term: Term, env: Env, depth: int):
+        stack = []
+        result = term, env
+        while type(result) is tuple:
+            term, env = result
+            code = term._code_cache
+            if code is None:
+                result = self.interpret(term, env, stack, depth)
+            else:
+                result = code(self, term, env, stack, depth)
+        return result
+
+
+def normal_form(term: Term, steps: int = 100000) -> Term:
+    t = term if not term.is_named else term.remove_name()
+    t.compiled(_compile)
+    return Compiler(steps).normalize(Thunk(t, Env.empty(0)), 0)
@@ -0,0 +1,626 @@
+from __future__ import annotations
+
+from collections.abc import ItemsView, Iterable, Mapping, Sequence, ValuesView
+from typing import Any
+
+
+# Persistent vector
+# A skew binary random access list (Okasaki, Purely Functional Data Structures, 9.3).
+# The elements are stored in a list of complete binary trees of sizes 2^k - 1, in preorder.
+# cons, head and tail are O(1), indexing, update and drop are O(log n), and
+# the updated vectors share all the untouched trees with the original.
+
+
+class _Tree:
+    __slots__ = ('value', 'left', 'right', 'max', 'max_key')
+
+    def __init__(self, value, left: _Tree | None = None, right: _Tree | None = None):
+        self.value = value
+        self.left = left
+        self.right = right
+        # The maximum of max_key over the tree
+        self.max = None
+        self.max_key = None
+
+
+# Trees of the vector, from the first elements to the last ones
+class _Spine:
+    __slots__ = ('size', 'tree', 'rest')
+
+    def __init__(self, size: int, tree: _Tree, rest: _Spine | None):
+        self.size = size
+        self.tree = tree
+        self.rest = rest
+
+
+def _tree_lookup(tree: _Tree, size: int, i: int):
+    while i > 0:
+        half = size // 2
+        if i <= half:
+            tree, i = tree.left, i - 1
+        else:
+            tree, i = tree.right, i - 1 - half
+        size = half
+    return tree.value
+
+
+def _tree_update(tree: _Tree, size: int, i: int, value) -> _Tree:
+    if i == 0:
+        return _Tree(value, tree.left, tree.right)
+    half = size // 2
+    if i <= half:
+        return _Tree(tree.value, _tree_update(tree.left, half, i - 1, value), tree.right)
+    return _Tree(tree.value, tree.left, _tree_update(tree.right, half, i - 1 - half, value))
+
+
+def _tree_iter(tree: _Tree):
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        yield t.value
+        if t.left is not None:
+            stack.append(t.right)
+            stack.append(t.left)
+
+
+# The elements in the reverse of the preorder: the right subtree, the left subtree, then the value
+def _tree_reversed(tree: _Tree):
+    stack = [(tree, False)]
+    while stack:
+        t, expanded = stack.pop()
+        if expanded or t.left is None:
+            yield t.value
+        else:
+            stack.append((t, True))
+            stack.append((t.left, False))
+            stack.append((t.right, False))
+
+
+def _tree_max(tree: _Tree, key):
+    if tree.max_key is not key:
+        m = key(tree.value)
+        if tree.left is not None:
+            m = max(m, _tree_max(tree.left, key), _tree_max(tree.right, key))
+        tree.max = m
+        tree.max_key = key
+    return tree.max
+
+
+def _tree_map(tree: _Tree, fn) -> _Tree:
+    if tree.left is None:
+        return _Tree(fn(tree.value))
+    return _Tree(fn(tree.value), _tree_map(tree.left, fn), _tree_map(tree.right, fn))
+
+
+def _tree_eq(t1: _Tree, t2: _Tree) -> bool:
+    if t1 is t2:
+        return True
+    if not t1.value == t2.value:
+        return False
+    if t1.left is None:
+        return True
+    return _tree_eq(t1.left, t2.left) and _tree_eq(t1.right, t2.right)
+
+
+class PVector(Sequence):
+    __slots__ = ('_spine', '_len', '_hash')
+
+    def __init__(self, items: Iterable = ()):
+        if isinstance(items, PVector):
+            spine, length = items._spine, items._len
+        else:
+            spine, length = None, 0
+            for item in reversed(tuple(items)):
+                spine = _cons(item, spine)
+                length += 1
+        self._spine = spine
+        self._len = length
+        self._hash = None
+
+    @classmethod
+    def _make(cls, spine: _Spine | None, length: int) -> PVector:
+        v = cls.__new__(cls)
+        v._spine = spine
+        v._len = length
+        v._hash = None
+        return v
+
+    # Used as an attrs converter
+    @classmethod
+    def from_iterable(cls, items: Iterable) -> PVector:
+        # Exact type test, which is faster than isinstance on an abstract base class
+        if type(items) is PVector:
+            return items
+        return cls(items)
+
+    def cons(self, item) -> PVector:
+        return self._make(_cons(item, self._spine), self._len + 1)
+
+    def head(self):
+        if self._spine is None:
+            raise IndexError('head of an empty vector')
+        return self._spine.tree.value
+
+    def tail(self) -> PVector:
+        return self.drop(1)
+
+    def drop(self, n: int) -> PVector:
+        if n <= 0:
+            return self
+        if n >= self._len:
+            return self._make(None, 0)
+        spine, k = self._spine, n
+        while k >= spine.size:
+            k -= spine.size
+            spine = spine.rest
+        # Drop k elements from the first tree, splitting it on the way down
+        while k > 0:
+            half = spine.size // 2
+            tree, rest = spine.tree, spine.rest
+            k -= 1
+            if k >= half:
+                k -= half
+                spine = _Spine(half, tree.right, rest)
+            else:
+                spine = _Spine(half, tree.left, _Spine(half, tree.right, rest))
+        return self._make(spine, self._len - n)
+
+    def set(self, i: int, item) -> PVector:
+        i = self._index(i)
+        spines = []
+        spine = self._spine
+        while i >= spine.size:
+            i -= spine.size
+            spines.append(spine)
+            spine = spine.rest
+        new_spine = _Spine(spine.size, _tree_update(spine.tree, spine.size, i, item), spine.rest)
+        for s in reversed(spines):
+            new_spine = _Spine(s.size, s.tree, new_spine)
+        return self._make(new_spine, self._len)
+
+    # The elements mapped by fn, in a vector of the same shape
+    def map(self, fn) -> PVector:
+        spines = []
+        spine = self._spine
+        while spine is not None:
+            spines.append(spine)
+            spine = spine.rest
+        new_spine = None
+        for s in reversed(spines):
+            new_spine = _Spine(s.size, _tree_map(s.tree, fn), new_spine)
+        return self._make(new_spine, self._len)
+
+    # The maximum of key over the elements.  It is cached in the trees, which are shared between
+    # vectors, for the last key used.
+    def max(self, key, default):
+        m = default
+        spine = self._spine
+        while spine is not None:
+            m = max(m, _tree_max(spine.tree, key))
+            spine = spine.rest
+        return m
+
+    def _index(self, i: int) -> int:
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError('vector index out of range')
+        return i
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._len)
+            if step == 1 and stop == self._len:
+                return self.drop(start)
+            return PVector(tuple(self)[i])
+        i = self._index(i)
+        spine = self._spine
+        while i >= spine.size:
+            i -= spine.size
+            spine = spine.rest
+        return _tree_lookup(spine.tree, spine.size, i)
+
+    def __iter__(self):
+        spine = self._spine
+        while spine is not None:
+            yield from _tree_iter(spine.tree)
+            spine = spine.rest
+
+    def __reversed__(self):
+        trees = []
+        spine = self._spine
+        while spine is not None:
+            trees.append(spine.tree)
+            spine = spine.rest
+        for tree in reversed(trees):
+            yield from _tree_reversed(tree)
+
+    def __add__(self, other: Iterable) -> PVector:
+        return PVector(tuple(self) + tuple(other))
+
+    def __radd__(self, other: Iterable) -> PVector:
+        v = self
+        for item in reversed(tuple(other)):
+            v = v.cons(item)
+        return v
+
+    # Vectors of the same length have trees of the same sizes
+    def __eq__(self, other: Any):
+        if isinstance(other, PVector):
+            if self is other:
+                return True
+            if self._len != other._len:
+                return False
+            s1, s2 = self._spine, other._spine
+            while s1 is not None:
+                if not _tree_eq(s1.tree, s2.tree):
+                    return False
+                s1, s2 = s1.rest, s2.rest
+            return True
+        if isinstance(other, tuple):
+            return self._len == len(other) and all(x == y for x, y in zip(self, other))
+        return NotImplemented
+
+    # Same as the hash of the tuple, which compares equal
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(tuple(self))
+        return self._hash
+
+    def __repr__(self):
+        return f'{type(self).__name__}({tuple(self)!r})'
+
+
+def _cons(item, spine: _Spine | None) -> _Spine:
+    if spine is not None and spine.rest is not None and spine.size == spine.rest.size:
+        second = spine.rest
+        return _Spine(2 * spine.size + 1, _Tree(item, spine.tree, second.tree), second.rest)
+    return _Spine(1, _Tree(item), spine)
+
+
+# Persistent map
+# A hash array mapped trie (Bagwell, Ideal Hash Trees).  Each level of the trie consumes 5 bits of
+# the hash of the key, so that lookup, update and removal are O(log n) and updated maps share all the
+# untouched nodes.  The iteration order is the insertion order, as for dict: the entries are also kept
+# in a PVector, the latest first, where an entry with the sequence number seq is at next_seq - 1 - seq.
+# Deleted entries are None in the vector until they are the most of it.  The sum of the hashes of the
+# items is cached in each node, so that the hash of an updated map is computed along the updated path.
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_MASK = (1 << 64) - 1
+
+
+class _Entry:
+    __slots__ = ('key', 'value', 'seq', 'hash')
+
+    def __init__(self, key, value, seq: int, h: int):
+        self.key = key
+        self.value = value
+        self.seq = seq
+        self.hash = h
+
+
+class _Node:
+    __slots__ = ('bitmap', 'children', 'items_hash')
+
+    def __init__(self, bitmap: int, children: tuple):
+        self.bitmap = bitmap
+        self.children = children
+        self.items_hash = None
+
+
+# Entries whose keys have the same hash
+class _Collision:
+    __slots__ = ('hash', 'entries', 'items_hash')
+
+    def __init__(self, h: int, entries: tuple[_Entry, ...]):
+        self.hash = h
+        self.entries = entries
+        self.items_hash = None
+
+
+_empty_node = _Node(0, ())
+
+
+def _key_hash(key) -> int:
+    return hash(key) & _HASH_MASK
+
+
+def _find(node, h: int, key) -> _Entry | None:
+    shift = 0
+    while True:
+        if type(node) is _Collision:
+            for e in node.entries:
+                if e.key == key:
+                    return e
+            return None
+        bit = 1 << ((h >> shift) & _MASK)
+        if not node.bitmap & bit:
+            return None
+        child = node.children[(node.bitmap & (bit - 1)).bit_count()]
+        if type(child) is _Entry:
+            return child if child.hash == h and child.key == key else None
+        node = child
+        shift += _BITS
+
+
+def _merge(e1: _Entry, e2: _Entry, shift: int):
+    if e1.hash == e2.hash:
+        return _Collision(e1.hash, (e1, e2))
+    b1 = (e1.hash >> shift) & _MASK
+    b2 = (e2.hash >> shift) & _MASK
+    if b1 == b2:
+        return _Node(1 << b1, (_merge(e1, e2, shift + _BITS),))
+    return _Node((1 << b1) | (1 << b2), (e1, e2) if b1 < b2 else (e2, e1))
+
+
+def _assoc(node, shift: int, entry: _Entry):
+    if isinstance(node, _Collision):
+        if node.hash == entry.hash:
+            return _Collision(node.hash, tuple(e for e in node.entries if e.key != entry.key) + (entry,))
+        node = _Node(1 << ((node.hash >> shift) & _MASK), (node,))
+    bit = 1 << ((entry.hash >> shift) & _MASK)
+    idx = (node.bitmap & (bit - 1)).bit_count()
+    children = node.children
+    if not node.bitmap & bit:
+        return _Node(node.bitmap | bit, children[:idx] + (entry,) + children[idx:])
+    child = children[idx]
+    if isinstance(child, _Entry):
+        if child.hash == entry.hash and child.key == entry.key:
+            new_child = entry
+        else:
+            new_child = _merge(child, entry, shift + _BITS)
+    else:
+        new_child = _assoc(child, shift + _BITS, entry)
+    return _Node(node.bitmap, children[:idx] + (new_child,) + children[idx + 1:])
+
+
+# The key must be in the node.  None is returned if the node becomes empty.
+def _without(node, shift: int, h: int, key):
+    if isinstance(node, _Collision):
+        entries = tuple(e for e in node.entries if e.key != key)
+        return entries[0] if len(entries) == 1 else _Collision(node.hash, entries)
+    bit = 1 << ((h >> shift) & _MASK)
+    idx = (node.bitmap & (bit - 1)).bit_count()
+    children = node.children
+    child = children[idx]
+    new_child = None if isinstance(child, _Entry) else _without(child, shift + _BITS, h, key)
+    if new_child is None:
+        if node.bitmap == bit:
+            return None
+        return _Node(node.bitmap & ~bit, children[:idx] + children[idx + 1:])
+    if isinstance(new_child, _Node) and len(new_child.children) == 1 \
+            and isinstance(new_child.children[0], _Entry):
+        new_child = new_child.children[0]
+    return _Node(node.bitmap, children[:idx] + (new_child,) + children[idx + 1:])
+
+
+# The node with each entry e replaced by entries[id(e)]
+def _replace_entries(node, entries: dict[int, _Entry]):
+    if isinstance(node, _Collision):
+        return _Collision(node.hash, tuple([entries[id(e)] for e in node.entries]))
+    return _Node(node.bitmap, tuple([entries[id(c)] if type(c) is _Entry else _replace_entries(c, entries)
+                                     for c in node.children]))
+
+
+def _node_hash(node) -> int:
+    if node.items_hash is None:
+        h = 0
+        for child in node.entries if isinstance(node, _Collision) else node.children:
+            h += hash((child.key, child.value)) if type(child) is _Entry else _node_hash(child)
+        node.items_hash = h & _HASH_MASK
+    return node.items_hash
+
+
+class PMap(Mapping):
+    __slots__ = ('_root', '_len', '_next_seq', '_order', '_ordered', '_reads', '_dict', '_hash')
+
+    def __init__(self, items: Mapping | Iterable = ()):
+        if type(items) is PMap:
+            self._init(items._root, items._len, items._next_seq, items._order)
+            return
+        # A dict gives the distinct keys in the insertion order, with the last values
+        if type(items) is not dict:
+            items = dict(items.items() if isinstance(items, Mapping) else items)
+        root = _empty_node
+        entries = []
+        for seq, (key, value) in enumerate(items.items()):
+            entry = _Entry(key, value, seq, _key_hash(key))
+            root = _assoc(root, 0, entry)
+            entries.append(entry)
+        self._init(root, len(entries), len(entries), PVector(reversed(entries)))
+
+    def _init(self, root: _Node, length: int, next_seq: int, order: PVector):
+        self._root = root
+        self._len = length
+        self._next_seq = next_seq
+        self._order = order
+        self._ordered = None
+        self._reads = 0
+        self._dict = None
+        self._hash = None
+
+    @classmethod
+    def _make(cls, root: _Node, length: int, next_seq: int, order: PVector) -> PMap:
+        m = cls.__new__(cls)
+        m._init(root, length, next_seq, order)
+        return m
+
+    # Used as an attrs converter
+    @classmethod
+    def from_mapping(cls, items: Mapping | Iterable) -> PMap:
+        if type(items) is PMap:
+            return items
+        return cls(items)
+
+    def set(self, key, value) -> PMap:
+        h = _key_hash(key)
+        old = _find(self._root, h, key)
+        if old is None:
+            entry = _Entry(key, value, self._next_seq, h)
+            return self._make(_assoc(self._root, 0, entry), self._len + 1, self._next_seq + 1,
+                              self._order.cons(entry))
+        if old.value is value:
+            return self
+        entry = _Entry(key, value, old.seq, h)
+        return self._make(_assoc(self._root, 0, entry), self._len, self._next_seq,
+                          self._order.set(self._next_seq - 1 - old.seq, entry))
+
+    def delete(self, key) -> PMap:
+        h = _key_hash(key)
+        old = _find(self._root, h, key)
+        if old is None:
+            raise KeyError(key)
+        root = _without(self._root, 0, h, key)
+        m = self._make(_empty_node if root is None else root, self._len - 1, self._next_seq,
+                       self._order.set(self._next_seq - 1 - old.seq, None))
+        if m._next_seq > 2 * m._len + 32:
+            m = m._renumber()
+        return m
+
+    # Same keys in the same order, with the values mapped by fn.  The shapes of the trie and of the vector
+    # are kept.
+    def map_values(self, fn) -> PMap:
+        if self._len == 0:
+            return self
+        entries = {}
+
+        def map_entry(e: _Entry | None) -> _Entry | None:
+            if e is None:
+                return None
+            new = entries[id(e)] = _Entry(e.key, fn(e.value), e.seq, e.hash)
+            return new
+        order = self._order.map(map_entry)
+        return self._make(_replace_entries(self._root, entries), self._len, self._next_seq, order)
+
+    # The entries numbered again from 0, without the deleted ones in the order.  The shape of the trie,
+    # which depends only on the keys, is kept.
+    def _renumber(self) -> PMap:
+        entries = {}
+        for seq, e in enumerate(self._entries()):
+            entries[id(e)] = _Entry(e.key, e.value, seq, e.hash)
+        order = PVector(reversed(list(entries.values())))
+        return self._make(_replace_entries(self._root, entries), self._len, self._len, order)
+
+    def update(self, other: Mapping) -> PMap:
+        m = self
+        for key, value in other.items():
+            m = m.set(key, value)
+        return m
+
+    def copy(self) -> PMap:
+        return self
+
+    # The entries in the insertion order.  They are read lazily from the vector, and kept once they have all
+    # been read.
+    def _entries(self) -> Iterable[_Entry]:
+        if self._ordered is not None:
+            return self._ordered
+        return self._read_order()
+
+    def _read_order(self):
+        entries = []
+        for e in reversed(self._order):
+            if e is not None:
+                entries.append(e)
+                yield e
+        self._ordered = tuple(entries)
+
+    # A map which has been read as many times as it has entries keeps its items in a dict for the further
+    # reads, so that building the dict costs no more than the reads already done through the trie.
+    def _read(self) -> dict | None:
+        self._reads += 1
+        if self._reads < self._len:
+            return None
+        self._dict = {e.key: e.value for e in self._entries()}
+        return self._dict
+
+    def __getitem__(self, key):
+        d = self._dict if self._dict is not None else self._read()
+        if d is not None:
+            return d[key]
+        e = _find(self._root, _key_hash(key), key)
+        if e is None:
+            raise KeyError(key)
+        return e.value
+
+    def __contains__(self, key):
+        d = self._dict if self._dict is not None else self._read()
+        if d is not None:
+            return key in d
+        return _find(self._root, _key_hash(key), key) is not None
+
+    def get(self, key, default=None):
+        d = self._dict if self._dict is not None else self._read()
+        if d is not None:
+            return d.get(key, default)
+        e = _find(self._root, _key_hash(key), key)
+        return default if e is None else e.value
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for e in self._entries():
+            yield e.key
+
+    def items(self):
+        return _ItemsView(self)
+
+    def values(self):
+        return _ValuesView(self)
+
+    def __or__(self, other: Mapping) -> PMap:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return self.update(other)
+
+    def __ror__(self, other: Mapping) -> PMap:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return PMap(other).update(self)
+
+    # Equal as dictionaries, regardless of the insertion order
+    def __eq__(self, other: Any):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        if self is other:
+            return True
+        if len(self) != len(other):
+            return False
+        # Hashes are cached, so that unequal maps are usually told apart without comparing the values
+        if type(other) is PMap and hash(self) != hash(other):
+            return False
+        for e in self._entries():
+            v = other.get(e.key, _missing)
+            if v is _missing or not (v is e.value or v == e.value):
+                return False
+        return True
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((PMap, _node_hash(self._root)))
+        return self._hash
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self.items())!r})'
+
+
+_missing = object()
+
+
+# Views iterating the entries, instead of looking up each key
+class _ItemsView(ItemsView):
+    def __iter__(self):
+        for e in self._mapping._entries():
+            yield e.key, e.value
+
+
+class _ValuesView(ValuesView):
+    def __iter__(self):
+        for e in self._mapping._entries():
+            yield e.value
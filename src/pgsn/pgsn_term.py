@@ -1,16 +1,23 @@
 from __future__ import annotations
 
+import collections
+import contextlib
 import functools
+import sys
+import weakref
 from abc import ABC, abstractmethod
 from typing import Any
+from typing import Callable
 from typing import TypeAlias
 from typing import TypeVar
 
+import attrs.validators
 import cattrs.preconf.json
-from attrs import field, frozen, evolve
+from attrs import field, fields, frozen, evolve
 from cattrs.strategies import include_subclasses, configure_tagged_union
 
 from pgsn import helpers
+from pgsn.persistent import PVector, PMap
 
 Term: TypeAlias = "Term"
 T = TypeVar('T')
@@ -32,6 +39,323 @@ class LambdaInterpreterError(Exception):
     pass
 
 
+# Checked mode runs the invariant assertions of the evaluator and the attrs validators.
+# It is the default.  The unchecked mode is meant for production runs on large cases.
+_checked = True
+
+
+def set_checked(checked: bool):
+    global _checked
+    _checked = checked
+    attrs.validators.set_disabled(not checked)
+
+
+@contextlib.contextmanager
+def checked_mode(checked: bool):
+    saved = _checked
+    set_checked(checked)
+    try:
+        yield
+    finally:
+        set_checked(saved)
+
+
+# Hash-consing
+# Terms are bucketed by their hash.  Buckets hold weak references, so that the table does not keep terms alive.
+class InternTable:
+
+    def __init__(self):
+        self.buckets: dict[int, list[weakref.ref]] = {}
+
+    def intern(self, term: Term) -> Term:
+        try:
+            h = hash(term)
+        except TypeError:
+            return term
+        bucket = self.buckets.setdefault(h, [])
+        for ref in bucket:
+            t = ref()
+            if t is not None and type(t) is type(term) and _same_fields(t, term):
+                return t
+        bucket.append(weakref.ref(term, lambda ref: self._remove(h, ref)))
+        return term
+
+    def _remove(self, h: int, ref: weakref.ref):
+        bucket = self.buckets.get(h)
+        if bucket is None or ref not in bucket:
+            return
+        bucket.remove(ref)
+        if not bucket:
+            del self.buckets[h]
+
+    def contains(self, term: Term) -> bool:
+        try:
+            h = hash(term)
+        except TypeError:
+            return False
+        return any(ref() is term for ref in self.buckets.get(h, ()))
+
+
+_intern_table: InternTable | None = None
+
+
+# When enabled, terms built by build and evolve are shared through the intern table.
+def set_hash_consing(enabled: bool):
+    global _intern_table
+    _intern_table = InternTable() if enabled else None
+
+
+# Terms carrying meta_info are not shared, because meta_info does not take part in equality.
+def hash_cons(term: Term) -> Term:
+    if _intern_table is None or term.meta_info:
+        return term
+    return _intern_table.intern(term)
+
+
+# Structural equality.  Two interned terms are equal only if they are the same object.
+def same_term(t1: Term, t2: Term) -> bool:
+    if t1 is t2:
+        return True
+    if _intern_table is not None and _intern_table.contains(t1) and _intern_table.contains(t2):
+        return False
+    return t1 == t2
+
+
+_eq_field_names: dict[type, tuple[str, ...]] = {}
+
+
+# Equality of two terms of the same class, comparing the subterms by same_term
+def _same_fields(t1: Term, t2: Term) -> bool:
+    cls = type(t1)
+    names = _eq_field_names.get(cls)
+    if names is None:
+        names = tuple(f.name for f in fields(cls) if f.eq)
+        _eq_field_names[cls] = names
+    for name in names:
+        v1 = getattr(t1, name)
+        v2 = getattr(t2, name)
+        if v1 is v2:
+            continue
+        if isinstance(v1, Term) and isinstance(v2, Term):
+            if not same_term(v1, v2):
+                return False
+        elif v1 != v2:
+            return False
+    return True
+
+
+# Normal form cache
+# Closed terms are looked up by their cached hash and equality, and their normal forms are shared across
+# evaluations.  Entries are evicted in the LRU order when there are more than max_entries of them,
+# or when the cached normal forms have more than max_nodes nodes in total.
+# Only the normal forms which a reduction has reached are stored, so a cached term never reduces
+# a subterm which the reduction would not have reduced.  A cached normal form is returned without spending steps.
+class NormalFormCache:
+
+    def __init__(self, max_entries: int = 4096, max_nodes: int = 1000000):
+        self.max_entries = max_entries
+        self.max_nodes = max_nodes
+        self.entries: collections.OrderedDict[Term, tuple[Term, int]] = collections.OrderedDict()
+        self.nodes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, term: Term) -> Term | None:
+        entry = self.entries.get(term)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(term)
+        return entry[0]
+
+    def store(self, term: Term, normal_form: Term):
+        nodes = _count_nodes(normal_form)
+        if nodes > self.max_nodes:
+            return
+        old = self.entries.pop(term, None)
+        if old is not None:
+            self.nodes -= old[1]
+        self.entries[term] = (normal_form, nodes)
+        self.nodes += nodes
+        while len(self.entries) > self.max_entries or self.nodes > self.max_nodes:
+            _, (_, n) = self.entries.popitem(last=False)
+            self.nodes -= n
+            self.evictions += 1
+
+    # One step of the reduction of a closed term, which jumps to the normal form if it is known
+    def eval_or_none(self, term: Term) -> Term | None:
+        normal_form = self.lookup(term)
+        if normal_form is None:
+            return term._eval_or_none()
+        return None if same_term(normal_form, term) else normal_form
+
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries), 'nodes': self.nodes}
+
+
+_normal_form_cache: NormalFormCache | None = None
+
+
+def set_normal_form_cache(enabled: bool, max_entries: int = 4096, max_nodes: int = 1000000):
+    global _normal_form_cache
+    _normal_form_cache = NormalFormCache(max_entries, max_nodes) if enabled else None
+
+
+def normal_form_cache_stats() -> dict[str, int] | None:
+    return None if _normal_form_cache is None else _normal_form_cache.stats()
+
+
+# The number of distinct nodes of a term
+def _count_nodes(term: Term) -> int:
+    seen = set()
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        if id(t) in seen:
+            continue
+        seen.add(id(t))
+        stack.extend(_children(t))
+    return len(seen)
+
+
+# Explicit stack traversal
+# Terms are traversed with stacks of frames instead of the Python stack, so that the depth of a term is
+# limited by the memory and not by the recursion limit.  The children of a term are the subterms
+# visited by its _traverse, in that order.
+
+def _children(term: Term) -> list[Term]:
+    children = []
+    term._traverse(children.append)
+    return children
+
+
+# The term rebuilt from the images of its children, or None if none of them changes
+def _rebuild(term: Term, images: list[Term | None]) -> Term | None:
+    it = iter(images)
+    return term._traverse(lambda _: next(it))
+
+
+_DESCEND = object()
+
+
+# Maps a term bottom up.  visit(t, env) is the image of t, None if t does not change, or _DESCEND.
+# The children of a descended term t are visited in the environment enter(t, env),
+# and leave(t, images) is the image of t computed from the images of its children.
+def _map_term(term: Term, env, visit, enter, leave=_rebuild) -> Term | None:
+    image = visit(term, env)
+    if image is not _DESCEND:
+        return image
+    stack = [(term, enter(term, env), _children(term), [])]
+    while True:
+        t, t_env, children, images = stack[-1]
+        if len(images) < len(children):
+            child = children[len(images)]
+            image = visit(child, t_env)
+            if image is _DESCEND:
+                stack.append((child, enter(child, t_env), _children(child), []))
+            else:
+                images.append(image)
+            continue
+        stack.pop()
+        image = leave(t, images)
+        if not stack:
+            return image
+        stack[-1][3].append(image)
+
+
+# Fills a cache field of a term and its subterms bottom up.  compute(t) reads only the caches of the children of t.
+def _fill_cache(term: Term, name: str, compute):
+    stack = [term]
+    while stack:
+        t = stack[-1]
+        if getattr(t, name) is not None:
+            stack.pop()
+            continue
+        pending = [c for c in _children(t) if getattr(c, name) is None]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        object.__setattr__(t, name, compute(t))
+
+
+# env is the pair of the shift and the cutoff
+def _shift_visit(t: Term, env: tuple[int, int]):
+    num, cutoff = env
+    if t.max_free_index() < cutoff:
+        return None
+    if isinstance(t, Variable):
+        return t.evolve(num=t.num + num)
+    return _DESCEND
+
+
+def _shift_enter(t: Term, env: tuple[int, int]) -> tuple[int, int]:
+    if not isinstance(t, Abs):
+        return env
+    num, cutoff = env
+    return num, cutoff + 1
+
+
+def _depth_enter(t: Term, depth: int) -> int:
+    return depth + 1 if isinstance(t, Abs) else depth
+
+
+# Substitutes term for the variable var in one pass, where env is the number of binders crossed.
+# term is shifted only where it is inserted, once for each depth.
+# If unshift is set, the variables above var are decremented, as var is removed by beta reduction.
+def _substitute(t: Term, var: int, term: Term, unshift: bool) -> Term | None:
+    inserted: dict[int, Term] = {}
+
+    def visit(u: Term, depth: int):
+        if u.max_free_index() < var + depth:
+            return None
+        if isinstance(u, Variable):
+            if u.num == var + depth:
+                shifted = inserted.get(depth)
+                if shifted is None:
+                    shifted = inserted[depth] = term.shift(depth, 0)
+                return shifted
+            return u.evolve(num=u.num - 1) if unshift and u.num > var + depth else None
+        return _DESCEND
+
+    return _map_term(t, 0, visit, _depth_enter)
+
+
+# The nameless form of a named term in one pass, where env is the number of binders crossed.
+# levels maps each name to the stack of the depths of its binders, innermost last, and is restored when a binder
+# is left.  The names in the naming context have negative depths, so that the i-th name has the index i at the top.
+def _remove_names(term: Term, context: list[str]) -> Term:
+    levels: dict[str, list[int]] = {}
+    for i, name in reversed(list(enumerate(context))):
+        levels.setdefault(name, []).append(-1 - i)
+
+    def visit(t: Term, depth: int):
+        if isinstance(t, Variable):
+            binders = levels.get(t.name)
+            if not binders:
+                raise ValueError(f'{t.name} is not in the naming context')
+            return t.evolve(num=depth - binders[-1] - 1)
+        if isinstance(t, ConstMixin):
+            return t.evolve(is_named=False)
+        return _DESCEND
+
+    def enter(t: Term, depth: int) -> int:
+        if not isinstance(t, Abs):
+            return depth
+        levels.setdefault(t.v.name, []).append(depth)
+        return depth + 1
+
+    def leave(t: Term, images: list[Term]) -> Term:
+        if isinstance(t, Abs):
+            levels[t.v.name].pop()
+        return t._nameless(images)
+
+    return _map_term(term, 0, visit, enter, leave)
+
+
 Castable: TypeAlias = "Term | int | str | bool | list | dict | None"
 
 
@@ -59,17 +383,32 @@ class ConstMixin(ABC):
     def _eval_or_none(self) -> Term | None:
         return None
 
-    def _shift_or_none(self, num: int, cutoff: int) -> Term | None:
-        return None
-
-    def _subst_or_none(self, variable: int, term: Term) -> Term | None:
-        return None
-
     def _free_variables(self) -> set[str]:
         return set()
 
-    def _remove_name_with_context(self, context: list[str]) -> Term:
-        return self.evolve(is_named=False)
+    def _free_indices(self) -> set[int]:
+        return set()
+
+    def _max_free_index(self) -> int:
+        return -1
+
+
+# Lazy terms
+# A lazy term is an instance of its class whose fields are not set until one of them is read.  They are
+# then loaded by source.load(position), which returns the arguments of the constructor and, for a nameless
+# term, its max_free_index, so that a subterm is not loaded to know that shift and substitution skip it.
+# Subterms returned by load can be lazy terms again, e.g. those of binary_codec.TermStore.
+def lazy_term(cls: type[Term], source, position: int) -> Term:
+    t = object.__new__(cls)
+    object.__setattr__(t, '_source', (source, position))
+    return t
+
+
+def _load_lazy(t: Term, source, position: int):
+    kwargs, max_free_index = source.load(position)
+    t.__init__(**kwargs)
+    if not t.is_named:
+        object.__setattr__(t, '_max_free_index_cache', max_free_index)
 
 
 @frozen(kw_only=True, cache_hash=True)
@@ -77,10 +416,22 @@ class Term(ABC):
     # meta_info is always not empty
     meta_info: dict = field(default={}, eq=False)
     is_named: bool = field(validator=helpers.not_none)
+    # Free variables of a named term, or free de Bruijn indices of a nameless term.  Computed on demand.
+    _free_cache: frozenset | None = field(default=None, init=False, eq=False, repr=False)
+    _max_free_index_cache: int | None = field(default=None, init=False, eq=False, repr=False)
+    # Set once the term is known to be a normal form, e.g. when eval_or_none has returned None,
+    # so that normal forms are not traversed again
+    _normal_cache: bool = field(default=False, init=False, eq=False, repr=False)
+    # The nameless form of a named term by remove_name
+    _nameless_cache: Term | None = field(default=None, init=False, eq=False, repr=False)
+    # (source, position) of a lazy term whose fields are not loaded yet, see lazy_term
+    _source: tuple | None = field(default=None, init=False, eq=False, repr=False)
+    # Code compiled by pgsn.nbe.  It depends only on the term, so it is kept as long as the term.
+    _code_cache: Callable | None = field(default=None, init=False, eq=False, repr=False)
 
     @classmethod
     def build(cls, is_named: bool, **kwarg) -> Term:
-        return cls(is_named=is_named, **kwarg)
+        return hash_cons(cls(is_named=is_named, **kwarg))
 
     @classmethod
     def nameless(cls, **kwarg) -> Term:
@@ -97,8 +448,7 @@ class Term(ABC):
         del(self.meta_info[k])
 
     def evolve(self, **kwarg):
-        evolved = self._evolve(**kwarg)
-        return evolve(evolved)
+        return hash_cons(self._evolve(**kwarg))
 
     def _evolve(self, **kwarg):
         return evolve(self, **kwarg)
@@ -108,15 +458,33 @@ class Term(ABC):
     def _eval_or_none(self):
         pass
 
+    # Whether the term is known to be a normal form.  False does not mean that it reduces.
+    def is_normal_form(self) -> bool:
+        return self._normal_cache
+
+    # For engines which find out that the term is a normal form
+    def mark_normal_form(self):
+        object.__setattr__(self, '_normal_cache', True)
+
     # If None is returned, the reduction is terminated.
     def eval_or_none(self):
+        if self._normal_cache:
+            return None
         if self.is_named:
             t = self.remove_name()
         else:
             t = self
-        evaluated = t._eval_or_none()
-        assert (evaluated is None) or (not evaluated.is_named)
-        assert (evaluated is None) or (evaluated != t)  # should progress
+        if _normal_form_cache is not None and not isinstance(t, ConstMixin) and t.is_closed:
+            evaluated = _normal_form_cache.eval_or_none(t)
+        else:
+            evaluated = t._eval_or_none()
+        if evaluated is None:
+            object.__setattr__(t, '_normal_cache', True)
+            object.__setattr__(self, '_normal_cache', True)
+            return None
+        if _checked:
+            assert not evaluated.is_named
+            assert not same_term(evaluated, t)  # should progress
         return evaluated
 
     def eval(self) -> Term:
@@ -125,41 +493,76 @@ class Term(ABC):
         assert(not evaluated.is_named)
         return evaluated
 
-    # FIXME: Use contexts in intermediate steps, not terms
-    def fully_eval(self, steps=100000) -> Term:
+    # engine: "substitution" rewrites the term step by step,
+    # "machine" runs the environment machine in pgsn.machine (call-by-name),
+    # "need" runs the same machine with shared thunks (call-by-need),
+    # "nbe" compiles the term to Python closures in pgsn.nbe (call-by-need)
+    # checked: overrides the module setting (see set_checked) during this evaluation
+    def fully_eval(self, steps=100000, engine='substitution', checked: bool | None = None) -> Term:
+        if checked is not None and checked != _checked:
+            with checked_mode(checked):
+                return self.fully_eval(steps, engine)
+        if engine not in ('substitution', 'machine', 'need', 'nbe'):
+            raise ValueError(f'Unknown evaluation engine {engine}')
         t = self if not self.is_named else self.remove_name()
-        for _ in range(steps):
-            t_reduced = t.eval_or_none()
-            assert t_reduced is None or t_reduced != t  # should progress
-            if t_reduced is None:
-                return t
-            t = t_reduced
-        raise LambdaInterpreterError('Reduction did not terminate', t)
+        cache = _normal_form_cache if t.is_closed else None
+        if cache is not None:
+            normal_form = cache.lookup(t)
+            if normal_form is not None:
+                return normal_form
+        # A reduction which keeps nesting, e.g. fix (λs. equal s s), exhausts the Python stack
+        # before the steps.  It is reported as non-termination.
+        try:
+            if engine in ('machine', 'need'):
+                from pgsn import machine
+                normal_form = machine.normal_form(t, steps, sharing=engine == 'need')
+            elif engine == 'nbe':
+                from pgsn import nbe
+                normal_form = nbe.normal_form(t, steps)
+            else:
+                normal_form = _normal_form(t, steps)
+        except RecursionError:
+            raise LambdaInterpreterError('Reduction did not terminate', t) from None
+        if cache is not None:
+            cache.store(t, normal_form)
+        return normal_form
+
+    # Reduction to the weak head normal form by the substitution engine.
+    # The bodies of abstractions and the contents of lists, records, classes and objects are not reduced.
+    def whnf(self, steps=100000, checked: bool | None = None) -> Term:
+        if checked is not None and checked != _checked:
+            with checked_mode(checked):
+                return self.whnf(steps)
+        t = self if not self.is_named else self.remove_name()
+        return _normal_form(t, steps, weak=True)
 
-    @abstractmethod
-    def _shift_or_none(self, num: int, cutoff: int) -> Term | None:
-        pass
+    # Visits the children, and returns the term whose children are replaced by the results of visit
+    # which are not None.  None if all the results are None.
+    def _traverse(self, visit) -> Term | None:
+        return None
 
     def shift_or_none(self, num: int, cutoff: int) -> Term | None:
-        assert not self.is_named
-        shifted = self._shift_or_none(num, cutoff)
-        if shifted is None:
+        if _checked:
+            assert not self.is_named
+        if self.max_free_index() < cutoff:
             return None
-        assert not shifted.is_named
+        shifted = _map_term(self, (num, cutoff), _shift_visit, _shift_enter)
+        if _checked:
+            assert shifted is None or not shifted.is_named
         return shifted
 
     def shift(self, num: int, cutoff: int) -> Term:
         return helpers.default(self.shift_or_none(num, cutoff), self)
 
-    @abstractmethod
-    def _subst_or_none(self, variable: int, term: Term) -> Term | None:
-        pass
-
     def subst_or_none(self, variable: int, term: Term) -> Term | None:
-        assert not self.is_named
-        assert not term.is_named
-        substituted = self._subst_or_none(variable, term)
-        assert substituted is None or not substituted.is_named
+        if _checked:
+            assert not self.is_named
+            assert not term.is_named
+        if self.max_free_index() < variable:
+            return None
+        substituted = _substitute(self, variable, term, unshift=False)
+        if _checked:
+            assert substituted is None or not substituted.is_named
         return substituted
 
     def subst(self, variable:int, term: Term) -> Term:
@@ -167,21 +570,65 @@ class Term(ABC):
         substituted = helpers.default(substituted_or_none, self)
         return substituted
 
+    # The body of a beta redex (λ. self) arg after the reduction, that is, self.subst(0, arg.shift(1, 0)).shift(-1, 0)
+    # computed in one pass.
+    def instantiate(self, arg: Term) -> Term:
+        if _checked:
+            assert not self.is_named
+            assert not arg.is_named
+        instantiated = _substitute(self, 0, arg, unshift=True)
+        if _checked:
+            assert instantiated is None or not instantiated.is_named
+        return helpers.default(instantiated, self)
+
     @abstractmethod
     def _free_variables(self) -> set[str]:
         pass
 
-    def free_variables(self) -> set[str]:
+    def free_variables(self) -> frozenset[str]:
         assert self.is_named
-        return self._free_variables()
+        if self._free_cache is None:
+            _fill_cache(self, '_free_cache', lambda t: frozenset(t._free_variables()))
+        return self._free_cache
 
     @abstractmethod
-    def _remove_name_with_context(self, context: list[str]) -> Term:
+    def _free_indices(self) -> set[int]:
         pass
 
+    # de Bruijn indices which are not bound inside the term
+    def free_indices(self) -> frozenset[int]:
+        assert not self.is_named
+        if self._free_cache is None:
+            _fill_cache(self, '_free_cache', lambda t: frozenset(t._free_indices()))
+        return self._free_cache
+
+    @abstractmethod
+    def _max_free_index(self) -> int:
+        pass
+
+    # Shift and substitution do not change the term if the cutoff or the variable is above this index.
+    # -1 if the term is closed.
+    def max_free_index(self) -> int:
+        if self._max_free_index_cache is None:
+            assert not self.is_named
+            _fill_cache(self, '_max_free_index_cache', lambda t: t._max_free_index())
+        return self._max_free_index_cache
+
+    # The term and its subterms are compiled once, bottom up.  compile(t) reads the code of the children of t.
+    def compiled(self, compile) -> Callable:
+        if self._code_cache is None:
+            _fill_cache(self, '_code_cache', compile)
+        return self._code_cache
+
+    @property
+    def is_closed(self) -> bool:
+        if self.is_named:
+            return not self.free_variables()
+        return self.max_free_index() < 0
+
     def remove_name_with_context(self, context: list[str]) -> Term:
         assert self.is_named
-        nameless = self._remove_name_with_context(context)
+        nameless = _remove_names(self, context)
         assert not nameless.is_named
         return nameless
 
@@ -191,7 +638,9 @@ class Term(ABC):
 
     def remove_name(self) -> Term:
         assert self.is_named
-        return self.remove_name_with_context(self.my_naming_context())
+        if self._nameless_cache is None:
+            object.__setattr__(self, '_nameless_cache', self.remove_name_with_context(self.my_naming_context()))
+        return self._nameless_cache
 
     def __call__(self, *args: Castable, **kwargs: Castable) -> Term:
         arg_terms = list(map(lambda x: cast(x, is_named=self.is_named), args))
@@ -207,13 +656,19 @@ class Term(ABC):
     def __getitem__(self, item):
         return self(item)
 
+    # Only called for the names which are not set.  The fields of a lazy term are loaded when one of them
+    # is first read, and the other names are method calls.
     def __getattr__(self, name):
+        source = object.__getattribute__(self, '_source')
+        if source is not None:
+            _load_lazy(self, *source)
+            return getattr(self, name)
         return self(name)
 
     def pretty(self):
         return self.__str__()
 
-@frozen
+@frozen(cache_hash=True)
 class Variable(Term):
     num: int | None = field(default=None)
     name: str | None = field(default=None)
@@ -241,27 +696,18 @@ class Variable(Term):
     def _free_variables(self) -> set[str]:
         return {self.name}
 
-    def _eval_or_none(self):
-        return None
+    def _free_indices(self) -> set[int]:
+        return {self.num}
 
-    def _shift_or_none(self, d, cutoff):
-        if self.num < cutoff:
-            return None
-        else:
-            return self.evolve(num=self.num+d)
+    def _max_free_index(self) -> int:
+        return self.num
 
-    def _subst_or_none(self, num, term) -> Term | None:
-        if self.num == num:
-            return term
-        else:
-            return None
+    def _eval_or_none(self):
+        return None
 
-    def _remove_name_with_context(self, context: list[str]) -> Term:
-        num = context.index(self.name)
-        return self.evolve(num=num)
 
 
-@frozen
+@frozen(cache_hash=True)
 class Abs(Term):
     v: Variable | None = field()
     t: Term = field(validator=helpers.not_none)
@@ -292,32 +738,25 @@ class Abs(Term):
         t_evaluated = self.t.eval_or_none()
         return None if t_evaluated is None else self.evolve(t=t_evaluated)
 
-    def _shift_or_none(self, num: int, cutoff: int) -> Term | None:
-        t_shifted = self.t.shift_or_none(num, cutoff + 1)
-        if t_shifted is None:
-            return None
-        return self.evolve(t=t_shifted)
-
-    def _subst_or_none(self, var: int, term: Term) -> Term | None:
-        term_shifted_or_none = term.shift_or_none(1, 0)
-        term_shifted = helpers.default(term_shifted_or_none, term)
-        substituted = self.t.subst_or_none(var + 1, term_shifted)
-        if substituted is None:
-            return None
-        else:
-            return self.evolve(t=substituted)
+    def _traverse(self, visit):
+        t = visit(self.t)
+        return None if t is None else self.evolve(t=t)
 
     def _free_variables(self) -> set[str]:
         f_vars = self.t.free_variables()
         return f_vars - {self.v.name}
 
-    def _remove_name_with_context(self, context: list[str]) -> Term:
-        new_context = [self.v.name] + context
-        name_less_t = self.t.remove_name_with_context(new_context)
-        return self.evolve(t=name_less_t, v=None)
+    def _free_indices(self) -> set[int]:
+        return {i - 1 for i in self.t.free_indices() if i > 0}
 
+    def _max_free_index(self) -> int:
+        return max(self.t.max_free_index() - 1, -1)
 
-@frozen
+    def _nameless(self, images: list[Term]) -> Term:
+        return self.evolve(t=images[0], v=None)
+
+
+@frozen(cache_hash=True)
 class App(Term):
     def _shit_or_none(self, num: int, cutoff: int) -> Term | None:
         pass
@@ -358,45 +797,34 @@ class App(Term):
             assert False
 
     def to_context(self) -> Context:
-        if isinstance(self.t1, App):
-            return self.t1.to_context().stack(self.t2)
-        else:
-            return Context.build(head=self.t1, args=(self.t2,))
+        return Context.build(head=self, args=())
 
     def _eval_or_none(self):
-        if isinstance(self.t1, App):
-            c = self.t1.to_context().stack(self.t2)
-        else:
-            c = Context.build(head=self.t1, args=(self.t2,))
+        c = self.to_context()
         c_reduced = c.reduce_or_none()
         if c_reduced is None:
             return None
         else:
             return c_reduced.to_term()
 
-    def _shift_or_none(self, num: int, cutoff: int) -> Term | None:
-        t1_shifted_or_none = self.t1.shift_or_none(num, cutoff)
-        t2_shifted_or_none = self.t1.shift_or_none(num, cutoff)
-        if t1_shifted_or_none is None and t2_shifted_or_none is None:
-            return None
-        t1_shifted = helpers.default(t1_shifted_or_none, self.t1)
-        t2_shifted = helpers.default(t2_shifted_or_none, self.t2)
-        return self.evolve(t1=t1_shifted, t2=t2_shifted)
-
-    def _subst_or_none(self, var: int, term: Term) -> Term | None:
-        t1_subst = self.t1.subst(var, term)
-        t2_subst = self.t2.subst(var, term)
-        if t1_subst is None and t2_subst is None:
+    def _traverse(self, visit):
+        t1 = visit(self.t1)
+        t2 = visit(self.t2)
+        if t1 is None and t2 is None:
             return None
-        return self.evolve(t1=t1_subst, t2=t2_subst)
+        return self.evolve(t1=helpers.default(t1, self.t1), t2=helpers.default(t2, self.t2))
 
     def _free_variables(self) -> set[str]:
         return self.t1.free_variables() | self.t2.free_variables()
 
-    def _remove_name_with_context(self, context: list[str]) -> Term:
-        nameless_t1 = self.t1.remove_name_with_context(context)
-        nameless_t2 = self.t2.remove_name_with_context(context)
-        return self.evolve(t1=nameless_t1, t2=nameless_t2)
+    def _free_indices(self) -> set[int]:
+        return self.t1.free_indices() | self.t2.free_indices()
+
+    def _max_free_index(self) -> int:
+        return max(self.t1.max_free_index(), self.t2.max_free_index())
+
+    def _nameless(self, images: list[Term]) -> Term:
+        return self.evolve(t1=images[0], t2=images[1])
 
 
 class Builtin(Term):
@@ -408,7 +836,8 @@ class Builtin(Term):
         pass
 
     def applicable_args(self, args: tuple[Term, ...]) -> bool:
-        assert (not self.is_named and all(not arg.is_named for arg in args))
+        if _checked:
+            assert (not self.is_named and all(not arg.is_named for arg in args))
         return len(args) >= self.arity and self._applicable_args(args)
 
     @abstractmethod
@@ -416,16 +845,33 @@ class Builtin(Term):
         pass
 
     def apply_args(self, args: tuple[Term, ...]) -> tuple[Term, tuple[Term, ...]]:
-        assert self.applicable_args(args)
+        if _checked:
+            assert self.applicable_args(args)
         reduced = self._apply_args(args)
-        assert not reduced.is_named
+        if _checked:
+            assert not reduced.is_named
         return reduced, args[self.arity:]
 
-    def _remove_name_with_context(self, context: list[str]) -> Term:
-        return self.evolve(is_named=False)
+    # The arguments are validated and applied at once
+    def _apply_args_or_none(self, args: tuple[Term, ...]) -> Term | None:
+        return self._apply_args(args) if self._applicable_args(args) else None
 
+    # The result of the application to args, or None if the builtin is not applicable to them
+    def apply_args_or_none(self, args: tuple[Term, ...]) -> Term | None:
+        if _checked:
+            assert (not self.is_named and all(not arg.is_named for arg in args))
+        if len(args) < self.arity:
+            return None
+        reduced = self._apply_args_or_none(args)
+        if _checked:
+            assert reduced is None or not reduced.is_named
+        return reduced
 
-@frozen
+    def _nameless(self, images: list[Term]) -> Term:
+        return helpers.default(_rebuild(self, images), self).evolve(is_named=False)
+
+
+@frozen(cache_hash=True)
 class Unary(Builtin, ABC):
     arity = 1
 
@@ -443,15 +889,16 @@ class Unary(Builtin, ABC):
     def _apply_args(self, args: tuple[Term, ...]):
         return self._apply_arg(args[0])
 
+    def _apply_args_or_none(self, args: tuple[Term, ...]):
+        arg = args[0]
+        return self._apply_arg(arg) if self._applicable(arg) else None
 
-@frozen
+
+@frozen(cache_hash=True)
 class Constant(ConstMixin, Builtin):
     arity=0
     name = field(validator=helpers.not_none)
 
-    def _shift_or_none(self, num: int, cutoff: int) -> Term | None:
-        pass
-
     def _applicable_args(self, _):
         return False
 
@@ -459,7 +906,7 @@ class Constant(ConstMixin, Builtin):
         assert False
 
 
-@frozen
+@frozen(cache_hash=True)
 class String(ConstMixin, Builtin):
     arity = 0
     value: str = field(validator=helpers.not_none)
@@ -471,7 +918,7 @@ class String(ConstMixin, Builtin):
         assert False
 
 
-@frozen
+@frozen(cache_hash=True)
 class Integer(ConstMixin, Builtin):
     arith = 0
     value: int = field(validator=helpers.not_none)
@@ -495,7 +942,7 @@ class Integer(ConstMixin, Builtin):
         return cls.named(value=int(string))
 
 
-@frozen
+@frozen(cache_hash=True)
 class Boolean(ConstMixin, Builtin):
     arith = 0
     value: bool = field(validator=helpers.not_none)
@@ -507,43 +954,39 @@ class Boolean(ConstMixin, Builtin):
         assert False
 
 
-@frozen
+@frozen(cache_hash=True)
 class List(Unary):
-    terms: tuple[Term, ...] = field(validator=helpers.not_none)
+    # Stored as a PVector.  The annotation keeps the JSON format of tuples.
+    terms: tuple[Term, ...] = field(validator=helpers.not_none, converter=PVector.from_iterable)
 
     def __attr_post_init__(self):
         assert all(isinstance(t, Term) for t in self.terms)
         assert len(self.terms) == 0 or all((t == self.is_named for t in self.terms))
 
-    def _eval_or_none(self):
-        evaluated = [term.eval_or_none() for term in self.terms]
-        if all(t is None for t in evaluated):
-            return None
-        else:
-            evaluated_expanded = (x[0] if x[1] is None else x[1] for x in zip(self.terms, evaluated))
-            return self.evolve(terms=tuple(evaluated_expanded))
-
-    def _shift_or_none(self, d, c):
-        shifted_or_none = [t.shift_or_none(d, c) for t in self.terms]
-        if all(s is None for s in shifted_or_none):
+    # Only the changed elements are replaced, unless most of them changed
+    def _traverse(self, visit):
+        visited = [visit(t) for t in self.terms]
+        changed = [i for i, t in enumerate(visited) if t is not None]
+        if not changed:
             return None
-        shifted = (helpers.default(shifted_or_none[i], self.terms[i]) for i in range(len(self.terms)))
-        return self.evolve(terms=tuple(shifted))
+        if 2 * len(changed) > len(visited):
+            return self.evolve(terms=tuple(helpers.default(t1, t) for t, t1 in zip(self.terms, visited)))
+        terms = self.terms
+        for i in changed:
+            terms = terms.set(i, visited[i])
+        return self.evolve(terms=terms)
 
-    def _subst_or_none(self, num, term):
-        subst = [t.subst_or_none(num, term) for t in self.terms]
-        if all(t is None for t in subst):
-            return None
-        else:
-            subst_expanded = (x[0] if x[1] is None else x[1] for x in zip(self.terms, subst))
-            return self.evolve(terms=tuple(subst_expanded))
+    def _eval_or_none(self):
+        return self._traverse(lambda t: t.eval_or_none())
 
     def _free_variables(self):
         return set().union(*[t.free_variables() for t in self.terms])
 
-    def _remove_name_with_context(self, context):
-        return List.nameless(meta_info=self.meta_info,
-                             terms=tuple(t.remove_name_with_context(context) for t in self.terms))
+    def _free_indices(self):
+        return set().union(*[t.free_indices() for t in self.terms])
+
+    def _max_free_index(self):
+        return self.terms.max(Term.max_free_index, default=-1)
 
     def _applicable(self, term: Term):
         return isinstance(term, Integer) and 0 <= term.value < len(self.terms)
@@ -552,10 +995,22 @@ class List(Unary):
         return self.terms[term.value]
 
 
-@frozen
+# Only the changed values are replaced, so that the unchanged part of the map is shared
+def _traverse_map(attributes: PMap, visit) -> PMap | None:
+    if not attributes:
+        return None
+    visited = attributes
+    for label, t in attributes.items():
+        t1 = visit(t)
+        if t1 is not None:
+            visited = visited.set(label, t1)
+    return None if visited is attributes else visited
+
+
+@frozen(cache_hash=True)
 class Record(Unary):
-    _attributes: dict[str, Term] = \
-        field(validator=helpers.not_none)
+    # Stored as a PMap.  The annotation keeps the JSON format of dicts.
+    _attributes: dict[str, Term] = field(validator=helpers.not_none, converter=PMap.from_mapping)
 
     def __attr_post_init__(self):
         assert all(isinstance(k, str) for k in self.attributes().keys())
@@ -563,54 +1018,34 @@ class Record(Unary):
 
     @classmethod
     def build(cls, is_named: bool, attributes: dict[str, Term]):
-        return cls(is_named=is_named, attributes=attributes.copy())
+        return hash_cons(cls(is_named=is_named, attributes=attributes))
 
     def _evolve(self, is_named: bool | None = None, attributes: dict[str, Term] | None =None):
         if attributes is None:
             attributes = self._attributes
         if is_named is None:
             is_named = self.is_named
-        return evolve(self, is_named=is_named, attributes=attributes.copy())
+        return evolve(self, is_named=is_named, attributes=attributes)
 
-    def attributes(self):
-        return self._attributes.copy()
+    # A read-only view
+    def attributes(self) -> PMap:
+        return self._attributes
 
-    def _eval_or_none(self):
-        evaluated = {label: t.eval_or_none() for label, t in self.attributes().items()}
-        if all(t is None for _, t in evaluated.items()):
-            return None
-        else:
-            evaluated_expand = dict(evaluated)
-            for k in evaluated.keys():
-                if evaluated_expand[k] is None:
-                    evaluated_expand[k] = self.attributes()[k]
-            return self.evolve(attributes=evaluated_expand)
-
-    def _shift_or_none(self, d, c):
-        shifted_or_none = dict((label, t.shift(d, c)) for label, t in self.attributes().items())
-        if all(s is None for s in shifted_or_none.values()):
-            return None
-        shifted = {k: helpers.default(v, self.attributes()[k]) for k, v in self.attributes().items()}
-        return self.evolve(attributes=shifted)
+    def _traverse(self, visit):
+        attributes = _traverse_map(self._attributes, visit)
+        return None if attributes is None else self.evolve(attributes=attributes)
 
-    def _subst_or_none(self, num, term):
-        subst = dict((label, t.subst_or_none(num, term)) for label, t in self.attributes().items())
-        if all(t is None for _, t in subst.items()):
-            return None
-        else:
-            for k in subst.keys():
-                if subst[k] is None:
-                    subst[k] = self._attributes[k]
-            return self.evolve(attributes=subst)
+    def _eval_or_none(self):
+        return self._traverse(lambda t: t.eval_or_none())
 
     def _free_variables(self):
         return set().union(*(t.free_variables() for _, t in self.attributes().items()))
 
-    def _remove_name_with_context(self, context):
-        return self.evolve(
-            attributes=dict((label, t.remove_name_with_context(context)) for label, t
-                            in self.attributes().items()),
-            is_named=False)
+    def _free_indices(self):
+        return set().union(*(t.free_indices() for t in self._attributes.values()))
+
+    def _max_free_index(self):
+        return max((t.max_free_index() for t in self._attributes.values()), default=-1)
 
     def _applicable(self, term: Term):
         return isinstance(term, String) and term.value in self.attributes()
@@ -619,13 +1054,13 @@ class Record(Unary):
         return self.attributes()[term.value]
 
 
-@frozen
+@frozen(cache_hash=True)
 class PGSNClass(Unary):
     inherit: PGSNClass | None = field()
     name: str | None = field()
-    _defaults: dict[str, Term] = field(default={}, validator=helpers.not_none)
-    _attributes: set[str, ...] = field(default=set(), validator=helpers.not_none)
-    _methods: dict[str, Term] = field(default={}, validator=helpers.not_none)
+    _defaults: dict[str, Term] = field(default=PMap(), validator=helpers.not_none, converter=PMap.from_mapping)
+    _attributes: set[str, ...] = field(default=set(), validator=helpers.not_none, eq=frozenset)
+    _methods: dict[str, Term] = field(default=PMap(), validator=helpers.not_none, converter=PMap.from_mapping)
 
     def __attr_post_init__(self):
         assert all(k in self._attributes for k in self._defaults.keys())
@@ -645,16 +1080,17 @@ class PGSNClass(Unary):
             defaults = inherit.defaults() | defaults
             attributes = set(inherit.defaults()) | set(attributes)
             methods = inherit.methods() | methods
-        return cls(is_named=is_named, name=name, inherit=inherit, defaults=defaults.copy(), attributes=attributes, methods=methods.copy())
+        return hash_cons(cls(is_named=is_named, name=name, inherit=inherit, defaults=defaults, attributes=attributes,
+                             methods=methods))
 
-    def defaults(self):
-        return self._defaults.copy()
+    def defaults(self) -> PMap:
+        return self._defaults
 
     def attributes(self):
         return self._attributes
 
-    def methods(self):
-        return self._methods.copy()
+    def methods(self) -> PMap:
+        return self._methods
 
     def _evolve(self,
                 is_named: bool | None = None,
@@ -679,41 +1115,44 @@ class PGSNClass(Unary):
                       is_named=is_named,
                       name=name,
                       inherit=inherit,
-                      defaults=defaults.copy(),
+                      defaults=defaults,
                       attributes=attributes,
-                      methods=methods.copy())
+                      methods=methods)
 
     def _traverse(self, visit):
         if self.inherit is not None:
             inherit1 = visit(self.inherit)
         else:
             inherit1 = None
-        defaults1 = {label: visit(t) for label, t in self.defaults().items()}
-        methods1 = {label: visit(t) for label, t in self.methods().items()}
-        if all(v is None for v in defaults1.values()):
-            if all(v is None for v in methods1.values()):
-                if inherit1 is None:
-                    return None
-        inherit2 = helpers.default(inherit1, self.inherit)
-        defaults2 = {k: helpers.default(defaults1[k], self.defaults()[k]) for k in defaults1.keys()}
-        methods2 = {k: helpers.default(methods1[k], self.methods()[k]) for k in self.methods().keys()}
-        return self.evolve(inherit=inherit2, defaults=defaults2, methods=methods2)
+        defaults1 = _traverse_map(self._defaults, visit)
+        methods1 = _traverse_map(self._methods, visit)
+        if inherit1 is None and defaults1 is None and methods1 is None:
+            return None
+        return self.evolve(inherit=helpers.default(inherit1, self.inherit),
+                           defaults=helpers.default(defaults1, self._defaults),
+                           methods=helpers.default(methods1, self._methods))
 
     def _eval_or_none(self):
         return self._traverse(lambda t: t.eval_or_none())
 
-    def _shift_or_none(self, num: int, cutoff: int) -> Term | None:
-        return self._traverse(lambda t: t.shift_or_none(num, cutoff))
-
-    def _subst_or_none(self, variable: int, term: Term) -> Term | None:
-        return self._traverse(lambda t: t.subst_or_none())
-
     def _free_variables(self) -> set[str]:
         vars_inherit = self.inherit.free_variables() if self.inherit is not None else set()
-        vars_defaults = set(t.free_variables() for t in self.defaults().values())
-        vars_methods = set(t.free_variables() for t in self.methods().values())
+        vars_defaults = set().union(*(t.free_variables() for t in self._defaults.values()))
+        vars_methods = set().union(*(t.free_variables() for t in self._methods.values()))
         return vars_inherit | vars_defaults | vars_methods
 
+    def _free_indices(self) -> set[int]:
+        indices_inherit = self.inherit.free_indices() if self.inherit is not None else set()
+        indices_defaults = set().union(*(t.free_indices() for t in self._defaults.values()))
+        indices_methods = set().union(*(t.free_indices() for t in self._methods.values()))
+        return indices_inherit | indices_defaults | indices_methods
+
+    def _max_free_index(self) -> int:
+        index_inherit = self.inherit.max_free_index() if self.inherit is not None else -1
+        return max(index_inherit,
+                   max((t.max_free_index() for t in self._defaults.values()), default=-1),
+                   max((t.max_free_index() for t in self._methods.values()), default=-1))
+
     def _applicable(self, arg: Term):
         if not isinstance(arg, Record):
             return False
@@ -725,13 +1164,13 @@ class PGSNClass(Unary):
 
     def _apply_arg(self, arg: Record):
         attr = arg.attributes()
-        for k in self._defaults:
-            if not k in attr.keys():
-                attr[k] = self.defaults()[k]
+        for k, t in self._defaults.items():
+            if not k in attr:
+                attr = attr.set(k, t)
         return PGSNObject.nameless(instance=self, attributes=attr, methods=self.methods())
 
 
-@frozen
+@frozen(cache_hash=True)
 class DefineClass(ConstMixin, Unary):
 
     def _applicable(self, arg: Term) -> bool:
@@ -787,12 +1226,12 @@ class DefineClass(ConstMixin, Unary):
 def _is_subclass(cls1: PGSNClass, cls2: PGSNClass):
     if cls1.inherit is None:
         return False
-    if cls1 == cls2:
+    if same_term(cls1, cls2):
         return True
     return _is_subclass(cls1.inherit, cls2)
 
 
-@frozen
+@frozen(cache_hash=True)
 class IsSubclass(ConstMixin, Builtin):
     arity = 2
 
@@ -811,17 +1250,17 @@ class IsSubclass(ConstMixin, Builtin):
         return Boolean.nameless(value=_is_subclass(cls1, cls2))
 
 
-@frozen
+@frozen(cache_hash=True)
 class PGSNObject(Unary):
     instance: PGSNClass = field(validator=helpers.not_none)
-    _attributes: dict[str, Term] = field(validator=helpers.not_none)
-    _methods: dict[str, Term] = field()
+    _attributes: dict[str, Term] = field(validator=helpers.not_none, converter=PMap.from_mapping)
+    _methods: dict[str, Term] = field(converter=PMap.from_mapping)
 
-    def attributes(self):
-        return self._attributes.copy()
+    def attributes(self) -> PMap:
+        return self._attributes
 
-    def methods(self):
-        return self._methods.copy()
+    def methods(self) -> PMap:
+        return self._methods
 
     def _evolve(self,
                 is_named: bool | None = None,
@@ -833,7 +1272,7 @@ class PGSNObject(Unary):
         if instance is None:
             instance = self.instance
         if attributes is None:
-            attributes = self._attributes.copy()
+            attributes = self._attributes
         if methods is None:
             methods = self.methods()
         return evolve(self,
@@ -844,40 +1283,39 @@ class PGSNObject(Unary):
 
     def _traverse(self, visit):
         instance1 = visit(self.instance)
-        attributes1 = {label: visit(t) for label, t in self.attributes().items()}
-        methods1 = {label: visit(t) for label, t in self.methods().items()}
-        if all(v is None for v in attributes1.values()):
-            if all(v is None for v in methods1.values()):
-                if instance1 is None:
-                    return None
-        instance2 = helpers.default(instance1, self.instance)
-        attributes2 = {k: helpers.default(attributes1[k], self.attributes()[k]) for k in attributes1.keys()}
-        methods2 = {k: helpers.default(methods1[k], self.methods()[k]) for k in self.methods().keys()}
-        return self.evolve(instance=instance2, attributes=attributes2, methods=methods2)
+        attributes1 = _traverse_map(self._attributes, visit)
+        methods1 = _traverse_map(self._methods, visit)
+        if instance1 is None and attributes1 is None and methods1 is None:
+            return None
+        return self.evolve(instance=helpers.default(instance1, self.instance),
+                           attributes=helpers.default(attributes1, self._attributes),
+                           methods=helpers.default(methods1, self._methods))
 
     def _eval_or_none(self):
         return self._traverse(lambda t: t.eval_or_none())
 
-    def _shift_or_none(self, num: int, cutoff: int) -> Term | None:
-        return self._traverse(lambda t: t.shift_or_none(num, cutoff))
-
-    def _shift(self, num: int, cutoff: int) -> Term:
-        return self._traverse(lambda t: helpers.default(t.shift(num, cutoff), t))
-
-    def _subst_or_none(self, variable: int, term: Term) -> Term | None:
-        return self._traverse(lambda t: t.subst_or_none())
-
     def _free_variables(self) -> set[str]:
         vars_instance = self.instance.free_variables()
-        vars_defaults = set(t.free_variables() for t in self.defaults().values())
-        vars_methods = set(t.free_variables() for t in self.methods().values())
-        return vars_instance | vars_defaults | vars_methods
+        vars_attributes = set().union(*(t.free_variables() for t in self._attributes.values()))
+        vars_methods = set().union(*(t.free_variables() for t in self._methods.values()))
+        return vars_instance | vars_attributes | vars_methods
+
+    def _free_indices(self) -> set[int]:
+        indices_instance = self.instance.free_indices()
+        indices_attributes = set().union(*(t.free_indices() for t in self._attributes.values()))
+        indices_methods = set().union(*(t.free_indices() for t in self._methods.values()))
+        return indices_instance | indices_attributes | indices_methods
+
+    def _max_free_index(self) -> int:
+        return max(self.instance.max_free_index(),
+                   max((t.max_free_index() for t in self._attributes.values()), default=-1),
+                   max((t.max_free_index() for t in self._methods.values()), default=-1))
 
     def _applicable(self, arg: Term):
         if not isinstance(arg, String):
             return False
         k = arg.value
-        if k in self.attributes().keys() or self.methods().keys():
+        if k in self._attributes or k in self._methods:
             return True
         else:
             return False
@@ -891,7 +1329,7 @@ class PGSNObject(Unary):
         assert False
 
 
-@frozen
+@frozen(cache_hash=True)
 class Instance(ConstMixin, Unary):
 
     def _applicable(self, arg: Term) -> bool:
@@ -908,7 +1346,7 @@ class Instance(ConstMixin, Unary):
 
 # List functions
 
-@frozen
+@frozen(cache_hash=True)
 class Cons(ConstMixin, Builtin):
     arity = 2
 
@@ -916,9 +1354,9 @@ class Cons(ConstMixin, Builtin):
         return isinstance(args[1], List)
 
     def _apply_args(self, args: tuple[Term, List]):
-        return evolve(args[1], terms=(args[0],) + args[1].terms)
+        return args[1].evolve(terms=args[1].terms.cons(args[0]))
 
-@frozen
+@frozen(cache_hash=True)
 class Head(ConstMixin, Unary):
 
     def _applicable(self, arg: Term):
@@ -927,14 +1365,14 @@ class Head(ConstMixin, Unary):
     def _apply_arg(self, arg: List) -> Term:
         return arg.terms[0]
 
-@frozen
+@frozen(cache_hash=True)
 class Tail(ConstMixin, Unary):
 
     def _applicable(self, arg: Term):
         return isinstance(arg, List) and len(arg.terms) >= 1
 
     def _apply_arg(self, arg: List) -> List:
-        return List(terms=arg.terms[1:], is_named=self.is_named)
+        return List.build(terms=arg.terms.tail(), is_named=self.is_named)
 
 
 class Index(ConstMixin, Builtin):
@@ -947,7 +1385,15 @@ class Index(ConstMixin, Builtin):
         return args[0].terms[args[1].value]
 
 
-@frozen
+# fun applied in place to arg1 and arg2 if it is a binary builtin which applies to them, or None.
+# The folds apply it so to one element per step, instead of building the application.
+def _apply_binary_or_none(fun: Term, arg1: Term, arg2: Term) -> Term | None:
+    if isinstance(fun, Builtin) and fun.arity == 2:
+        return fun.apply_args_or_none((arg1, arg2))
+    return None
+
+
+@frozen(cache_hash=True)
 class Fold(ConstMixin, Builtin):
     arity = 3
 
@@ -957,19 +1403,83 @@ class Fold(ConstMixin, Builtin):
         if not isinstance(args[2], List):
             return False
         return True
+
+    # Lazy right fold, one element per step.  A binary builtin is folded by FoldFromRight instead.
     def _apply_args(self, args: tuple[Term,...]) -> Term:
         fun = args[0]
         init = args[1]
         arg_list = args[2].terms
         if len(arg_list) == 0:
             return init
-        list_head = arg_list[0]
-        list_rest = arg_list[1:]
-        rest = List(terms=list_rest, is_named=self.is_named)
-        return fun(list_head)(self(fun)(init)(rest))
+        if isinstance(fun, Builtin) and fun.arity == 2:
+            index = Integer.build(is_named=self.is_named, value=len(arg_list))
+            return FoldFromRight.build(is_named=self.is_named)(fun)(init)(args[2])(index)
+        rest = List.build(terms=arg_list.tail(), is_named=self.is_named)
+        return fun(arg_list.head())(self(fun)(init)(rest))
 
 
-@frozen
+# Right fold of a binary builtin over the elements before the index, from the last one, one element per
+# step.  The builtin is applied in place as long as it applies, and the applications are built otherwise.
+@frozen(cache_hash=True)
+class FoldFromRight(ConstMixin, Builtin):
+    arity = 4
+
+    def _applicable_args(self, args: tuple[Term,...]):
+        return isinstance(args[2], List) and isinstance(args[3], Integer)
+
+    def _apply_args(self, args: tuple[Term,...]) -> Term:
+        fun = args[0]
+        acc = args[1]
+        k = args[3].value
+        if k == 0:
+            return acc
+        arg = args[2].terms[k - 1]
+        applied = _apply_binary_or_none(fun, arg, acc)
+        acc = fun(arg)(acc) if applied is None else applied
+        index = Integer.build(is_named=self.is_named, value=k - 1)
+        return self(fun)(acc)(args[2])(index)
+
+
+@frozen(cache_hash=True)
+class FoldLeft(ConstMixin, Builtin):
+    arity = 3
+
+    def _applicable_args(self, args: tuple[Term,...]):
+        return isinstance(args[2], List)
+
+    # Lazy left fold, one element per step.  The accumulator is built up unevaluated, unless fun is a binary
+    # builtin which applies to it.
+    def _apply_args(self, args: tuple[Term,...]) -> Term:
+        fun = args[0]
+        acc = args[1]
+        arg_list = args[2].terms
+        if len(arg_list) == 0:
+            return acc
+        applied = _apply_binary_or_none(fun, acc, arg_list.head())
+        rest = List.build(terms=arg_list.tail(), is_named=self.is_named)
+        return self(fun)(fun(acc)(arg_list.head()) if applied is None else applied)(rest)
+
+
+# Whether the term has no further reduction step.  A term holding a suspension of pgsn.machine, whose free
+# index is unbounded, is not known to be irreducible until the machine normalizes it.
+def _irreducible(t: Term) -> bool:
+    if t.is_normal_form():
+        return True
+    if not t.is_named and t.max_free_index() == sys.maxsize:
+        return False
+    return t.eval_or_none() is None
+
+
+# Strict left fold, one element per step.  It proceeds only when the accumulator has no further reduction
+# step, so that the accumulator never grows.  The result is the same as FoldLeft.
+@frozen(cache_hash=True)
+class FoldLeftStrict(FoldLeft):
+
+    def _applicable_args(self, args: tuple[Term,...]):
+        return _irreducible(args[1]) and isinstance(args[2], List)
+
+
+@frozen(cache_hash=True)
 class Map(ConstMixin, Builtin):
     arity = 2
 
@@ -983,12 +1493,12 @@ class Map(ConstMixin, Builtin):
         arg = args[1]
         arg_list = arg.terms
         map_list = tuple((fun(t) for t in arg_list))
-        map_result = List(terms=map_list, is_named=self.is_named)
+        map_result = List.build(terms=map_list, is_named=self.is_named)
         return map_result
 
 
 # Integer functions
-@frozen
+@frozen(cache_hash=True)
 class Plus(ConstMixin, Builtin):
     arity = 2
 
@@ -1034,7 +1544,7 @@ class Equal(ConstMixin, Builtin):
         return all((not isinstance(arg, App) and not isinstance(arg, Abs) for arg in args))
 
     def _apply_args(self, args: tuple[Term,...]):
-        return Boolean.build(is_named=self.is_named, value=args[0] == args[1])
+        return Boolean.build(is_named=self.is_named, value=same_term(args[0], args[1]))
 
 
 class HasLabel(ConstMixin, Builtin):
@@ -1056,8 +1566,7 @@ class AddAttribute(ConstMixin, Builtin):
         return isinstance(terms[0], Record) and isinstance(terms[1], String)
 
     def _apply_args(self, terms: tuple[Term,...]):
-        attrs = terms[0].attributes()
-        attrs[terms[1].value] = terms[2]
+        attrs = terms[0].attributes().set(terms[1].value, terms[2])
         return Record.build(is_named=self.is_named, attributes=attrs)
 
 
@@ -1068,8 +1577,7 @@ class RemoveAttribute(ConstMixin, Builtin):
         return isinstance(terms[0], Record) and isinstance(terms[1], String)
 
     def _apply_args(self, terms: tuple[Term,...]):
-        attrs = terms[0].attributes()
-        del attrs[terms[1].value]
+        attrs = terms[0].attributes().delete(terms[1].value)
         return Record.build(is_named=self.is_named, attributes=attrs)
 
 
@@ -1079,7 +1587,7 @@ class ListLabels(ConstMixin, Unary):
         return isinstance(term, Record)
 
     def _apply_arg(self, term: Term):
-        labels = map(lambda l: String(is_named=self.is_named, value=l), term.attributes())
+        labels = map(lambda l: String.build(is_named=self.is_named, value=l), term.attributes())
         return List.build(is_named=self.is_named, terms=tuple(labels))
 
 
@@ -1090,11 +1598,7 @@ class OverwriteRecord(ConstMixin, Builtin):
         return isinstance(terms[0], Record) and isinstance(terms[1], Record)
 
     def _apply_args(self, terms: tuple[Term,...]):
-        r1 = terms[0].attributes()
-        r2 = terms[1].attributes()
-        r = r1
-        for k, t in r2.items():
-            r[k] = t
+        r = terms[0].attributes() | terms[1].attributes()
         return Record.build(is_named=self.is_named, attributes=r)
 
 
@@ -1109,45 +1613,137 @@ class Formatter(ConstMixin, Builtin):
         if not isinstance(terms[1], Record):
             return False
         try:
-            python_vals = to_python(terms[1])
+            python_vals = to_python(terms[1], 1000)
             _ = terms[0].value.format(**python_vals)
             return True
         except (KeyError, TypeError, ValueError):
             return False
 
     def _apply_args(self, terms: tuple[Term,...]):
-        python_vals = to_python(terms[1])
+        python_vals = to_python(terms[1], 1000)
         return String.build(is_named=self.is_named, value=terms[0].value.format(**python_vals))
 
+    # The values are converted and formatted once
+    def _apply_args_or_none(self, terms: tuple[Term,...]):
+        if not len(terms) == 2 or not isinstance(terms[0], String) or not isinstance(terms[1], Record):
+            return None
+        try:
+            value = terms[0].value.format(**to_python(terms[1], 1000))
+        except (KeyError, TypeError, ValueError):
+            return None
+        return String.build(is_named=self.is_named, value=value)
+
+
+
+def value_of(term: Term, steps=1000, engine='substitution', checked: bool | None = None) -> Any:
+    if checked is not None and checked != _checked:
+        with checked_mode(checked):
+            return value_of(term, steps, engine)
+    if engine != 'substitution':
+        term = term.fully_eval(steps, engine=engine)
+    return to_python(term, steps)
+
+
+_data_types = (String, Integer, Boolean, List, Record, PGSNObject)
+
+
+# The conversion is on demand and in one pass.  Subterms are reduced to weak head normal forms when they
+# are converted, sharing the budget of steps steps, and the methods of objects are not evaluated.
+# A subterm shared in the term is converted once, and its Python value is shared in the result.
+def to_python(t: Term, steps=100000) -> Any:
+    values: dict[int, Any] = {}
+    forms: dict[int, Term] = {}
+    # Keeps the converted terms alive, so that their ids are not reused
+    seen: list[Term] = []
+    stack = [t]
+    while stack:
+        term = stack[-1]
+        if id(term) in values:
+            stack.pop()
+            continue
+        form = forms.get(id(term))
+        if form is None:
+            form = term
+            if not isinstance(term, _data_types):
+                form, steps = _reduce(term if not term.is_named else term.remove_name(), steps, weak=True)
+            forms[id(term)] = form
+            seen.append(term)
+        match form:
+            case String() | Integer() | Boolean():
+                value = form.value
+            case List():
+                pending = [t1 for t1 in form.terms if id(t1) not in values]
+                if pending:
+                    stack.extend(reversed(pending))
+                    continue
+                value = [values[id(t1)] for t1 in form.terms]
+            case Record() | PGSNObject():
+                attr = form.attributes()
+                pending = [t1 for t1 in attr.values() if id(t1) not in values]
+                if pending:
+                    stack.extend(reversed(pending))
+                    continue
+                value = {k: values[id(t1)] for k, t1 in attr.items()}
+                if isinstance(form, PGSNObject):
+                    value["__" + form.instance.name + "__"] = True
+            case _:
+                raise ValueError(f'PGSN term {type(form)} does not normalizes a Python value')
+        values[id(term)] = value
+        stack.pop()
+    return values[id(t)]
+
+
+# Persistent stack of arguments.  The first argument is on the top.
+@frozen
+class ArgStack:
+    top: Term | None = field(default=None)
+    rest: ArgStack | None = field(default=None)
+    size: int = field(default=0)
 
-
-def value_of(term: Term, steps=1000) -> Any:
-    t = term.fully_eval(steps)
-    return to_python(t)
-
-
-def to_python(t: Term) -> Any:
-    match t:
-        case String():
-            return t.value
-        case Integer():
-            return t.value
-        case Boolean():
-            return t.value
-        case List():
-            terms = t.terms
-            return [value_of(t1) for t1 in terms]
-        case Record():
-            attr = t.attributes()
-            return {k: value_of(t1) for k, t1 in attr.items()}
-        case PGSNObject():
-            attr = t.attributes()
-            cls_name = t.instance.name
-            attrs =  {k: value_of(t1) for k, t1 in attr.items()}
-            attrs["__" + cls_name + "__"] = True
-            return attrs
-        case _:
-            raise ValueError(f'PGSN term {type(t)} does not normalizes a Python value')
+    @classmethod
+    def from_tuple(cls, args: tuple[Term, ...]) -> ArgStack:
+        stack = _empty_args
+        for arg in reversed(args):
+            stack = stack.push(arg)
+        return stack
+
+    def push(self, arg: Term) -> ArgStack:
+        return ArgStack(top=arg, rest=self, size=self.size + 1)
+
+    # The first n arguments
+    def take(self, n: int) -> tuple[Term, ...]:
+        args = []
+        stack = self
+        while len(args) < n and stack.size > 0:
+            args.append(stack.top)
+            stack = stack.rest
+        return tuple(args)
+
+    def drop(self, n: int) -> ArgStack:
+        stack = self
+        for _ in range(n):
+            stack = stack.rest
+        return stack
+
+    # The stack whose i-th argument is replaced by arg.  The arguments after i are shared.
+    def replace(self, i: int, arg: Term) -> ArgStack:
+        prefix = self.take(i)
+        stack = self.drop(i + 1).push(arg)
+        for t in reversed(prefix):
+            stack = stack.push(t)
+        return stack
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        stack = self
+        while stack.size > 0:
+            yield stack.top
+            stack = stack.rest
+
+
+_empty_args = ArgStack()
 
 
 # Evaluation Context
@@ -1155,14 +1751,16 @@ def to_python(t: Term) -> Any:
 @frozen
 class Context:
     head: Term = field(validator=helpers.not_none)
-    args: tuple[Term, ...] = field(default=(), validator=helpers.not_none)
+    args: ArgStack = field(default=_empty_args, validator=helpers.not_none)
 
     @classmethod
-    def build(cls, head, args):
-        if isinstance(head, App):
-            return cls.build(head=head.t1, args=(head.t2,) + args)
-        else:
-            return cls(head=head, args=args)
+    def build(cls, head, args: ArgStack | tuple[Term, ...]):
+        if isinstance(args, tuple):
+            args = ArgStack.from_tuple(args)
+        while isinstance(head, App):
+            args = args.push(head.t2)
+            head = head.t1
+        return cls(head=head, args=args)
 
     def evolve(self, head=None, args=None):
         if head is None:
@@ -1174,34 +1772,130 @@ class Context:
     def to_term(self) -> Term:
         term = self.head
         for arg in self.args:
-            term = term(arg)
+            term = App.term(term, arg)
         return term
 
-    def stack(self, arg: Term):
-        return self.evolve(args=self.args + (arg,))
-
     # If None is returned, the reduction is terminated
     # outermost leftmost reduction.
     def reduce_or_none(self) -> Context | None:
-        if isinstance(self.head, Abs) and len(self.args) > 0:
-            head_substituted = (self.head.t.subst(0, self.args[0].shift(1, 0))
-                                .shift(-1, 0))
-            return self.evolve(head=head_substituted, args=self.args[1:])
-        if isinstance(self.head, Builtin) and self.head.applicable_args(self.args):
-            reduced, rest = self.head.apply_args(self.args)
-            return self.evolve(head=reduced, args=rest)
+        if self.args.size > 0:
+            rule = _head_rule(type(self.head))
+            if rule is not None:
+                reduced = rule(self)
+                if reduced is not None:
+                    return reduced
         head_reduced = self.head.eval_or_none()
         if head_reduced is not None:
             return self.evolve(head=head_reduced)
-        for i in range(len(self.args)):
-            arg_reduced = self.args[i].eval_or_none()
+        for i, arg in enumerate(self.args):
+            arg_reduced = arg.eval_or_none()
             if arg_reduced is not None:
-                new_args = self.args[0:i] + (arg_reduced,) + self.args[i + 1:]
-                return self.evolve(args=new_args)
+                return self.evolve(args=self.args.replace(i, arg_reduced))
         else:
             return None
 
+    # A step towards the weak head normal form.  Abstractions, data and partial applications are values.
+    # The arguments of a builtin are reduced to weak head normal forms until the builtin applies,
+    # and normalized only if it still does not.
+    def reduce_whnf_or_none(self) -> Context | None:
+        head = self.head
+        if self.args.size == 0:
+            return None
+        rule = _head_rule(type(head))
+        if rule is _beta_rule:
+            return rule(self)
+        if rule is None or self.args.size < head.arity:
+            return None
+        reduced = rule(self)
+        if reduced is not None:
+            return reduced
+        for i, arg in enumerate(self.args.take(head.arity)):
+            if isinstance(arg, App):
+                arg_reduced = arg.to_context().reduce_whnf_or_none()
+                if arg_reduced is not None:
+                    return self.evolve(args=self.args.replace(i, arg_reduced.to_term()))
+        return self.reduce_or_none()
+
+
+def _beta_rule(c: Context) -> Context:
+    unfolded = _unfold_fix_or_none(c.head, c.args.top)
+    if unfolded is not None:
+        return c.evolve(head=unfolded, args=c.args.rest)
+    return c.evolve(head=c.head.t.instantiate(c.args.top), args=c.args.rest)
+
+
+def _builtin_rule(c: Context) -> Context | None:
+    reduced = c.head.apply_args_or_none(c.args.take(c.head.arity))
+    if reduced is None:
+        return None
+    return c.evolve(head=reduced, args=c.args.drop(c.head.arity))
+
+
+_head_rules: dict[type, Any] = {}
+
+
+# The rule reducing a context with arguments by its head, looked up by the type of the head.
+# None if the head is reduced only inside.
+def _head_rule(cls: type):
+    try:
+        return _head_rules[cls]
+    except KeyError:
+        pass
+    if issubclass(cls, Abs):
+        rule = _beta_rule
+    elif issubclass(cls, Builtin):
+        rule = _builtin_rule
+    else:
+        rule = None
+    _head_rules[cls] = rule
+    return rule
+
+
+# Reduction by the substitution engine.  The spine is kept as a context between steps.
+def _normal_form(t: Term, steps: int, weak: bool = False) -> Term:
+    return _reduce(t, steps, weak)[0]
+
+
+# The reduced term, and the number of steps left.
+# The normal form of a closed term is stored in the normal form cache.
+def _reduce(t: Term, steps: int, weak: bool) -> tuple[Term, int]:
+    c = Context.build(head=t, args=())
+    for i in range(steps):
+        c_reduced = c.reduce_whnf_or_none() if weak else c.reduce_or_none()
+        if _checked:
+            assert c_reduced is None or c_reduced != c  # should progress
+        if c_reduced is None:
+            reduced = c.to_term()
+            if not weak and _normal_form_cache is not None and t.is_closed:
+                _normal_form_cache.store(t, reduced)
+            return reduced, steps - i
+        c = c_reduced
+    raise LambdaInterpreterError('Reduction did not terminate', c.to_term())
+
+
+# The fixed point combinator λf. (λx. f (x x)) (λx. f (x x)), in the nameless form
+_self_application = App.nameless(t1=Variable.nameless(num=0), t2=Variable.nameless(num=0))
+_fix_half = Abs.nameless(v=None, t=App.nameless(t1=Variable.nameless(num=1), t2=_self_application))
+fix_combinator = Abs.nameless(v=None, t=App.nameless(t1=_fix_half, t2=_fix_half))
+
+
+# Recursion is unfolded without copying the recursive body.  fix F steps to F (fix F), and
+# (λx. F (x x)) (λx. F (x x)) to F applied to the same redex, which serves as the back-reference.
+# Each unfolding counts as one step.
+def _unfold_fix_or_none(head: Abs, arg: Term) -> Term | None:
+    if head == fix_combinator:
+        return App.term(arg, App.term(head, arg))
+    body = head.t
+    if isinstance(body, App) and body.t2 == _self_application and same_term(head, arg) \
+            and 0 not in body.t1.free_indices():
+        return App.term(body.t1.shift(-1, 0), App.term(head, arg))
+    return None
+
 
 json_term_converter = cattrs.preconf.json.make_converter()
 union_strategy = functools.partial(configure_tagged_union, tag_name="type_name")
 include_subclasses(Term, json_term_converter, union_strategy=union_strategy)
+# List.terms is a PVector, serialized as the tuple it replaces
+json_term_converter.register_unstructure_hook(PVector, json_term_converter.get_unstructure_hook(tuple[Term, ...]))
+# Record attributes and class members are PMaps, serialized as dicts
+json_term_converter.register_unstructure_hook(PMap, json_term_converter.get_unstructure_hook(dict[str, Term]))
@@ -1,5 +1,10 @@
-import pgsn.dsl
-from src.pgsn import pgsn_term
+import io
+import json
+
+import attrs
+
+from pgsn import dsl, gsn
+from pgsn import json_codec, binary_codec, pgsn_term
 from pgsn.gsn import goal, evidence, immediate
 from pgsn.dsl import lambda_abs, variable, define_class, base_class, list_term, record
 
@@ -11,18 +16,18 @@ goal_template = lambda_abs(variable("desc"),
          support=evidence(description=variable("desc")))
 )
 
-goals = stdlib.map_term(goal_template, requirements)
+goals = dsl.map_term(goal_template, requirements)
 
-secure_goal = gsn_term.goal(
+secure_goal = gsn.goal(
     description="Security requirements fulfilled",
     support=immediate(goals)
 )
 
 def test_var():
     var_x = variable("x")
-    s = pgsn.dsl.json_dumps(var_x, indent=2)
-    t = pgsn.dsl.json_loads(s)
-    s1 = pgsn.dsl.json_dumps(t, indent=2)
+    s = dsl.json_dumps(var_x, indent=2)
+    t = dsl.json_loads(s)
+    s1 = dsl.json_dumps(t, indent=2)
     assert var_x == t
     assert s == s1
 
@@ -30,9 +35,9 @@ def test_var():
 def test_term_id():
     x = variable('x')
     id_f = lambda_abs(x, x)
-    s = pgsn.dsl.json_dumps(id_f, indent=2)
-    t = pgsn.dsl.json_loads(s)
-    s1 = pgsn.dsl.json_dumps(t, indent=2)
+    s = dsl.json_dumps(id_f, indent=2)
+    t = dsl.json_loads(s)
+    s1 = dsl.json_dumps(t, indent=2)
     assert id_f == t
     assert s == s1
 
@@ -41,9 +46,9 @@ def test_term_id_id():
     x = variable('x')
     id_f = lambda_abs(x, x)
     t = id_f(id_f)
-    s = pgsn.dsl.json_dumps(id_f(id_f), indent=2)
-    t1 = pgsn.dsl.json_loads(s)
-    s1 = pgsn.dsl.json_dumps(t, indent=2)
+    s = dsl.json_dumps(id_f(id_f), indent=2)
+    t1 = dsl.json_loads(s)
+    s1 = dsl.json_dumps(t, indent=2)
     assert t == t1
     assert s == s1
 
@@ -52,9 +57,9 @@ def test_list():
     x = variable("x")
     y = variable("y")
     z = list_term((x, y))
-    s = pgsn.dsl.json_dumps(z, indent=2)
-    t1 = pgsn.dsl.json_loads(s)
-    s1 = pgsn.dsl.json_dumps(z, indent=2)
+    s = dsl.json_dumps(z, indent=2)
+    t1 = dsl.json_loads(s)
+    s1 = dsl.json_dumps(z, indent=2)
     assert z == t1
     assert s == s1
 
@@ -63,45 +68,182 @@ def test_record():
     x = variable("x")
     y = variable("y")
     z = record({"x": x, "y": y})
-    s = pgsn.dsl.json_dumps(z, indent=2)
-    t1 = pgsn.dsl.json_loads(s)
-    s1 = pgsn.dsl.json_dumps(z, indent=2)
+    s = dsl.json_dumps(z, indent=2)
+    t1 = dsl.json_loads(s)
+    s1 = dsl.json_dumps(z, indent=2)
     assert z == t1
     assert s == s1
 
 
 def test_class():
     cls = define_class(name="test", inherit=base_class)
-    s = pgsn.dsl.json_dumps(cls, indent=2)
-    t1 = pgsn.dsl.json_loads(s)
-    s1 = pgsn.dsl.json_dumps(cls, indent=2)
+    s = dsl.json_dumps(cls, indent=2)
+    t1 = dsl.json_loads(s)
+    s1 = dsl.json_dumps(cls, indent=2)
     assert cls == t1
     assert s == s1
 
 
 
 def test_json_1():
-    s = pgsn.dsl.json_dumps(goal_template, indent=2)
-    t = pgsn.dsl.json_loads(s)
-    s1 = pgsn.dsl.json_dumps(t, indent=2)
+    s = dsl.json_dumps(goal_template, indent=2)
+    t = dsl.json_loads(s)
+    s1 = dsl.json_dumps(t, indent=2)
     #assert goal_template == t # structural (==) is very slow
     assert s == s1
 
 
 def test_json_2():
-    s = pgsn.dsl.json_dumps(goals, indent=2)
-    t = pgsn.dsl.json_loads(s)
-    s1 = pgsn.dsl.json_dumps(t, indent=2)
+    s = dsl.json_dumps(goals, indent=2)
+    t = dsl.json_loads(s)
+    s1 = dsl.json_dumps(t, indent=2)
     #assert goals == t # structural (==) is very slow
     assert s == s1
 
 
 def test_json_3():
-    s = pgsn.dsl.json_dumps(secure_goal, indent=2)
-    t = pgsn.dsl.json_loads(s)
-    s1 = pgsn.dsl.json_dumps(t, indent=2)
+    s = dsl.json_dumps(secure_goal, indent=2)
+    t = dsl.json_loads(s)
+    s1 = dsl.json_dumps(t, indent=2)
     #assert secure_goal == t # structural (==) is very slow
     assert s == s1
     v = t.fully_eval()
     assert v
 
+
+def test_cattrs_compatibility():
+    x = variable('x')
+    deep = x
+    for i in range(100):
+        deep = dsl.constant('c')(deep) if i % 2 else list_term((deep, record({'n': dsl.integer(i)})))
+    terms = [goal_template, goals, secure_goal, secure_goal.fully_eval(), define_class(name="test", inherit=base_class),
+             lambda_abs(x, deep).remove_name()]
+    options = [{}, dict(indent=2), dict(separators=(',', ':')), dict(indent='\t', sort_keys=True),
+               dict(ensure_ascii=False, indent=0)]
+    for t in terms:
+        d = pgsn_term.json_term_converter.unstructure(t, unstructure_as=pgsn_term.Term)
+        for kwargs in options:
+            assert json_codec.dumps(t, **kwargs) == json.dumps(d, **kwargs)
+        assert json_codec.loads(json.dumps(d)) == pgsn_term.json_term_converter.structure(d, pgsn_term.Term)
+
+
+def test_missing_fields():
+    # fields with a default, such as meta_info, may be left out of the document
+    def strip(d):
+        if isinstance(d, list):
+            return [strip(x) for x in d]
+        if not isinstance(d, dict):
+            return d
+        if not isinstance(d.get('type_name'), str):
+            return {k: strip(v) for k, v in d.items()}
+        cls, _ = json_codec.term_class(d['type_name'])
+        defaults = {a.name: a.default for a in attrs.fields(cls) if a.default is not attrs.NOTHING}
+        return {k: strip(v) for k, v in d.items() if k not in defaults or v != defaults[k] and v not in ({}, [])}
+    x = variable('x')
+    one = dsl.integer(1)
+    cls = define_class(name="test", inherit=base_class)
+    terms = [lambda_abs(x, x)(one), lambda_abs(x, x)(one).remove_name(), cls, cls.fully_eval()]
+    for t in terms:
+        d = json.loads(json_codec.dumps(t))
+        s = json.dumps(strip(d))
+        assert 'meta_info' not in s
+        assert json_codec.loads(s) == t
+        assert json_codec.loads(s).fully_eval() == t.fully_eval()
+    assert json_codec.loads('{"type_name": "Integer", "is_named": true, "value": 1}') == one
+
+
+def test_loads_options():
+    s = dsl.json_dumps(secure_goal)
+    names = []
+
+    def hook(d):
+        names.append(d.get('type_name'))
+        return d
+    assert dsl.json_loads(s, object_hook=hook) == dsl.json_loads(s)
+    assert 'App' in names
+    assert dsl.json_loads(s, object_pairs_hook=dict) == dsl.json_loads(s)
+    t = dsl.json_loads(dsl.json_dumps(dsl.integer(7)), parse_int=lambda v: int(v) * 2)
+    assert t.value == 14
+
+
+def test_deep():
+    x = variable('x')
+    t = x
+    for i in range(20000):
+        t = dsl.constant('c')(t) if i % 2 else list_term((t, record({'n': dsl.integer(i)})))
+    f = io.StringIO()
+    dsl.json_dump(lambda_abs(x, t), f, separators=(',', ':'))
+    t1 = dsl.json_load(io.StringIO(f.getvalue()))
+    assert dsl.json_dumps(t1, separators=(',', ':')) == f.getvalue()
+
+
+def test_dag():
+    tree = dsl.json_dumps(secure_goal)
+    s = dsl.json_dumps(secure_goal, dag=True)
+    assert len(s) < len(tree) / 2
+    assert dsl.json_dumps(dsl.json_loads(s)) == dsl.json_dumps(dsl.json_loads(tree))
+    copy = dsl.json_loads(dsl.json_dumps(goal_template))
+    var_x = pgsn_term.Variable.named(name='x', meta_info={'name': 'x'})
+    t = dsl.json_loads(dsl.json_dumps(list_term((goal_template, copy, var_x, variable('x'))), dag=True))
+    assert t.terms[0] is t.terms[1]
+    assert t.terms[2] == t.terms[3] and t.terms[2].meta_info == {'name': 'x'} and not t.terms[3].meta_info
+
+
+def test_binary(tmp_path):
+    data = dsl.binary_dumps(secure_goal)
+    assert binary_codec.is_binary(data)
+    assert len(data) < len(dsl.json_dumps(secure_goal, dag=True)) / 2
+    expected = dsl.json_dumps(dsl.json_loads(dsl.json_dumps(secure_goal)))
+    assert dsl.json_dumps(dsl.binary_loads(data)) == expected
+    path = tmp_path / 'secure.pgsn'
+    with open(path, 'wb') as f:
+        dsl.binary_dump(secure_goal, f)
+    assert binary_codec.is_binary_file(str(path))
+    with open(path, 'rb') as f:
+        assert dsl.json_dumps(dsl.binary_load(f)) == expected
+    var_x = pgsn_term.Variable.named(name='x', meta_info={'name': 'x', 'line': -1, 'weight': 0.5, 'tags': None})
+    t = list_term((goal_template, goal_template, var_x, variable('x'), dsl.integer(-300)))
+    t1 = dsl.binary_loads(dsl.binary_dumps(t))
+    assert t1 == t
+    assert t1.terms[0] is t1.terms[1]
+    assert t1.terms[2].meta_info == var_x.meta_info and not t1.terms[3].meta_info
+    assert t1.terms[4].value == -300
+
+
+def test_term_store(tmp_path):
+    x = variable('x')
+    shared = record({'a': dsl.plus(dsl.integer(1))(dsl.integer(1))})
+    items = list_term(tuple(lambda_abs(x, list_term((x, shared)))(dsl.integer(i)) for i in range(100)))
+    t = lambda_abs(x, x)(items).remove_name()
+    path = tmp_path / 'items.pgsn'
+    with open(path, 'wb') as f:
+        dsl.binary_dump(t, f)
+    with binary_codec.TermStore(str(path)) as store:
+        root = store.root_term()
+        assert root._source is not None
+        assert root.max_free_index() == -1 and root._source is not None
+        w = root.whnf()
+        assert isinstance(w, pgsn_term.List) and root._source is None
+        assert pgsn_term.value_of(w.terms[7], steps=10) == [7, {'a': 2}]
+        assert all(u._source is not None for u in w.terms[8:])
+        assert w.terms[9].max_free_index() == -1 and w.terms[9]._source is not None
+        assert store.term(store.root) is root
+        assert pgsn_term.value_of(root, steps=1000) == pgsn_term.value_of(t, steps=1000)
+        assert store.root_term() == t
+    with dsl.binary_open(str(path)) as store:
+        assert store.root_term().fully_eval() == t.fully_eval()
+    body = lambda_abs(x, dsl.constant('c')(x)).remove_name().t
+    with open(path, 'wb') as f:
+        dsl.binary_dump(body, f)
+    with dsl.binary_open(str(path)) as store:
+        assert store.root_term().max_free_index() == 0 and store.root_term()._source is not None
+
+
+def test_streaming_load():
+    t = list_term((secure_goal, dsl.string('安全 é')))
+    for dag in (False, True):
+        s = dsl.json_dumps(t, dag=dag, indent=1, ensure_ascii=False)
+        expected = dsl.json_dumps(dsl.json_loads(s))
+        for chunk_size in (1, 7, 4096):
+            assert dsl.json_dumps(json_codec.load(io.StringIO(s), chunk_size)) == expected
+            assert dsl.json_dumps(json_codec.load(io.BytesIO(s.encode('utf-8')), chunk_size)) == expected
@@ -1,12 +1,39 @@
 from pgsn import dsl
-from src.pgsn.pgsn_term import List
+from pgsn.pgsn_term import List
+from pgsn.persistent import PVector
 
 
 def test_list():
-    x = stdlib.constant('x')
-    y = stdlib.constant('y')
-    z = stdlib.constant('z')
+    x = dsl.constant('x')
+    y = dsl.constant('y')
+    z = dsl.constant('z')
     ll = List.named(terms=(x, y, z))
     assert ll.terms == (x, y, z)
-    i = stdlib.integer(1)
-    assert ll(i).eval().name == 'y'
\ No newline at end of file
+    i = dsl.integer(1)
+    assert ll(i).eval().name == 'y'
+
+def test_persistent_vector():
+    v = PVector(range(20))
+    assert list(v) == list(range(20))
+    assert v[7] == 7 and v[-1] == 19
+    assert list(v.cons(-1)) == list(range(-1, 20))
+    assert list(v[5:]) == list(range(5, 20))
+    w = v.set(10, 'a')
+    assert w[10] == 'a' and v[10] == 10
+    assert v.cons(-1).tail() == v
+    assert hash(v.drop(3)) == hash(PVector(range(3, 20)))
+    assert v == tuple(range(20)) and hash(v) == hash(tuple(range(20)))
+    assert len({v, tuple(range(20))}) == 1
+    assert v != list(range(20))
+    u = PVector.from_iterable([1, -5, 3])
+    assert u.max(lambda x: x, default=-99) == 3
+    assert u.max(abs, default=-99) == 5
+    assert u.cons(-7).max(abs, default=-99) == 7
+
+
+def test_cons_tail():
+    x = dsl.constant('x')
+    y = dsl.constant('y')
+    ll = dsl.cons(x)(dsl.cons(y)(dsl.empty))
+    assert ll.fully_eval().terms == (x.remove_name(), y.remove_name())
+    assert dsl.tail(ll).fully_eval().terms == (y.remove_name(),)
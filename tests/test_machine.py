@@ -0,0 +1,119 @@
+import pytest
+
+from pgsn import dsl, gsn
+from pgsn.pgsn_term import App, LambdaInterpreterError, value_of
+from pgsn.dsl import lambda_abs, lambda_abs_vars, let
+
+
+x = dsl.variable('x')
+y = dsl.variable('y')
+f = dsl.variable('f')
+one = dsl.integer(1)
+two = dsl.integer(2)
+
+
+def same_normal_form(t, engine='machine'):
+    return t.fully_eval(engine=engine) == t.fully_eval()
+
+
+def test_beta():
+    c = dsl.constant('c')
+    d = dsl.constant('d')
+    p1 = lambda_abs(x, lambda_abs(y, x))
+    assert same_normal_form(p1(c)(d))
+    assert same_normal_form(lambda_abs(y, lambda_abs(x, p1(x)(y))))
+    assert same_normal_form(lambda_abs(y, y(c)(d))(p1))
+
+
+def test_free_variables():
+    z = dsl.variable('z')
+    assert same_normal_form(lambda_abs(x, f(x)(y)))
+    t = lambda_abs(x, lambda_abs(y, x))(f(y))
+    assert t.fully_eval(engine='machine') == lambda_abs(z, f(y)).remove_name()
+    assert same_normal_form(t)
+
+
+def test_builtins():
+    t = lambda_abs_vars((x, y), let(x, dsl.plus(x)(y), dsl.plus(x)(y)))
+    assert t(one)(two).fully_eval(engine='machine').value == 5
+    assert same_normal_form(dsl.guard(dsl.false)(one))
+    assert same_normal_form(dsl.concat(dsl.list_term((one,)), dsl.list_term((two, one))))
+    assert same_normal_form(dsl.integer_sum(dsl.cons(one)(dsl.cons(two)(dsl.empty))))
+    assert isinstance(dsl.plus(one)(dsl.true).fully_eval(engine='machine'), App)
+
+
+def test_gsn():
+    g = gsn.goal(description="System is secure",
+                 support=gsn.strategy(description="Break into sub-goals",
+                                      sub_goals=[gsn.goal(description="Input validated",
+                                                          support=gsn.evidence(description="Static analysis"))]))
+    assert same_normal_form(g)
+    assert value_of(g, engine='machine') == value_of(g)
+    assert same_normal_form(g, engine='need')
+    assert same_normal_form(g, engine='nbe')
+
+
+def test_call_by_need():
+    t = let(x, dsl.plus(one)(one), dsl.list_term((x, x, x, x)))
+    assert same_normal_form(t, engine='need')
+    assert t.fully_eval(steps=3, engine='need') == t.fully_eval()
+    with pytest.raises(LambdaInterpreterError):
+        t.fully_eval(steps=3, engine='machine')
+
+
+def test_call_by_need_loop():
+    omega = lambda_abs(x, x(x))
+    with pytest.raises(LambdaInterpreterError):
+        omega(omega).fully_eval(steps=100, engine='need')
+
+
+def test_nbe():
+    p1 = lambda_abs(x, lambda_abs(y, x))
+    assert same_normal_form(p1(dsl.constant('c'))(dsl.constant('d')), engine='nbe')
+    assert same_normal_form(lambda_abs(f, lambda_abs(x, f(f(x))))(p1(one)), engine='nbe')
+    t = let(x, dsl.plus(one)(one), dsl.list_term((x, x, x, x)))
+    assert t.fully_eval(steps=3, engine='nbe') == t.fully_eval()
+    # The code stays on the terms of the program, and the results of builtins are not compiled
+    assert t.remove_name()._code_cache is not None
+    assert dsl.plus(dsl.integer(40))(two).fully_eval(engine='nbe')._code_cache is None
+
+
+def test_nbe_closed_terms():
+    cls = dsl.define_class(inherit=dsl.base_class, attributes=['a'])
+    objs = dsl.list_term([cls({'a': dsl.plus(dsl.integer(i))(one)}) for i in range(10)] + [cls({'a': one})] * 3)
+    assert same_normal_form(objs, engine='nbe')
+    assert same_normal_form(lambda_abs(x, dsl.list_term((x, x)))(cls({'a': two})), engine='nbe')
+
+
+def test_fix():
+    s = dsl.variable('self')
+    m = dsl.variable('m')
+    a = dsl.variable('acc')
+    loop = dsl.fix(lambda_abs_vars((s, m, a),
+                                   dsl.if_then_else(dsl.equal(m)(dsl.integer(0)))(a)
+                                   (s(dsl.plus(m)(dsl.integer(-1)))(dsl.plus(a)(m)))))
+    t = loop(dsl.integer(10))(dsl.integer(0))
+    assert t.fully_eval().value == 55
+    for engine in ('machine', 'need', 'nbe'):
+        assert same_normal_form(t, engine=engine)
+    for engine in ('substitution', 'machine', 'need', 'nbe'):
+        with pytest.raises(LambdaInterpreterError):
+            dsl.fix(lambda_abs(x, x)).fully_eval(steps=100, engine=engine)
+
+
+def test_fix_read_back():
+    s = dsl.variable('self')
+    n = dsl.variable('n')
+    steps = dsl.fix(lambda_abs_vars((s, n),
+                                    dsl.if_then_else(dsl.equal(n)(dsl.integer(0)))(dsl.string('done'))
+                                    (dsl.format_string(dsl.string('step {a}'))
+                                     (dsl.record({'a': s(dsl.plus(n)(dsl.integer(-1)))})))))
+    loop = dsl.fix(lambda_abs(s, dsl.equal(s)(s)))
+    for engine in ('substitution', 'machine', 'need', 'nbe'):
+        assert steps(dsl.integer(3)).fully_eval(engine=engine).value == 'step step step done'
+    # The substitution engine slows down as the term grows
+    with pytest.raises(LambdaInterpreterError):
+        loop.fully_eval(steps=100)
+    for engine in ('machine', 'need', 'nbe'):
+        with pytest.raises(LambdaInterpreterError):
+            loop.fully_eval(engine=engine)
@@ -1,17 +1,16 @@
 from pgsn import dsl
-from src.pgsn import pgsn_term
+from pgsn import pgsn_term
 from pgsn.dsl import define_class, is_subclass, is_instance
 
-a = stdlib.string('a')
-b = stdlib.string('b')
-c = stdlib.string('c')
-defaults = stdlib.record({'a': stdlib.boolean(True)})
-self = stdlib.variable('self')
-v = stdlib.lambda_abs(self, stdlib.if_then_else(self(a))(self(b))(self(c)))
+a = dsl.string('a')
+b = dsl.string('b')
+c = dsl.string('c')
+defaults = dsl.record({'a': dsl.boolean(True)})
+self = dsl.variable('self')
+v = dsl.lambda_abs(self, dsl.if_then_else(self(a))(self(b))(self(c)))
 # attrs1 = inherit(defaults)(record_term.record({'value': get_value_term}))
-attrs1 = stdlib.record({'a': stdlib.true})
-cls = define_class(inherit=stdlib.base_class, defaults=defaults, attributes=["a"], methods={})
-test = stdlib.string('test')
+attrs1 = dsl.record({'a': dsl.true})
+cls = define_class(inherit=dsl.base_class, defaults=defaults, attributes=["a"], methods={})
 
 
 cls1 = define_class(inherit=cls, attributes=[])
@@ -32,7 +31,7 @@ def test_subclass():
     assert isinstance(cls1.fully_eval(), pgsn_term.PGSNClass)
     assert is_subclass(cls)(cls).fully_eval().value
     assert is_subclass(cls1)(cls).fully_eval().value
-    assert not is_subclass(stdlib.base_class)(cls).fully_eval().value
+    assert not is_subclass(dsl.base_class)(cls).fully_eval().value
 
 
 obj1 = cls({})
@@ -77,3 +76,13 @@ def test_obj_methods():
     assert obj6('v').fully_eval().value == 2
     assert obj5.v.fully_eval().value == 1
     assert obj6.v.fully_eval().value == 2
+
+
+def test_unused_methods():
+    x = dsl.variable('x')
+    omega = dsl.lambda_abs(x, x(x)(x))
+    loop = dsl.lambda_abs(self, omega(omega))
+    cls4 = define_class(inherit=cls, name='Lazy', attributes=['b'], methods={'loop': loop})
+    obj = cls4({'b': dsl.plus(dsl.integer(1))(dsl.integer(1))})
+    value = pgsn_term.value_of(obj)
+    assert value == {'a': True, 'b': 2, '__Lazy__': True}
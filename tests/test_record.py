@@ -1,29 +1,56 @@
 from pgsn import dsl
 from pgsn.dsl import let, lambda_abs_vars
+from pgsn.persistent import PMap
 
 
 def test_record():
-    x = stdlib.constant('x')
-    y = stdlib.constant('y')
-    z = stdlib.constant('z')
-    r = stdlib.record({'x': x, 'y': y, 'z': z})
-    k1 = stdlib.string('x')
-    k2 = stdlib.string('w')
+    x = dsl.constant('x')
+    y = dsl.constant('y')
+    z = dsl.constant('z')
+    r = dsl.record({'x': x, 'y': y, 'z': z})
+    k1 = dsl.string('x')
+    k2 = dsl.string('w')
     assert r(k1).eval() == x.eval()
     assert r(k2).eval_or_none() is None
 
 
-x = stdlib.variable('x')
-y = stdlib.variable('y')
-z = stdlib.variable('z')
-a = stdlib.variable('a')
-b = stdlib.constant('b')
-c = stdlib.constant('c')
-label_1 = stdlib.string('l1')
-label_2 = stdlib.string('l2')
-r1 = stdlib.record({'l1': a})
-r2 = stdlib.add_attribute(stdlib.empty_record)(label_2)(r1)
-r3 = stdlib.overwrite_record(r1)(r2)
+def test_persistent_map():
+    m = PMap({str(i): i for i in range(100)})
+    assert list(m) == [str(i) for i in range(100)]
+    m1 = m.set('5', 'a').delete('7').set('x', 0)
+    assert m1['5'] == 'a' and '7' not in m1 and list(m1)[-1] == 'x'
+    assert m['5'] == 5 and '7' in m and len(m) == 100
+    assert m == {str(i): i for i in range(100)}
+    assert hash(m1.delete('x')) == hash(PMap(reversed(list(m1.delete('x').items()))))
+    assert {'a': 1} | PMap({'b': 2}) == {'a': 1, 'b': 2}
+    m2 = m
+    for i in range(90):
+        m2 = m2.delete(str(i)).set(str(i), i) if i % 3 else m2.delete(str(i))
+    assert list(m2) == [str(i) for i in range(90, 100)] + [str(i) for i in range(90) if i % 3]
+    assert m2 == {k: int(k) for k in m2} and hash(m2) == hash(PMap(sorted(m2.items())))
+    assert list(m2.map_values(lambda v: -v).items()) == [(k, -v) for k, v in m2.items()]
+
+
+def test_shared_attributes():
+    r = dsl.record({'x': dsl.constant('x'), 'y': dsl.constant('y')})
+    assert isinstance(r.attributes(), PMap)
+    r1 = dsl.add_attribute(r)(dsl.string('z'))(dsl.constant('z'))
+    assert list(r1.fully_eval().attributes().keys()) == ['x', 'y', 'z']
+    r2 = dsl.remove_attribute(r1)(dsl.string('x'))
+    assert list(r2.fully_eval().attributes().keys()) == ['y', 'z']
+
+
+x = dsl.variable('x')
+y = dsl.variable('y')
+z = dsl.variable('z')
+a = dsl.variable('a')
+b = dsl.constant('b')
+c = dsl.constant('c')
+label_1 = dsl.string('l1')
+label_2 = dsl.string('l2')
+r1 = dsl.record({'l1': a})
+r2 = dsl.add_attribute(dsl.empty_record)(label_2)(r1)
+r3 = dsl.overwrite_record(r1)(r2)
 def test_self_reference1():
     assert set(r3.fully_eval().attributes().keys()) == {'l1', 'l2'}
 
@@ -31,8 +58,8 @@ def test_self_reference1():
 def test_self_reference2():
     f = lambda_abs_vars((x, y),
                         let(
-                            y, stdlib.add_attribute(y)(label_2)(x),
-                            stdlib.overwrite_record(x)(y)
+                            y, dsl.add_attribute(y)(label_2)(x),
+                            dsl.overwrite_record(x)(y)
                         )
                         )
     assert set(f(r1)(r2).fully_eval().attributes().keys()) == {'l1', 'l2'}
@@ -40,11 +67,11 @@ def test_self_reference2():
 
 def test_self_reference3():
     f1 = lambda_abs_vars((x, y),
-                         stdlib.overwrite_record(x)(stdlib.add_attribute(y)(label_2)(x))
+                         dsl.overwrite_record(x)(dsl.add_attribute(y)(label_2)(x))
                          )
     assert set(f1(r1)(r2).fully_eval().attributes().keys()) == {'l1', 'l2'}
 
 
 def test_self_reference4():
-    r = stdlib.overwrite_record(r1)(stdlib.add_attribute(r2)(label_2)(r1), )
+    r = dsl.overwrite_record(r1)(dsl.add_attribute(r2)(label_2)(r1), )
     assert set(r.fully_eval().attributes().keys()) == {'l1', 'l2'}
@@ -1,33 +1,34 @@
-import src.pgsn.pgsn_term
+import pytest
+
 from pgsn import dsl
-from src.pgsn import pgsn_term
+from pgsn import pgsn_term
 from pgsn.dsl import lambda_abs, lambda_abs_vars, lambda_abs_keywords, plus, let
 
 
 def test_list():
-    c = stdlib.constant('c')
-    d = stdlib.constant('d')
-    t = stdlib.cons(c)(stdlib.empty)
-    t1 = stdlib.head(t)
-    t2 = stdlib.cons(d)(t)
-    t3 = stdlib.tail(t2)
+    c = dsl.constant('c')
+    d = dsl.constant('d')
+    t = dsl.cons(c)(dsl.empty)
+    t1 = dsl.head(t)
+    t2 = dsl.cons(d)(t)
+    t3 = dsl.tail(t2)
     assert t.fully_eval().terms[0] == c.fully_eval()
     assert t1.fully_eval() == c.fully_eval()
     assert t2.fully_eval().terms == (d.remove_name(), c.remove_name())
     assert t3.fully_eval() == t.fully_eval()
-    assert stdlib.index(t2)(stdlib.integer(0)).fully_eval() == d.fully_eval()
-    assert stdlib.index(t2)(stdlib.integer(1)).fully_eval() == c.fully_eval()
+    assert dsl.index(t2)(dsl.integer(0)).fully_eval() == d.fully_eval()
+    assert dsl.index(t2)(dsl.integer(1)).fully_eval() == c.fully_eval()
     assert t3.fully_eval() == t.fully_eval()
 
 
 def test_concat():
-    a = stdlib.constant('a')
-    b = stdlib.constant('b')
-    c = stdlib.constant('c')
-    d = stdlib.constant('d')
-    t1 = stdlib.cons(a, stdlib.empty)
-    t2 = stdlib.list_term((b, c, d))
-    t = stdlib.concat(t1, t2)
+    a = dsl.constant('a')
+    b = dsl.constant('b')
+    c = dsl.constant('c')
+    d = dsl.constant('d')
+    t1 = dsl.cons(a, dsl.empty)
+    t2 = dsl.list_term((b, c, d))
+    t = dsl.concat(t1, t2)
     assert t(0).fully_eval() == a.fully_eval()
     assert t(1).fully_eval() == b.fully_eval()
     assert t(2).fully_eval() == c.fully_eval()
@@ -35,50 +36,88 @@ def test_concat():
 
 
 def test_integer():
-    i1 = stdlib.integer(1)
-    i2 = stdlib.integer(1)
-    i = stdlib.plus(i1)(i2)
+    i1 = dsl.integer(1)
+    i2 = dsl.integer(1)
+    i = dsl.plus(i1)(i2)
     assert i.fully_eval().value == 2
 
 
 def test_fold():
-    i1 = stdlib.integer(1)
-    i2 = stdlib.integer(1)
-    ll = stdlib.cons(i1)(stdlib.cons(i2)(stdlib.empty))
-    i = stdlib.integer_sum(ll)
+    i1 = dsl.integer(1)
+    i2 = dsl.integer(1)
+    ll = dsl.cons(i1)(dsl.cons(i2)(dsl.empty))
+    i = dsl.integer_sum(ll)
     assert i.fully_eval().value == 2
 
 
+def test_fold_family():
+    x = dsl.variable('x')
+    y = dsl.variable('y')
+    ll = dsl.list_term(tuple(dsl.integer(i) for i in range(100)))
+    pair = lambda_abs_vars((x, y), dsl.list_term((x, y)))
+    assert dsl.foldr(plus)(dsl.integer(0))(ll).fully_eval().value == 4950
+    assert dsl.foldl(plus)(dsl.integer(0))(ll).fully_eval().value == 4950
+    assert dsl.foldl_strict(lambda_abs_vars((x, y), plus(y)(x)))(dsl.integer(0))(ll).fully_eval().value == 4950
+    short = dsl.list_term((dsl.integer(1), dsl.integer(2)))
+    assert dsl.foldr(pair)(dsl.integer(0))(short).fully_eval() == \
+        dsl.list_term((dsl.integer(1), dsl.list_term((dsl.integer(2), dsl.integer(0))))).fully_eval()
+    assert dsl.foldl(pair)(dsl.integer(0))(short).fully_eval() == \
+        dsl.list_term((dsl.list_term((dsl.integer(0), dsl.integer(1))), dsl.integer(2))).fully_eval()
+    assert dsl.list_all(lambda_abs(x, dsl.equal(x)(x)))(ll).fully_eval().value
+    assert not dsl.list_all(lambda_abs(x, dsl.equal(x)(dsl.integer(0))))(ll).fully_eval().value
+
+
+def test_fold_steps():
+    a = dsl.constant('a')
+    ll = dsl.list_term(tuple(dsl.integer(i) for i in range(100)))
+    for fold in (dsl.foldr, dsl.foldl, dsl.foldl_strict):
+        for engine in ('substitution', 'machine', 'need', 'nbe'):
+            with pytest.raises(pgsn_term.LambdaInterpreterError):
+                fold(plus)(dsl.integer(0))(ll).fully_eval(steps=50, engine=engine)
+    # integer_sum is a right fold, which adds the integers after a stuck element
+    one, two = dsl.integer(1), dsl.integer(2)
+    mixed = dsl.list_term((one, a, two, dsl.integer(3)))
+    assert dsl.integer_sum(mixed).fully_eval() == plus(one)(plus(a)(dsl.integer(5))).remove_name()
+    # The strict left fold proceeds on an accumulator which has no further reduction step
+    g = dsl.constant('g')
+    funs = (plus, lambda_abs_vars((x, y), plus(x)), lambda_abs_vars((x, y), g(x)))
+    for fun in funs:
+        for ll in (dsl.list_term((one, two)), dsl.list_term((one, a, two))):
+            expected = dsl.foldl(fun)(dsl.integer(0))(ll).fully_eval()
+            for engine in ('substitution', 'machine', 'need', 'nbe'):
+                assert dsl.foldl_strict(fun)(dsl.integer(0))(ll).fully_eval(engine=engine) == expected
+
+
 def test_map():
-    i1 = stdlib.integer(1)
-    i2 = stdlib.integer(2)
-    ll = stdlib.cons(i1)(stdlib.cons(i2)(stdlib.empty))
-    plus_one = stdlib.plus(i1)
-    ll_1 = stdlib.map_term(plus_one)(ll)
+    i1 = dsl.integer(1)
+    i2 = dsl.integer(2)
+    ll = dsl.cons(i1)(dsl.cons(i2)(dsl.empty))
+    plus_one = dsl.plus(i1)
+    ll_1 = dsl.map_term(plus_one)(ll)
     assert len(ll_1.fully_eval().terms) == 2
     assert ll_1.fully_eval().terms[0].value == 2
     assert ll_1.fully_eval().terms[1].value == 3
 
 
 def test_multi_arg_function():
-    x = stdlib.variable('x')
-    y = stdlib.variable('y')
-    a = stdlib.variable('a')
-    b = stdlib.variable('b')
-    default = stdlib.integer(1)
-    defaults = stdlib.record({'b': default})
-    f = lambda_abs_vars((x, y), lambda_abs_keywords(arguments={'a': a, 'b': b}, defaults=defaults, body=stdlib.plus(x)(b)))
-    f1 = lambda_abs(x, lambda_abs_keywords(arguments={'a': a}, defaults=stdlib.empty_record, body=stdlib.plus(x)(a)))
-    zero = stdlib.integer(0)
-    one = stdlib.integer(1)
-    two = stdlib.integer(2)
-    three = stdlib.integer(2)
-    r = stdlib.record({'a': zero})
+    x = dsl.variable('x')
+    y = dsl.variable('y')
+    a = dsl.variable('a')
+    b = dsl.variable('b')
+    default = dsl.integer(1)
+    defaults = dsl.record({'b': default})
+    f = lambda_abs_vars((x, y), lambda_abs_keywords(arguments={'a': a, 'b': b}, defaults=defaults, body=dsl.plus(x)(b)))
+    f1 = lambda_abs(x, lambda_abs_keywords(arguments={'a': a}, defaults=dsl.empty_record, body=dsl.plus(x)(a)))
+    zero = dsl.integer(0)
+    one = dsl.integer(1)
+    two = dsl.integer(2)
+    three = dsl.integer(2)
+    r = dsl.record({'a': zero})
     assert f1(one)(r).fully_eval().value == 1
     assert f(one)(two)(r).fully_eval().value == 2
-    r1 = stdlib.record({'a': zero, 'b': zero})
+    r1 = dsl.record({'a': zero, 'b': zero})
     assert f(one)(two)(r1).fully_eval().value == 1
-    r2 = stdlib.record({})
+    r2 = dsl.record({})
     assert isinstance(f1(one)(two)(r2).fully_eval(), pgsn_term.App)
     assert f1(one, a=zero).fully_eval().value == 1
     assert f(one, two, a=zero).fully_eval().value ==2
@@ -86,18 +125,18 @@ def test_multi_arg_function():
 
 
 def test_let():
-    x = stdlib.variable('x')
-    identity = stdlib.lambda_abs(x, x)
+    x = dsl.variable('x')
+    identity = dsl.lambda_abs(x, x)
     t = x(x)
-    t1 = stdlib.let(x, identity, t)
+    t1 = dsl.let(x, identity, t)
     assert t1.fully_eval() == identity.fully_eval()
 
 
 def test_let2():
-    x = stdlib.variable('x')
-    y = stdlib.variable('y')
-    one = stdlib.integer(1)
-    two = stdlib.integer(2)
+    x = dsl.variable('x')
+    y = dsl.variable('y')
+    one = dsl.integer(1)
+    two = dsl.integer(2)
     t = lambda_abs_vars((x, y),
                         (lambda_abs(x, plus(x)(y))(plus(x)(x)))
                         )
@@ -111,44 +150,44 @@ def test_let2():
 
 
 def test_bool():
-    c = stdlib.constant('c')
-    d = stdlib.constant('d')
-    true = stdlib.boolean(True)
-    false = stdlib.boolean(False)
-    assert stdlib.if_then_else(true)(c)(d).fully_eval() == c.fully_eval()
-    assert stdlib.if_then_else(false)(c)(d).fully_eval() == d.fully_eval()
-    assert stdlib.guard(true)(c).fully_eval() == c.fully_eval()
-    assert stdlib.guard(false)(c).fully_eval() != c.fully_eval()
+    c = dsl.constant('c')
+    d = dsl.constant('d')
+    true = dsl.boolean(True)
+    false = dsl.boolean(False)
+    assert dsl.if_then_else(true)(c)(d).fully_eval() == c.fully_eval()
+    assert dsl.if_then_else(false)(c)(d).fully_eval() == d.fully_eval()
+    assert dsl.guard(true)(c).fully_eval() == c.fully_eval()
+    assert dsl.guard(false)(c).fully_eval() != c.fully_eval()
 
 
 def test_equal():
-    s1 = stdlib.string('s1')
-    s2 = stdlib.string('s2')
-    assert stdlib.equal(s1)(s1).fully_eval().value
-    assert not stdlib.equal(s1)(s2).fully_eval().value
+    s1 = dsl.string('s1')
+    s2 = dsl.string('s2')
+    assert dsl.equal(s1)(s1).fully_eval().value
+    assert not dsl.equal(s1)(s2).fully_eval().value
 
 
 def test_record():
-    zero = stdlib.integer(0)
-    one = stdlib.integer(1)
-    two = stdlib.integer(2)
-    a = stdlib.string('a')
-    b = stdlib.string('b')
-    c = stdlib.string('c')
-    r = stdlib.add_attribute(stdlib.empty_record)(a)(zero)
-    r = stdlib.add_attribute(r)(b)(one)
+    zero = dsl.integer(0)
+    one = dsl.integer(1)
+    two = dsl.integer(2)
+    a = dsl.string('a')
+    b = dsl.string('b')
+    c = dsl.string('c')
+    r = dsl.add_attribute(dsl.empty_record)(a)(zero)
+    r = dsl.add_attribute(r)(b)(one)
     assert isinstance(r.fully_eval(), pgsn_term.Record)
     assert r(b).fully_eval().value == 1
-    assert stdlib.has_label(r)(b).fully_eval().value
-    assert not stdlib.has_label(r)(c).fully_eval().value
-    assert stdlib.has_label(stdlib.remove_attribute(r)(b))(a).fully_eval().value
-    assert not stdlib.has_label(stdlib.remove_attribute(r)(b))(b).fully_eval().value
-    assert stdlib.list_labels(r).fully_eval() == pgsn_term.List.named(terms=(a, b)).fully_eval()
-    r1 = stdlib.record({'c': two})
-    assert stdlib.overwrite_record(r)(r1)(a).fully_eval().value == 0
-    assert stdlib.overwrite_record(r)(r1)(c).fully_eval().value == 2
-    r2 = stdlib.record({'b': two})
-    assert stdlib.overwrite_record(r)(r2)(b).fully_eval().value == 2
+    assert dsl.has_label(r)(b).fully_eval().value
+    assert not dsl.has_label(r)(c).fully_eval().value
+    assert dsl.has_label(dsl.remove_attribute(r)(b))(a).fully_eval().value
+    assert not dsl.has_label(dsl.remove_attribute(r)(b))(b).fully_eval().value
+    assert dsl.list_labels(r).fully_eval() == pgsn_term.List.named(terms=(a, b)).fully_eval()
+    r1 = dsl.record({'c': two})
+    assert dsl.overwrite_record(r)(r1)(a).fully_eval().value == 0
+    assert dsl.overwrite_record(r)(r1)(c).fully_eval().value == 2
+    r2 = dsl.record({'b': two})
+    assert dsl.overwrite_record(r)(r2)(b).fully_eval().value == 2
 
 
 class Id(pgsn_term.ConstMixin, pgsn_term.Unary):
@@ -163,80 +202,87 @@ class Id(pgsn_term.ConstMixin, pgsn_term.Unary):
 
 def test_pgsn_term_nested2():
     id_f = Id.named()
-    x = stdlib.variable('x')
-    y = stdlib.variable('y')
-    z = stdlib.variable('z')
-    a = stdlib.constant('a')
-    b = stdlib.constant('b')
-    label = stdlib.string('ll')
-    t = stdlib.lambda_abs_vars(
+    x = dsl.variable('x')
+    y = dsl.variable('y')
+    z = dsl.variable('z')
+    a = dsl.constant('a')
+    b = dsl.constant('b')
+    label = dsl.string('ll')
+    t = dsl.lambda_abs_vars(
         (x, y),
-        stdlib.let(x, id_f(x), id_f(x)))
+        dsl.let(x, id_f(x), id_f(x)))
     assert t(a)(b).fully_eval() == a.fully_eval()
     t2 = lambda_abs_vars((x, y), t(x)(y))
     assert t2(a)(b).fully_eval() == a.fully_eval()
-    t3 = stdlib.lambda_abs_vars(
+    t3 = dsl.lambda_abs_vars(
         (x, y),
-        stdlib.let(
-            x, stdlib.add_attribute(stdlib.empty_record)(label)(x),
-            stdlib.overwrite_record(x)(y)
+        dsl.let(
+            x, dsl.add_attribute(dsl.empty_record)(label)(x),
+            dsl.overwrite_record(x)(y)
         )
     )
-    r = stdlib.record({'a': a})
-    label_a = stdlib.string('a')
-    assert t3(stdlib.empty_record)(r)(label_a).fully_eval() == a.fully_eval()
-    assert stdlib.has_label(t3(stdlib.empty_record)(r))(label).fully_eval()
-    assert t3(stdlib.empty_record)(r)(label).fully_eval() == stdlib.empty_record.fully_eval()
+    r = dsl.record({'a': a})
+    label_a = dsl.string('a')
+    assert t3(dsl.empty_record)(r)(label_a).fully_eval() == a.fully_eval()
+    assert dsl.has_label(t3(dsl.empty_record)(r))(label).fully_eval()
+    assert t3(dsl.empty_record)(r)(label).fully_eval() == dsl.empty_record.fully_eval()
 
 
-x = stdlib.variable('x')
-y = stdlib.variable('y')
-z = stdlib.variable('z')
-f = stdlib.lambda_abs(x, x)
-label_a = stdlib.string('a')
-label_f = stdlib.string('f')
-r1 = stdlib.record({'a': stdlib.true})
-r2 = stdlib.record({'f': f})
-r3 = stdlib.add_attribute(stdlib.empty_record)(label_a)(stdlib.true)
-r4 = stdlib.add_attribute(stdlib.empty_record)(label_f)(f)
+x = dsl.variable('x')
+y = dsl.variable('y')
+z = dsl.variable('z')
+f = dsl.lambda_abs(x, x)
+label_a = dsl.string('a')
+label_f = dsl.string('f')
+r1 = dsl.record({'a': dsl.true})
+r2 = dsl.record({'f': f})
+r3 = dsl.add_attribute(dsl.empty_record)(label_a)(dsl.true)
+r4 = dsl.add_attribute(dsl.empty_record)(label_f)(f)
 
 
 def test_overwrite_record_fun():
-    assert set(stdlib.overwrite_record(r1)(stdlib.empty_record). \
+    assert set(dsl.overwrite_record(r1)(dsl.empty_record). \
                fully_eval().attributes().keys()) == {'a'}
-    assert set(stdlib.overwrite_record(r2)(stdlib.empty_record). \
+    assert set(dsl.overwrite_record(r2)(dsl.empty_record). \
                fully_eval().attributes().keys()) == {'f'}
 
 
-eta = stdlib.lambda_abs_vars((y, z), stdlib.overwrite_record(y)(z))
+eta = dsl.lambda_abs_vars((y, z), dsl.overwrite_record(y)(z))
 
 
 def test_overwrite_record_eta():
-    assert set(eta(r1)(stdlib.empty_record). \
+    assert set(eta(r1)(dsl.empty_record). \
                fully_eval().attributes().keys()) == {'a'}
-    assert set(eta(r2)(stdlib.empty_record). \
+    assert set(eta(r2)(dsl.empty_record). \
                fully_eval().attributes().keys()) == {'f'}
 
 
 def test_add_attribute_record_fun():
     assert set(r3.fully_eval().attributes().keys()) == {'a'}
     assert set(r4.fully_eval().attributes().keys()) == {'f'}
-    assert set(stdlib.add_attribute(r3)(label_a)(stdlib.true). \
+    assert set(dsl.add_attribute(r3)(label_a)(dsl.true). \
                fully_eval().attributes().keys()) == {'a'}
-    assert set(stdlib.add_attribute(r4)(label_f)(f). \
+    assert set(dsl.add_attribute(r4)(label_f)(f). \
                fully_eval().attributes().keys()) == {'f'}
 
 
 id_f = Id.named()
 
 def test_value_of():
-    assert src.pgsn.pgsn_term.value_of(stdlib.integer(1)) == 1
-    assert src.pgsn.pgsn_term.value_of(stdlib.true)
-    assert src.pgsn.pgsn_term.value_of(stdlib.string('hoge')) == 'hoge'
-    assert src.pgsn.pgsn_term.value_of(id_f(['gaga', 'piyo'])) == ['gaga', 'piyo']
-    assert src.pgsn.pgsn_term.value_of(id_f({'gaga':1, 'piyo':2})) == {'gaga':1, 'piyo':2}
+    assert pgsn_term.value_of(dsl.integer(1)) == 1
+    assert pgsn_term.value_of(dsl.true)
+    assert pgsn_term.value_of(dsl.string('hoge')) == 'hoge'
+    assert pgsn_term.value_of(id_f(['gaga', 'piyo'])) == ['gaga', 'piyo']
+    assert pgsn_term.value_of(id_f({'gaga':1, 'piyo':2})) == {'gaga':1, 'piyo':2}
 
 
 def test_format():
-    f_string = stdlib.string('{x}, {y}, {z}')
-    assert src.pgsn.pgsn_term.value_of(stdlib.format_string(f_string, {'x':1, 'y': 'hoge', 'z': [1, 2]})) == '1, hoge, [1, 2]'
+    f_string = dsl.string('{x}, {y}, {z}')
+    assert pgsn_term.value_of(dsl.format_string(f_string, {'x':1, 'y': 'hoge', 'z': [1, 2]})) == '1, hoge, [1, 2]'
+
+
+def test_python_value_steps():
+    xs = dsl.list_term([dsl.plus(dsl.integer(i))(dsl.integer(1)) for i in range(10)])
+    assert dsl.python_value(xs, steps=100) == list(range(1, 11))
+    with pytest.raises(pgsn_term.LambdaInterpreterError):
+        dsl.python_value(xs, steps=5)
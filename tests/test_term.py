@@ -1,4 +1,6 @@
-from src.pgsn import pgsn_term
+import pytest
+
+from pgsn import dsl, pgsn_term
 from pgsn.dsl import let, lambda_abs, lambda_abs_vars
 
 
@@ -14,40 +16,40 @@ def test_var():
 
 
 def test_pgsn_term_id():
-    x = stdlib.variable('x')
-    id_f = stdlib.lambda_abs(x, x)
+    x = dsl.variable('x')
+    id_f = dsl.lambda_abs(x, x)
     t = id_f(id_f)
     assert t.eval() == id_f.eval()
 
 
 def test_pgsn_term_const():
-    c = stdlib.constant('c')
-    x = stdlib.variable('x')
-    id_f = stdlib.lambda_abs(x, c)
+    c = dsl.constant('c')
+    x = dsl.variable('x')
+    id_f = dsl.lambda_abs(x, c)
     t = id_f(c)
     assert t.eval() == c.eval()
 
 
 def test_pgsn_term_nested():
-    x = stdlib.variable('x')
-    y = stdlib.variable('y')
-    z = stdlib.variable('z')
-    c = stdlib.constant('c')
-    d = stdlib.constant('d')
-    p1 = stdlib.lambda_abs(x, stdlib.lambda_abs(y, x))
-    t = stdlib.lambda_abs(y, stdlib.lambda_abs(x, p1(x)(y)))
+    x = dsl.variable('x')
+    y = dsl.variable('y')
+    z = dsl.variable('z')
+    c = dsl.constant('c')
+    d = dsl.constant('d')
+    p1 = dsl.lambda_abs(x, dsl.lambda_abs(y, x))
+    t = dsl.lambda_abs(y, dsl.lambda_abs(x, p1(x)(y)))
     assert t(c)(d).fully_eval() == d.fully_eval()
 
 
 def test_pgsn_term_higher_order():
-    x = stdlib.variable('x')
-    y = stdlib.variable('y')
-    z = stdlib.variable('z')
-    c = stdlib.constant('c')
-    d = stdlib.constant('d')
-    p1 = stdlib.lambda_abs(x, stdlib.lambda_abs(y, x))
+    x = dsl.variable('x')
+    y = dsl.variable('y')
+    z = dsl.variable('z')
+    c = dsl.constant('c')
+    d = dsl.constant('d')
+    p1 = dsl.lambda_abs(x, dsl.lambda_abs(y, x))
     assert p1(c)(d).fully_eval() == c.fully_eval()
-    t = stdlib.lambda_abs(y, y(c)(d))(p1)
+    t = dsl.lambda_abs(y, y(c)(d))(p1)
     assert t.fully_eval() == c.fully_eval()
 
 
@@ -63,43 +65,202 @@ class Id(pgsn_term.ConstMixin, pgsn_term.Unary):
 
 def test_builtin():
     id_f = Id.named().eval()
-    c = stdlib.constant('c').eval()
+    c = dsl.constant('c').eval()
     assert id_f.applicable_args((c,))
     assert id_f.apply_args((c,)) == (c, tuple())
+    assert id_f.apply_args_or_none((c,)) == c
     assert id_f(c).eval() == c
+    plus = dsl.plus.eval()
+    assert plus.apply_args_or_none((dsl.integer(1).eval(),)) is None
+    assert plus.apply_args_or_none((dsl.integer(1).eval(), c)) is None
 
 
 def test_higher_order2():
-    x = stdlib.variable('x')
-    y = stdlib.variable('y')
-    f = stdlib.variable('f')
-    a = stdlib.constant('a')
+    x = dsl.variable('x')
+    y = dsl.variable('y')
+    f = dsl.variable('f')
+    a = dsl.constant('a')
     id = lambda_abs(x, x)
-    g = stdlib.lambda_abs_vars((f, y), f(y))
+    g = dsl.lambda_abs_vars((f, y), f(y))
     assert g(id)(a).fully_eval() == a.fully_eval()
-    h = stdlib.lambda_abs(f, f(a))
+    h = dsl.lambda_abs(f, f(a))
     assert h(id).fully_eval() == a.fully_eval()
 
 
 def test_eta_expansion():
-    x = stdlib.variable('x')
-    y = stdlib.variable('y')
-    one = stdlib.integer(1)
-    two = stdlib.integer(2)
-    assert stdlib.plus(one)(two).fully_eval().value == 3
-    f = lambda_abs_vars((x, y), stdlib.plus(x)(y))
+    x = dsl.variable('x')
+    y = dsl.variable('y')
+    one = dsl.integer(1)
+    two = dsl.integer(2)
+    assert dsl.plus(one)(two).fully_eval().value == 3
+    f = lambda_abs_vars((x, y), dsl.plus(x)(y))
     assert f(one)(two).fully_eval().value == 3
 
 
 def test_self_reference():
-    x = stdlib.variable('x')
-    y = stdlib.variable('y')
-    one = stdlib.integer(1)
-    two = stdlib.integer(2)
+    x = dsl.variable('x')
+    y = dsl.variable('y')
+    one = dsl.integer(1)
+    two = dsl.integer(2)
     f = lambda_abs_vars((x, y),
                         let(
-                            x, stdlib.plus(x)(y),
-                            stdlib.plus(x)(y)
+                            x, dsl.plus(x)(y),
+                            dsl.plus(x)(y)
                         ))
     assert f(one)(two).fully_eval().value == 5
 
+
+x = dsl.variable('x')
+y = dsl.variable('y')
+z = dsl.variable('z')
+f = dsl.variable('f')
+c = dsl.constant('c')
+one = dsl.integer(1)
+
+
+def test_hash_consing():
+    pgsn_term.set_hash_consing(True)
+    try:
+        assert dsl.lambda_abs(x, x(c)) is dsl.lambda_abs(x, x(c))
+        t = dsl.lambda_abs(x, dsl.list_term((x, c)))(c).fully_eval()
+        assert t is dsl.list_term((c, c)).fully_eval()
+        var_x = pgsn_term.Variable.named(name='x', meta_info={'name': 'x'})
+        assert var_x is not x and var_x == x
+        assert pgsn_term.same_term(var_x, x)
+    finally:
+        pgsn_term.set_hash_consing(False)
+
+
+def test_normal_form_cache():
+    double = lambda_abs(x, dsl.plus(x)(x))
+    t = dsl.list_term((double(one), double(double(one))))
+    expected = t.fully_eval()
+    assert pgsn_term.normal_form_cache_stats() is None
+    pgsn_term.set_normal_form_cache(True)
+    try:
+        assert t.fully_eval(engine='substitution') == expected
+        stats = pgsn_term.normal_form_cache_stats()
+        assert stats['misses'] > 0
+        assert t.fully_eval(steps=1) == expected
+        assert pgsn_term.normal_form_cache_stats()['hits'] == stats['hits'] + 1
+        assert dsl.list_term((t, t)).fully_eval(steps=2).terms == (expected, expected)
+        assert t.fully_eval(engine='machine') == expected
+        pgsn_term.set_normal_form_cache(True, max_entries=2)
+        for i in range(3):
+            assert double(dsl.integer(i)).fully_eval().value == 2 * i
+        stats = pgsn_term.normal_form_cache_stats()
+        assert stats['entries'] == 2 and stats['evictions'] > 0
+        # Subterms which the reduction does not need are not normalized
+        omega = lambda_abs(x, x(x)(x))
+        t1 = dsl.head(lambda_abs(x, dsl.list_term((x, omega(omega))))(one))
+        assert t1.fully_eval(steps=1000) == one.fully_eval()
+    finally:
+        pgsn_term.set_normal_form_cache(False)
+
+
+def test_normal_form_marker():
+    t = dsl.list_term((one, lambda_abs(x, x)(one))).remove_name()
+    assert not t._normal_cache
+    normal = t.fully_eval()
+    assert normal.eval_or_none() is None
+    assert normal._normal_cache and not t._normal_cache
+
+
+def test_whnf():
+    omega = lambda_abs(x, x(x)(x))
+    t = lambda_abs(x, dsl.list_term((dsl.plus(x)(x), omega(omega))))(one)
+    whnf = t.whnf(steps=10)
+    assert isinstance(whnf, pgsn_term.List)
+    assert whnf.terms[0] == dsl.plus(one)(one).remove_name()
+    assert dsl.head(t).whnf(steps=10).value == 2
+    assert pgsn_term.value_of(dsl.head(t), steps=10) == 2
+    with pytest.raises(pgsn_term.LambdaInterpreterError):
+        t.fully_eval(steps=100)
+
+
+def test_to_python():
+    shared = dsl.record({'a': dsl.plus(one)(one)})
+    t = dsl.list_term((shared, shared, lambda_abs(x, x)(shared)))
+    value = pgsn_term.value_of(t, steps=5)
+    assert value == [{'a': 2}] * 3
+    assert value[0] is value[1]
+    deep = dsl.list_term(tuple(dsl.integer(i) for i in range(2000)))
+    for _ in range(2000):
+        deep = dsl.list_term((deep,))
+    assert pgsn_term.value_of(deep, steps=1)
+    with pytest.raises(pgsn_term.LambdaInterpreterError):
+        pgsn_term.value_of(t, steps=2)
+
+
+def test_closed():
+    t = dsl.lambda_abs(x, x(y))
+    assert t.free_variables() == {'y'}
+    assert not t.is_closed
+    assert dsl.lambda_abs(y, t).is_closed
+    nameless = t.remove_name()
+    assert nameless.free_indices() == {0}
+    assert nameless.max_free_index() == 0
+    assert nameless.shift(1, 0).free_indices() == {1}
+    assert nameless.shift_or_none(1, 1) is None
+    assert nameless.subst_or_none(1, c.remove_name()) is None
+    assert nameless.subst(0, c.remove_name()).is_closed
+    closed = dsl.lambda_abs(y, t).remove_name()
+    assert closed.shift_or_none(1, 0) is None
+
+
+def test_remove_name():
+    t = lambda_abs(x, lambda_abs(y, lambda_abs(x, f(x)(y))))
+    assert t.remove_name() is t.remove_name()
+    assert t.remove_name().t.t.t == f(x)(y).remove_name_with_context(['x', 'y', 'x', 'f'])
+    assert t.remove_name().t.t.t.free_indices() == {0, 1, 3}
+    with pytest.raises(ValueError):
+        f(x).remove_name_with_context(['f'])
+
+
+def test_instantiate():
+    bodies = [x, y, f(x)(y), lambda_abs(z, z(x)(y)(f)), lambda_abs(y, lambda_abs(z, f(x)(y)(z)))(x),
+              dsl.list_term((x, lambda_abs(z, dsl.record({'a': x(z), 'b': y}))))]
+    args = [dsl.constant('c'), y, lambda_abs(z, z(y)), f(y)]
+    for body in bodies:
+        for arg in args:
+            t = lambda_abs(x, body)(arg)
+            names = pgsn_term.naming_context(t.free_variables())
+            nameless = t.remove_name_with_context(names)
+            redex_body, redex_arg = nameless.t1.t, nameless.t2
+            expected = redex_body.subst(0, redex_arg.shift(1, 0)).shift(-1, 0)
+            assert redex_body.instantiate(redex_arg) == expected
+
+
+def test_deep_term():
+    t = x
+    for _ in range(5000):
+        t = c(t)
+    f = lambda_abs(x, t)
+    assert f.is_closed
+    body = f.remove_name().t
+    assert body.free_indices() == {0}
+    assert body.shift(1, 0).max_free_index() == 1
+    assert body.subst(0, c.remove_name()).is_closed
+
+
+def test_context():
+    c = dsl.constant('c').remove_name()
+    d = dsl.constant('d').remove_name()
+    id_f = dsl.lambda_abs(x, x).remove_name()
+    context = pgsn_term.Context.build(head=id_f(c)(d), args=())
+    assert context.head == id_f
+    assert tuple(context.args) == (c, d)
+    reduced = context.reduce_or_none()
+    assert reduced.head == c
+    assert reduced.args is context.args.rest
+    assert reduced.to_term() == c(d)
+
+
+def test_unchecked():
+    f = lambda_abs_vars((x, y), dsl.plus(x)(y))
+    assert f(one)(one).fully_eval(checked=False) == f(one)(one).fully_eval()
+    assert pgsn_term.value_of(f(one)(one), checked=False) == 2
+    with pgsn_term.checked_mode(False):
+        assert pgsn_term.String.nameless(value=None).value is None
+    with pytest.raises(AssertionError):
+        pgsn_term.String.nameless(value=None)